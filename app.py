@@ -4,13 +4,19 @@ Streamlit AIコンシェルジュアプリ
 """
 import streamlit as st
 import os
-import base64
-from typing import Optional
+import time
+import uuid
+from typing import Dict, Iterator, Optional
 from dotenv import load_dotenv
-from services.llm import generate_response, initialize_gemini
-from services.sheets import load_course_data
-from services.knowledge import resolve_guidelines
-from config import get_gemini_api_key
+from services.sheets import get_course_catalog
+from services.conversation import ConversationContext, ConversationState
+from services.pipeline import respond_stream
+from services.assets import AssetBundle, build_asset_bundle, config_hash, get_asset_registry
+from services.knowledge import get_guideline_store, resolve_guidelines
+from services.metrics import configure_metrics, get_metrics, record_stage, stage, trace
+from services.router import get_query_router
+from services.warmup import get_prewarmer, start_prewarm
+from config import get_admin_panel_enabled, get_gemini_api_key, reload_settings
 
 
 # ============================================================================
@@ -60,7 +66,13 @@ TEXTS = {
     "submit_button": "シップちゃんに案内してもらう",
     "footer": "© ねんねママのファミリーシップ",
     "loading_message": "考えています...",
-    "error_message": "エラーが発生しました: {error}",
+    "error_message": "エラーが発生しました: {error}（問い合わせ番号: {trace_id}）",
+    "show_more": "以前のメッセージを表示（残り{count}件）",
+}
+
+# チャット履歴の表示設定
+CHAT_HISTORY = {
+    "page_size": 20,  # 一度に表示するメッセージ数（古いものは「以前のメッセージを表示」で追加表示）
 }
 
 # サイドバー設定
@@ -103,38 +115,56 @@ def get_assets_dir() -> str:
     return os.path.join(os.path.dirname(__file__), "assets")
 
 
-def get_custom_icon(role: str) -> Optional[str]:
+# デザイン設定から求めたアセットのバージョン（設定はこのファイルの定数のため、スクリプトの実行ごとに一度だけ求める）
+_asset_version: Optional[str] = None
+
+
+def get_asset_version() -> str:
     """
-    カスタムアイコンを取得する
+    デザイン設定（COLORS・DESIGN・ICONS・RESPONSIVE）とアセットディレクトリから求めたバージョンを取得する
     
-    Args:
-        role: ロール名（"user" または "assistant"）
+    Returns:
+        str: アセットのバージョン
+    """
+    global _asset_version
+    if _asset_version is None:
+        _asset_version = config_hash(get_assets_dir(), COLORS, DESIGN, ICONS, RESPONSIVE)
+    return _asset_version
+
+
+def get_asset_bundle() -> AssetBundle:
+    """
+    事前処理済みのアセット（圧縮したCSS・ロゴとアイコンのパス）を取得する
+    デザイン設定が変わらない限り、2回目以降はメモリ上のものを返す
     
     Returns:
-        str | None: アイコンファイルのパス、存在しない場合はNone
+        AssetBundle: アセット
     """
     assets_dir = get_assets_dir()
-    icon_path = os.path.join(assets_dir, ICONS.get(f"{role}_icon", f"{role}_icon.png"))
-    if os.path.exists(icon_path):
-        return icon_path
-    return None
+    version = get_asset_version()
+    return get_asset_registry().get(
+        version,
+        lambda: build_asset_bundle(
+            version,
+            assets_dir,
+            generate_css(),
+            ICONS["logo_candidates"],
+            {"user": ICONS["user_icon"], "assistant": ICONS["assistant_icon"]},
+        ),
+    )
 
 
-def _get_image_base64(image_path: str) -> str:
+def get_custom_icon(role: str) -> Optional[str]:
     """
-    画像ファイルをbase64エンコードして返す
+    カスタムアイコンを取得する
     
     Args:
-        image_path: 画像ファイルのパス
+        role: ロール名（"user" または "assistant"）
     
     Returns:
-        str: base64エンコードされた画像データ
+        str | None: アイコンファイルのパス、存在しない場合はNone
     """
-    try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode()
-    except Exception:
-        return ""
+    return get_asset_bundle().icon(role)
 
 
 # ============================================================================
@@ -148,13 +178,11 @@ def render_logo() -> bool:
     Returns:
         bool: ロゴが表示された場合はTrue、そうでない場合はFalse
     """
-    assets_dir = get_assets_dir()
-    for logo_filename in ICONS["logo_candidates"]:
-        logo_path = os.path.join(assets_dir, logo_filename)
-        if os.path.exists(logo_path):
-            st.image(logo_path, width=DESIGN["logo_width"])
-            st.session_state.logo_loaded = True
-            return True
+    logo_path = get_asset_bundle().logo_path
+    if logo_path:
+        st.image(logo_path, width=DESIGN["logo_width"])
+        st.session_state.logo_loaded = True
+        return True
     st.session_state.logo_loaded = False
     return False
 
@@ -172,6 +200,32 @@ def render_sidebar():
     examples_text = "\n    - ".join([""] + SIDEBAR["examples"])
     st.markdown(examples_text)
 
+    if get_admin_panel_enabled():
+        render_admin_panel()
+
+
+def render_admin_panel():
+    """
+    管理パネル（段階ごとの処理時間・カウンター・直近のトレース）を表示する
+    設定 ADMIN_PANEL が有効な場合だけ表示する
+    """
+    metrics = get_metrics().snapshot()
+    with st.expander("📊 処理時間とメトリクス"):
+        st.markdown("**段階ごとの処理時間（ミリ秒）**")
+        st.json(metrics["stages"], expanded=False)
+        st.markdown("**カウンター**")
+        st.json(metrics["counters"], expanded=False)
+        st.markdown("**ガイドライン**")
+        st.json(get_guideline_store().stats(), expanded=False)
+        st.markdown("**起動時の事前準備**")
+        st.json(get_prewarmer().status(), expanded=False)
+        st.markdown("**ファストパス / LLM**")
+        st.json(get_query_router().stats(), expanded=False)
+        st.markdown("**直近のトレース**")
+        st.json(metrics["recent_traces"][-5:], expanded=False)
+        if st.button("設定を再読み込み", key="reload_settings"):
+            reload_settings()
+
 
 def render_header():
     """
@@ -185,19 +239,65 @@ def render_header():
     render_logo()
 
 
+def chat_message_container(role: str):
+    """
+    ロールに応じたアイコン付きのチャットメッセージ枠を返す
+    
+    Args:
+        role: ロール名（"user" または "assistant"）
+    """
+    icon_path = get_custom_icon(role)
+    if icon_path:
+        return st.chat_message(role, avatar=icon_path)
+    return st.chat_message(role)
+
+
+def new_message(role: str, content: str, **extra) -> Dict:
+    """
+    チャット履歴に追加するメッセージを作る（表示のキャッシュに使うIDを付ける）
+    
+    Args:
+        role: ロール名（"user" または "assistant"）
+        content: メッセージ本文
+    
+    Returns:
+        dict: メッセージ
+    """
+    return {"id": uuid.uuid4().hex[:12], "role": role, "content": content, **extra}
+
+
+def render_message(message: Dict):
+    """
+    1件のメッセージを表示する
+    
+    Args:
+        message: チャット履歴のメッセージ
+    """
+    with chat_message_container(message["role"]):
+        st.markdown(message["content"])
+
+
+def _show_more_history():
+    st.session_state.history_limit += CHAT_HISTORY["page_size"]
+
+
 def render_chat_history():
     """
     チャット履歴を表示する
+    直近の history_limit 件だけを描画し、それより古いメッセージは「以前のメッセージを表示」で追加表示する
     """
-    if st.session_state.messages:
-        for message in st.session_state.messages:
-            icon_path = get_custom_icon(message["role"])
-            if icon_path:
-                with st.chat_message(message["role"], avatar=icon_path):
-                    st.markdown(message["content"])
-            else:
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
+    messages = st.session_state.messages
+    if not messages:
+        return
+    hidden = max(len(messages) - st.session_state.history_limit, 0)
+    if hidden:
+        st.button(
+            TEXTS["show_more"].format(count=hidden),
+            key="show_more_history",
+            on_click=_show_more_history,
+        )
+    for message in messages[hidden:]:
+        render_message(message)
 
 
 def render_input_form():
@@ -229,7 +329,7 @@ def render_input_form():
 
 def generate_css() -> str:
     """
-    CSSスタイルを生成する
+    CSSスタイルを生成する（画面では get_asset_bundle() で圧縮・キャッシュしたものを使う）
     
     Returns:
         str: CSSスタイルの文字列
@@ -666,26 +766,29 @@ div:has(img[src*="concierge_logo"]) img {{
 # ロジック関数（AIとの通信部分）
 # ============================================================================
 
-@st.cache_data
 def get_course_data():
     """
-    講座データを取得する（キャッシュ機能付き）
+    講座データを取得する
+    Google Sheetsの変更はバックグラウンドで定期的に反映される（COURSE_REFRESH_INTERVAL_SECONDS）
     
     Returns:
-        str | None: CSV形式の講座データ、取得できない場合はNone
+        CourseCatalog | None: 講座カタログ、取得できない場合はNone
     """
-    return load_course_data()
+    with stage("course_data_load"):
+        return get_course_catalog()
 
 
-@st.cache_data
-def get_default_guidelines():
+def get_guidelines():
     """
-    デフォルトのガイドラインを取得する（キャッシュ機能付き）
+    このセッションで使うガイドラインを取得する
+    アップロードされたものがなければデフォルト（data/guidelines.md）を使う。
+    デフォルトのファイルは変更された場合だけ読み直す（services/knowledge.py）
     
     Returns:
-        str: ガイドラインテキスト
+        GuidelineDocument | None: ガイドライン
     """
-    return resolve_guidelines()
+    with stage("guideline_resolve"):
+        return resolve_guidelines(st.session_state.get("guidelines"))
 
 
 def initialize_session_state():
@@ -695,17 +798,24 @@ def initialize_session_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
     if "guidelines" not in st.session_state:
-        st.session_state.guidelines = get_default_guidelines()
+        # アップロードされたガイドライン（なければデフォルトを使う）
+        st.session_state.guidelines = None
     if "logo_loaded" not in st.session_state:
         st.session_state.logo_loaded = False
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = ConversationState()
+    if "history_limit" not in st.session_state:
+        st.session_state.history_limit = CHAT_HISTORY["page_size"]
 
 
-def process_user_message(user_input: str) -> str:
+def process_user_message(user_input: str, conversation: Optional[ConversationContext] = None) -> str:
     """
     ユーザーメッセージを処理し、AI応答を生成する
+    講座の場所を聞くだけの質問は、Geminiを呼ばずに定型文で答える（services/router.py）
     
     Args:
         user_input: ユーザーの入力テキスト
+        conversation: これまでの会話の文脈
     
     Returns:
         str: AIが生成した応答テキスト
@@ -713,32 +823,90 @@ def process_user_message(user_input: str) -> str:
     Raises:
         Exception: AI応答生成時にエラーが発生した場合
     """
-    course_data = get_course_data()
-    guidelines = st.session_state.get("guidelines")
-    return generate_response(user_input, course_data, guidelines)
+    with trace("chat"):
+        return "".join(process_user_message_stream(user_input, conversation))
+
+
+def process_user_message_stream(user_input: str, conversation: Optional[ConversationContext] = None) -> Iterator[str]:
+    """
+    ユーザーメッセージを処理し、AI応答をストリーミングで生成する
+    講座の場所を聞くだけの質問は、Geminiを呼ばずに定型文で答える（services/router.py）
+    
+    Args:
+        user_input: ユーザーの入力テキスト
+        conversation: これまでの会話の文脈
+    
+    Yields:
+        str: AIが生成した応答テキストのチャンク
+    """
+    return respond_stream(user_input, get_course_data(), get_guidelines(), conversation)
 
 
-def handle_form_submission(user_input: str):
+def handle_form_submission(user_input: str, chat_container):
     """
     フォーム送信を処理する
     
     Args:
         user_input: ユーザーの入力テキスト
+        chat_container: チャット履歴を表示しているコンテナ
+    """
+    with trace("chat") as current:
+        # これまでの会話から文脈を作る（今回のメッセージを追加する前の履歴を使う）
+        catalog = get_course_data()
+        conversation_state = st.session_state.conversation
+        conversation = conversation_state.build_context(user_input, st.session_state.messages, catalog)
+        
+        # ユーザーメッセージを履歴に追加して表示
+        user_message = new_message("user", user_input)
+        st.session_state.messages.append(user_message)
+        render_seconds = 0.0
+        with chat_container:
+            render_message(user_message)
+            
+            # AI応答を届いた順に表示
+            with chat_message_container("assistant"):
+                placeholder = st.empty()
+                placeholder.markdown(TEXTS["loading_message"])
+                response = ""
+                course_ids = []
+                try:
+                    for chunk in process_user_message_stream(user_input, conversation):
+                        response += chunk
+                        started = time.perf_counter()
+                        placeholder.markdown(response + "▌")
+                        render_seconds += time.perf_counter() - started
+                    course_ids = conversation_state.record_response(response, catalog)
+                except Exception as e:
+                    current.error = type(e).__name__
+                    response = TEXTS["error_message"].format(error=str(e), trace_id=current.trace_id)
+                placeholder.markdown(response)
+        record_stage("render", render_seconds)
+        st.session_state.messages.append(new_message("assistant", response, course_ids=course_ids))
+    # 新しい往復は表示済みの履歴の後ろに追加して描画したため、ここで再実行はしない
+    # （入力フォームは clear_on_submit でリセットされる。履歴の描き直しは次の操作のときだけ）
+
+
+# st.fragment（Streamlit 1.37以降）が使える場合は、チャット欄の操作でチャット欄だけを再実行する
+_fragment = getattr(st, "fragment", None)
+
+
+def render_chat_area():
     """
-    # ユーザーメッセージを履歴に追加
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    チャット履歴と入力フォームを表示し、送信を処理する
+    """
+    chat_container = st.container()
+    with chat_container:
+        render_chat_history()
     
-    # AI応答を生成
-    with st.spinner(TEXTS["loading_message"]):
-        try:
-            response = process_user_message(user_input)
-            st.session_state.messages.append({"role": "assistant", "content": response})
-        except Exception as e:
-            error_message = TEXTS["error_message"].format(error=str(e))
-            st.session_state.messages.append({"role": "assistant", "content": error_message})
+    # 入力フォームの表示と処理
+    user_input, submit_button = render_input_form()
     
-    # ページを再読み込みしてメッセージを表示
-    st.rerun()
+    if submit_button and user_input:
+        handle_form_submission(user_input, chat_container)
+
+
+if _fragment is not None:
+    render_chat_area = _fragment(render_chat_area)
 
 
 # ============================================================================
@@ -759,11 +927,18 @@ def main():
         layout="wide"
     )
     
+    # メトリクスの出力先の設定（METRICS_SINKS）
+    configure_metrics()
+    
+    # モデル解決・講座データの読み込み・索引の構築をバックグラウンドで開始（プロセスで一度だけ）
+    start_prewarm()
+    
     # セッション状態の初期化
     initialize_session_state()
     
     # APIキーの確認
-    api_key = get_gemini_api_key()
+    with stage("config_lookup"):
+        api_key = get_gemini_api_key()
     if not api_key:
         st.error("⚠️ エラー: GEMINI_API_KEY環境変数が設定されていません。")
         st.markdown("""
@@ -775,7 +950,7 @@ def main():
         st.stop()
     
     # CSSスタイルの適用
-    st.markdown(generate_css(), unsafe_allow_html=True)
+    st.markdown(get_asset_bundle().css, unsafe_allow_html=True)
     
     # サイドバーの表示
     with st.sidebar:
@@ -783,13 +958,7 @@ def main():
     
     # メインコンテンツの表示
     render_header()
-    render_chat_history()
-    
-    # 入力フォームの表示と処理
-    user_input, submit_button = render_input_form()
-    
-    if submit_button and user_input:
-        handle_form_submission(user_input)
+    render_chat_area()
 
 
 if __name__ == "__main__":
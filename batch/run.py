@@ -0,0 +1,346 @@
+"""
+質問のまとめて処理（バッチ実行）
+CSV / JSONL の質問を、チャット画面と同じ処理（services/pipeline.py）で並列に回答し、
+終わったものから順に JSONL に書き出す。途中で止めても --resume で続きから再開できる
+
+使い方:
+    python -m batch.run questions.csv --output answers.jsonl --workers 4 --rate 2
+    python -m batch.run questions.jsonl --output answers.jsonl --resume
+    python -m batch.run questions.csv --output answers.jsonl --fake   # 偽のGeminiで実行（APIキー不要）
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from config import reload_settings  # noqa: E402
+from services.knowledge import GuidelineDocument, get_guideline_store, resolve_guidelines  # noqa: E402
+from services.metrics import configure_metrics, trace  # noqa: E402
+from services.pipeline import respond_stream  # noqa: E402
+from services.router import get_query_router  # noqa: E402
+from services.sheets import load_course_data  # noqa: E402
+
+
+# CSVで質問として読む列（最初に見つかったもの。なければ1列目）
+QUESTION_COLUMNS = ("question", "質問", "user_input")
+
+# 処理待ちとして同時に抱えておく質問の数（ワーカー数に対する倍率）
+QUEUE_FACTOR = 2
+
+
+@dataclass(frozen=True)
+class BatchItem:
+    """1件の質問（id は出力の突き合わせと再開に使う）"""
+
+    id: str
+    question: str
+
+
+def read_questions(path: str) -> Iterator[BatchItem]:
+    """
+    質問のファイルを読み込む（拡張子が .jsonl / .json なら JSONL、それ以外はCSV）
+
+    JSONL は1行に {"id": ..., "question": ...}、CSV はヘッダー付きで QUESTION_COLUMNS のいずれかの列。
+    id がなければ行番号（1始まり）を使う。空の質問は読み飛ばす
+
+    Yields:
+        BatchItem
+    """
+    if path.endswith((".jsonl", ".json")):
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                question = str(record.get("question") or "").strip()
+                if question:
+                    yield BatchItem(str(record.get("id") or number), question)
+        return
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        column = next((name for name in QUESTION_COLUMNS if name in fields), fields[0] if fields else None)
+        if column is None:
+            return
+        for number, row in enumerate(reader, start=1):
+            question = (row.get(column) or "").strip()
+            if question:
+                yield BatchItem(str(row.get("id") or number), question)
+
+
+def prepare_resume(path: str, retry_errors: bool = False) -> Set[str]:
+    """
+    再開の準備として出力済みの JSONL を整理し、処理済みの id を返す
+
+    中断で途中まで書かれた行と、retry_errors のときはエラーになった質問の行を取り除いて書き直す
+    （やり直した結果を追記しても、同じ id の行が2つ残らないようにする）
+
+    Args:
+        path: 出力ファイル
+        retry_errors: True ならエラーになった質問は処理済みに含めず、出力からも取り除く
+
+    Returns:
+        処理済みの id
+    """
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    kept: List[str] = []
+    dropped = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断で途中まで書かれた行は処理済みとみなさない
+                dropped += 1
+                continue
+            if retry_errors and record.get("error"):
+                dropped += 1
+                continue
+            done.add(str(record.get("id")))
+            kept.append(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".batch-", suffix=".jsonl.tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, path)
+    return done
+
+
+class RateLimiter:
+    """1秒あたりの開始数を制限する（rate が0以下なら制限しない）"""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self) -> None:
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ResultWriter:
+    """結果を1件ずつ JSONL に追記する（書くたびにフラッシュする）"""
+
+    def __init__(self, path: Optional[str], append: bool):
+        self._lock = threading.Lock()
+        self._file = open(path, "a" if append else "w", encoding="utf-8") if path else sys.stdout
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class BatchRunner:
+    """
+    質問を並列に処理して結果を書き出す
+
+    - 同時に処理する数は workers、開始のペースは RateLimiter で制限する
+      （Geminiへの同時リクエスト数は別に GEMINI_MAX_CONCURRENCY で制限される）
+    - 読み込みは少しずつ行い、処理待ちの質問は workers × QUEUE_FACTOR 件までしか抱えない
+    - Ctrl+C で止めた場合は、処理中の質問を書き出してから終了する
+    """
+
+    def __init__(
+        self,
+        catalog: Any,
+        guidelines: Optional[GuidelineDocument],
+        writer: ResultWriter,
+        workers: int = 4,
+        rate: float = 0.0,
+        use_cache: bool = True,
+        structured: Optional[bool] = None,
+    ):
+        self._catalog = catalog
+        self._guidelines = guidelines
+        self._writer = writer
+        self._workers = max(workers, 1)
+        self._rate_limiter = RateLimiter(rate)
+        self._use_cache = use_cache
+        self._structured = structured
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.counts = {"done": 0, "errors": 0, "skipped": 0}
+
+    def _answer(self, item: BatchItem) -> None:
+        if self._stop.is_set():
+            return
+        self._rate_limiter.wait()
+        started = time.perf_counter()
+        record: Dict[str, Any] = {"id": item.id, "question": item.question}
+        with trace("batch", question_id=item.id) as current:
+            try:
+                chunks = respond_stream(
+                    item.question, self._catalog, self._guidelines, use_cache=self._use_cache, structured=self._structured
+                )
+                record["answer"] = "".join(chunks)
+                record["error"] = None
+            except Exception as e:
+                current.error = type(e).__name__
+                record["answer"] = None
+                record["error"] = f"{type(e).__name__}: {e}"
+            record["trace_id"] = current.trace_id
+        seconds = time.perf_counter() - started
+        record["latency_ms"] = round(seconds * 1000, 1)
+        self._writer.write(record)
+        with self._lock:
+            self.counts["errors" if record["error"] else "done"] += 1
+            self.latencies.append(seconds)
+
+    def run(self, items: Iterator[BatchItem], skip: Set[str]) -> None:
+        """質問を処理する（skip に含まれる id は処理しない）"""
+        slots = threading.BoundedSemaphore(self._workers * QUEUE_FACTOR)
+
+        def release(_future: Future) -> None:
+            slots.release()
+
+        executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="batch")
+        try:
+            for item in items:
+                if item.id in skip:
+                    self.counts["skipped"] += 1
+                    continue
+                slots.acquire()
+                executor.submit(self._answer, item).add_done_callback(release)
+        except KeyboardInterrupt:
+            self._interrupt()
+        finally:
+            # 投入し終えた後の待機中に Ctrl+C された場合も、まだ始まっていない質問は処理しない
+            while True:
+                try:
+                    executor.shutdown(wait=True)
+                    break
+                except KeyboardInterrupt:
+                    self._interrupt()
+
+    def _interrupt(self) -> None:
+        if not self._stop.is_set():
+            print("中断しました。処理中の質問を書き出しています…", file=sys.stderr)
+        self._stop.set()
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        """処理件数・応答時間・スループット"""
+        ordered = sorted(self.latencies)
+
+        def pick(ratio: float) -> float:
+            return ordered[min(int(ratio * len(ordered)), len(ordered) - 1)] * 1000 if ordered else 0.0
+
+        processed = self.counts["done"] + self.counts["errors"]
+        return dict(
+            self.counts,
+            elapsed_seconds=round(elapsed, 2),
+            throughput_per_minute=round(processed / elapsed * 60, 1) if elapsed else 0.0,
+            latency_ms={
+                "p50": pick(0.50),
+                "p95": pick(0.95),
+                "mean": statistics.fmean(ordered) * 1000 if ordered else 0.0,
+            },
+            router=get_query_router().stats(),
+        )
+
+
+def _limited(items: Iterator[BatchItem], limit: Optional[int]) -> Iterator[BatchItem]:
+    for position, item in enumerate(items):
+        if limit is not None and position >= limit:
+            return
+        yield item
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.fake:
+        # 偽のGeminiではAPIキーを使わないが、未設定だとエラーになるため仮の値を入れる
+        os.environ.setdefault("GEMINI_API_KEY", "batch-fake-key")
+        reload_settings()
+    configure_metrics()
+
+    if args.guidelines:
+        guidelines = get_guideline_store().load_file(args.guidelines, "batch")
+        if guidelines is None:
+            raise SystemExit(f"ガイドラインを読み込めません: {args.guidelines}")
+    else:
+        guidelines = resolve_guidelines()
+    catalog = load_course_data()
+
+    skip = prepare_resume(args.output, args.retry_errors) if args.resume and args.output else set()
+    writer = ResultWriter(args.output, append=args.resume)
+    runner = BatchRunner(
+        catalog, guidelines, writer, args.workers, args.rate, use_cache=not args.no_cache, structured=args.structured
+    )
+    items = _limited(read_questions(args.input), args.limit)
+
+    started = time.perf_counter()
+    try:
+        if args.fake:
+            # 偽のバックエンドは開発用（bench/）のため、--fake のときだけ読み込む
+            from bench.fake_genai import FakeGenAI, FakeGenAIConfig, use_fake_genai
+
+            config = FakeGenAIConfig(
+                first_chunk_latency=args.fake_first_chunk_ms / 1000,
+                chunk_latency=args.fake_chunk_ms / 1000,
+                error_rate=args.fake_error_rate,
+            )
+            with use_fake_genai(FakeGenAI(config, seed=0)):
+                runner.run(items, skip)
+        else:
+            runner.run(items, skip)
+    finally:
+        writer.close()
+    return runner.summary(time.perf_counter() - started)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CSV / JSONL の質問をまとめて回答する")
+    parser.add_argument("input", help="質問のファイル（.csv / .jsonl）")
+    parser.add_argument("--output", help="結果の JSONL の出力先（省略時は標準出力）")
+    parser.add_argument("--workers", type=int, default=4, help="同時に処理する質問の数")
+    parser.add_argument("--rate", type=float, default=0.0, help="1秒あたりに開始する質問の数の上限（0は制限なし）")
+    parser.add_argument("--resume", action="store_true", help="出力ファイルにある質問を飛ばして続きから再開する")
+    parser.add_argument("--retry-errors", action="store_true", help="--resume のとき、エラーになった質問をやり直す")
+    parser.add_argument("--limit", type=int, help="処理する質問の数の上限")
+    parser.add_argument("--guidelines", help="ガイドラインのファイル（省略時は data/guidelines.md）")
+    parser.add_argument("--no-cache", action="store_true", help="応答キャッシュを使わない（プロンプト変更の確認用）")
+    parser.add_argument(
+        "--structured", action=argparse.BooleanOptionalAction, default=None,
+        help="講座の提案をJSONで受け取る（省略時は GEMINI_STRUCTURED_OUTPUT に従う）",
+    )
+    parser.add_argument("--fake", action="store_true", help="偽のGeminiバックエンドで実行する（APIキー不要）")
+    parser.add_argument("--fake-first-chunk-ms", type=float, default=50, help="偽バックエンドの最初のチャンクまでの遅延")
+    parser.add_argument("--fake-chunk-ms", type=float, default=0, help="偽バックエンドのチャンクの間隔")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0, help="偽バックエンドが429を返す割合")
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error("--resume には --output が必要です")
+
+    summary = run(args)
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+google.generativeai の代わりに使うローカルの偽バックエンド
+ネットワークもAPIキーも使わずに、遅延とストリーミングの挙動を再現する（テスト・ベンチマーク・バッチのドライラン用。本番のコードからは読み込まない）
+"""
+import contextlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+DEFAULT_RESPONSE = (
+    "それは大変でしたね。毎日本当によく頑張っていらっしゃいますね。\n\n"
+    "お悩みに合いそうな講座をご案内します。\n\n"
+    "- 【講座タイトル】\n"
+    "  - おすすめの理由：講師の視点から、今日からできる関わり方を紹介しています。\n"
+    "  - 対象年齢：0～6歳\n"
+    "  - 視聴はこちら：https://example.com/\n"
+)
+
+
+@dataclass
+class FakeGenAIConfig:
+    """
+    偽バックエンドの挙動
+
+    first_chunk_latency: 最初のチャンクまでの遅延（秒）
+    chunk_latency: 2つ目以降のチャンクの間隔（秒）
+    chunks: 回答を分割するチャンク数
+    response_text: 回答テキスト
+    error_rate: 429（ResourceExhausted）を返す割合
+    models: list_models() が返すモデル名
+    supports_caching: コンテキストキャッシュに対応するかどうか
+    structured_response: JSONでの回答を求められたときの回答（Noneならプロンプトの講座IDから作る）
+    """
+
+    first_chunk_latency: float = 0.3
+    chunk_latency: float = 0.02
+    chunks: int = 20
+    response_text: str = DEFAULT_RESPONSE
+    error_rate: float = 0.0
+    models: Tuple[str, ...] = ("gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-flash")
+    supports_caching: bool = True
+    structured_response: Optional[str] = None
+
+
+# 構造化出力のプロンプトに含まれる講座IDの列（services/catalog.py の course_id）
+_COURSE_ID_PATTERN = re.compile(r"^(c[0-9a-f]{6}(?:-\d+)?),", re.MULTILINE)
+
+
+class ResourceExhausted(Exception):
+    """429 を模したエラー"""
+
+    code = 429
+
+
+class _Chunk:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _ModelInfo:
+    def __init__(self, name: str):
+        self.name = f"models/{name}"
+        self.supported_generation_methods = ["generateContent"]
+
+
+class FakeGenAI:
+    """
+    google.generativeai と同じ形の呼び出し口を持つ偽バックエンド
+
+    configure / list_models / GenerativeModel / caching.CachedContent を提供し、
+    呼び出し回数と受け取ったプロンプトの大きさを記録する
+    """
+
+    def __init__(self, config: Optional[FakeGenAIConfig] = None, seed: Optional[int] = None):
+        self.config = config or FakeGenAIConfig()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {"configure": 0, "list_models": 0, "models": 0, "generate": 0, "errors": 0, "cache_creates": 0}
+        self.prompt_chars: List[int] = []
+        self.GenerativeModel = self._model_class()
+        self.caching = self._caching_namespace()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+
+    def configure(self, api_key: Optional[str] = None, **_kwargs: Any) -> None:
+        self._count("configure")
+
+    def list_models(self) -> List[_ModelInfo]:
+        self._count("list_models")
+        return [_ModelInfo(name) for name in self.config.models]
+
+    def _chunks(self, text: str) -> List[str]:
+        count = max(self.config.chunks, 1)
+        size = max(len(text) // count, 1)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def _stream(self, text: str) -> Iterator[_Chunk]:
+        time.sleep(self.config.first_chunk_latency)
+        for position, piece in enumerate(self._chunks(text)):
+            if position:
+                time.sleep(self.config.chunk_latency)
+            yield _Chunk(piece)
+
+    def _structured_text(self, prompt: str) -> str:
+        if self.config.structured_response is not None:
+            return self.config.structured_response
+        recommendations = [
+            {"course_id": course_id, "reason": "お悩みに合わせた関わり方を紹介しています。"}
+            for course_id in _COURSE_ID_PATTERN.findall(prompt)[:2]
+        ]
+        return json.dumps(
+            {"empathy": "それは大変でしたね。毎日本当によく頑張っていらっしゃいますね。", "recommendations": recommendations},
+            ensure_ascii=False,
+        )
+
+    def _generate(self, model_name: str, prefix: str, prompt: Any, stream: bool, json_mode: bool = False) -> Any:
+        self._count("generate")
+        with self._lock:
+            self.prompt_chars.append(len(prefix) + len(str(prompt)))
+            failed = self._random.random() < self.config.error_rate
+        if failed:
+            self._count("errors")
+            raise ResourceExhausted("429 Resource exhausted (fake)")
+        if model_name not in self.config.models:
+            raise Exception(f"404 models/{model_name} is not found (fake)")
+        text = self._structured_text(str(prompt)) if json_mode else self.config.response_text
+        if stream:
+            return self._stream(text)
+        time.sleep(self.config.first_chunk_latency + self.config.chunk_latency * (self.config.chunks - 1))
+        return _Response(text)
+
+    def _model_class(self) -> type:
+        backend = self
+
+        class GenerativeModel:
+            def __init__(self, model_name: str, system_instruction: Optional[str] = None, **_kwargs: Any):
+                backend._count("models")
+                self.model_name = model_name.replace("models/", "")
+                self.system_instruction = system_instruction or ""
+
+            @classmethod
+            def from_cached_content(cls, cached_content: Any, **kwargs: Any) -> "GenerativeModel":
+                return cls(cached_content.model, system_instruction=cached_content.system_instruction, **kwargs)
+
+            def generate_content(
+                self, prompt: Any, stream: bool = False, generation_config: Any = None, **_kwargs: Any
+            ) -> Any:
+                if isinstance(generation_config, dict):
+                    mime_type = generation_config.get("response_mime_type")
+                else:
+                    mime_type = getattr(generation_config, "response_mime_type", None)
+                json_mode = mime_type == "application/json"
+                return backend._generate(self.model_name, self.system_instruction, prompt, stream, json_mode)
+
+        return GenerativeModel
+
+    def _caching_namespace(self) -> Any:
+        backend = self
+
+        class CachedContent:
+            def __init__(self, model: str, system_instruction: str):
+                self.model = model
+                self.system_instruction = system_instruction
+
+            @classmethod
+            def create(cls, model: str, system_instruction: str = "", **_kwargs: Any) -> "CachedContent":
+                if not backend.config.supports_caching:
+                    raise NotImplementedError("context caching is not supported (fake)")
+                backend._count("cache_creates")
+                return cls(model, system_instruction)
+
+            def delete(self) -> None:
+                pass
+
+        class Caching:
+            pass
+
+        Caching.CachedContent = CachedContent
+        return Caching
+
+    def stats(self) -> Dict[str, Any]:
+        """呼び出し回数とプロンプトの大きさ（文字数）"""
+        with self._lock:
+            prompts = list(self.prompt_chars)
+        return dict(
+            self.calls,
+            avg_prompt_chars=sum(prompts) / len(prompts) if prompts else 0,
+            max_prompt_chars=max(prompts) if prompts else 0,
+        )
+
+
+@contextlib.contextmanager
+def use_fake_genai(fake: FakeGenAI) -> Iterator[FakeGenAI]:
+    """
+    with ブロックの間、services.llm が使う genai を偽バックエンドに差し替える
+    モデル・コンテキストキャッシュは差し替えの前後で作り直す
+    """
+    from services import llm
+
+    original = llm.genai
+    llm.genai = fake
+    llm.reset_model_cache()
+    try:
+        yield fake
+    finally:
+        llm.genai = original
+        llm.reset_model_cache()
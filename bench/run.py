@@ -0,0 +1,307 @@
+"""
+チャット1回分の処理のベンチマーク
+偽のGeminiバックエンド（bench/fake_genai.py）に対して、講座データの読み込み・プロンプトの組み立て・
+モデル解決・エンドツーエンドの応答時間を計測し、JSONで出力する
+
+使い方:
+    python -m bench.run --scales 1,10,100 --concurrency 1,8,32 --requests 64 --output bench-results.json
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GEMINI_API_KEY", "bench-fake-key")
+
+from services.catalog import COURSE_COLUMNS, CourseCatalog  # noqa: E402
+from bench.fake_genai import FakeGenAI, FakeGenAIConfig, use_fake_genai  # noqa: E402
+from services.knowledge import resolve_guidelines  # noqa: E402
+from services.llm import _build_prompt_parts, get_model_resolver, reset_model_cache  # noqa: E402
+from services.metrics import get_metrics  # noqa: E402
+from services.pipeline import respond_stream  # noqa: E402
+from services.prompt_builder import PREFIX_SEPARATOR, estimate_tokens  # noqa: E402
+from services.router import get_query_router  # noqa: E402
+from services.search import get_search_index  # noqa: E402
+from services.sheets import load_from_default_csv  # noqa: E402
+from services.sheets_client import SheetsClientManager  # noqa: E402
+
+
+# 計測に使う質問（相談・講座の場所を聞く質問を混ぜる）
+QUESTIONS = [
+    "3ヶ月の夜泣きに効く講座を教えて",
+    "1歳半の離乳食が進まなくて困っています",
+    "イヤイヤ期の対応に悩んでいます",
+    "4歳の子と英語で遊びたい",
+    "発達が気になる、おうちでできる運動あそびはありますか",
+    "イヤイヤ期対応講座はどこ？",
+    "自己肯定感を育てる褒め方を知りたい",
+    "寝かしつけに1時間かかります",
+]
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99・平均・最大（ミリ秒）"""
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def pick(ratio: float) -> float:
+        return ordered[min(int(ratio * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "mean": statistics.fmean(ordered) * 1000,
+        "max": ordered[-1] * 1000,
+    }
+
+
+def timed(function: Callable[[], Any], repeat: int = 1) -> float:
+    """関数の平均実行時間（ミリ秒）"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def scaled_rows(scale: int) -> List[List[str]]:
+    """data/courses.csv の講座を scale 倍に増やした行（1行目はヘッダー、講座ごとにタイトルとURLを変える）"""
+    base = load_from_default_csv()
+    rows = [list(COURSE_COLUMNS)]
+    for copy in range(scale):
+        for course in base:
+            row = course.as_row()
+            if copy:
+                row[3] = f"{row[3]} ({copy})"
+                row[7] = f"{row[7]}&copy={copy}"
+            rows.append(row)
+    return rows
+
+
+def rows_to_csv(rows: List[List[str]]) -> str:
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue()
+
+
+class _FakeSpreadsheet:
+    lastUpdateTime = "2024-01-01T00:00:00Z"
+
+
+class _FakeWorksheet:
+    def __init__(self, rows: List[List[str]]):
+        self._rows = rows
+        self.spreadsheet = _FakeSpreadsheet()
+
+    def get_all_values(self) -> List[List[str]]:
+        return [list(row) for row in self._rows]
+
+    def get(self, _range: str) -> List[List[str]]:
+        return self.get_all_values()
+
+
+class _FakeSheetsClient:
+    def __init__(self, rows: List[List[str]]):
+        self._worksheet = _FakeWorksheet(rows)
+
+    def get_file_drive_metadata(self, _sheets_id: str) -> Dict[str, str]:
+        return {"modifiedTime": _FakeSpreadsheet.lastUpdateTime}
+
+    def open_by_key(self, _sheets_id: str) -> Any:
+        spreadsheet = _FakeSpreadsheet()
+        spreadsheet.sheet1 = self._worksheet
+        return spreadsheet
+
+
+def bench_catalog(scale: int) -> Dict[str, Any]:
+    """講座データの読み込み（CSV・スタブのgspread）とインデックス構築の時間"""
+    rows = scaled_rows(scale)
+    csv_text = rows_to_csv(rows)
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8") as f:
+        f.write(csv_text)
+        path = f.name
+    try:
+        started = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            catalog = CourseCatalog.from_csv_text(f.read(), source="bench")
+        csv_ms = (time.perf_counter() - started) * 1000
+    finally:
+        os.unlink(path)
+
+    manager = SheetsClientManager()
+    manager._credentials = object()
+    manager._client = _FakeSheetsClient(rows)
+    started = time.perf_counter()
+    values = manager.fetch_values("bench", header_columns=list(COURSE_COLUMNS))
+    CourseCatalog.from_rows(values, source="google_sheets")
+    sheets_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    get_search_index(catalog)
+    index_ms = (time.perf_counter() - started) * 1000
+    return {
+        "courses": len(catalog),
+        "csv_bytes": len(csv_text.encode("utf-8")),
+        "csv_load_ms": csv_ms,
+        "sheets_load_ms": sheets_ms,
+        "search_index_build_ms": index_ms,
+        "catalog": catalog,
+    }
+
+
+def bench_prompt(catalog: CourseCatalog, guidelines: str, repeat: int) -> Dict[str, Any]:
+    """プロンプトの組み立て時間と大きさ"""
+    sizes = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        prefix, request_part = _build_prompt_parts(QUESTIONS[i % len(QUESTIONS)], catalog, guidelines)
+        sizes.append(prefix + PREFIX_SEPARATOR + request_part)
+    build_ms = (time.perf_counter() - started) / repeat * 1000
+    return {
+        "build_ms": build_ms,
+        "avg_chars": statistics.fmean(len(prompt) for prompt in sizes),
+        "avg_bytes": statistics.fmean(len(prompt.encode("utf-8")) for prompt in sizes),
+        "avg_tokens": statistics.fmean(estimate_tokens(prompt) for prompt in sizes),
+    }
+
+
+def bench_model_resolution(repeat: int) -> Dict[str, float]:
+    """モデル解決の時間（初回とキャッシュ済み）"""
+    api_key = os.environ["GEMINI_API_KEY"]
+    reset_model_cache()
+    cold_ms = timed(lambda: get_model_resolver().get_model(api_key))
+    warm_ms = timed(lambda: get_model_resolver().get_model(api_key), repeat)
+    return {"cold_ms": cold_ms, "warm_ms": warm_ms}
+
+
+def bench_end_to_end(catalog: CourseCatalog, guidelines: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    """エンドツーエンドの応答時間（応答キャッシュは使わない）"""
+    latencies: List[float] = []
+    first_chunk: List[float] = []
+    errors: List[str] = []
+
+    def one(i: int) -> None:
+        started = time.perf_counter()
+        try:
+            chunks = respond_stream(QUESTIONS[i % len(QUESTIONS)], catalog, guidelines, use_cache=False)
+            for position, _chunk in enumerate(chunks):
+                if position == 0:
+                    first_chunk.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(type(e).__name__)
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "throughput_rps": requests / wall if wall else 0.0,
+        "first_chunk_ms": percentiles(first_chunk),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return ""
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    config = FakeGenAIConfig(
+        first_chunk_latency=args.first_chunk_ms / 1000,
+        chunk_latency=args.chunk_ms / 1000,
+        chunks=args.chunks,
+        error_rate=args.error_rate,
+        supports_caching=not args.no_context_cache,
+    )
+    fake = FakeGenAI(config, seed=0)
+    guidelines = resolve_guidelines() or ""
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "fake_genai": dict(vars(config), response_text=len(config.response_text)),
+            "args": vars(args),
+        },
+        "scales": [],
+    }
+    with use_fake_genai(fake):
+        results["model_resolution"] = bench_model_resolution(args.repeat)
+        for scale in args.scales:
+            catalog_result = bench_catalog(scale)
+            catalog = catalog_result.pop("catalog")
+            scale_result = {
+                "scale": scale,
+                "catalog": catalog_result,
+                "prompt": bench_prompt(catalog, guidelines, args.repeat),
+                "end_to_end": [
+                    bench_end_to_end(catalog, guidelines, concurrency, args.requests)
+                    for concurrency in args.concurrency
+                ],
+            }
+            results["scales"].append(scale_result)
+            print(
+                f"scale={scale:>5} courses={catalog_result['courses']:>6} "
+                f"csv={catalog_result['csv_load_ms']:.1f}ms prompt={scale_result['prompt']['build_ms']:.2f}ms "
+                + " ".join(
+                    f"c{run['concurrency']}:p50={run['latency_ms']['p50']:.0f}ms/p99={run['latency_ms']['p99']:.0f}ms"
+                    for run in scale_result["end_to_end"]
+                ),
+                file=sys.stderr,
+            )
+        results["fake_genai_calls"] = fake.stats()
+        results["router"] = get_query_router().stats()
+        metrics = get_metrics().snapshot()
+        results["metrics"] = {"stages": metrics["stages"], "counters": metrics["counters"]}
+    return results
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="チャット1回分の処理のベンチマーク（偽のGeminiバックエンドを使用）")
+    parser.add_argument("--scales", type=_int_list, default=[1, 10, 100], help="講座データを何倍にするか（カンマ区切り）")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32], help="同時リクエスト数（カンマ区切り）")
+    parser.add_argument("--requests", type=int, default=64, help="同時リクエスト数ごとのリクエスト数")
+    parser.add_argument("--repeat", type=int, default=50, help="プロンプト組み立て・モデル解決の繰り返し回数")
+    parser.add_argument("--first-chunk-ms", type=float, default=300, help="偽バックエンドの最初のチャンクまでの遅延")
+    parser.add_argument("--chunk-ms", type=float, default=20, help="偽バックエンドのチャンクの間隔")
+    parser.add_argument("--chunks", type=int, default=20, help="偽バックエンドの回答のチャンク数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="偽バックエンドが429を返す割合")
+    parser.add_argument("--no-context-cache", action="store_true", help="偽バックエンドをコンテキストキャッシュ非対応にする")
+    parser.add_argument("--output", help="結果のJSONの出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+起動時間のベンチマーク
+新しいプロセスで、モジュールの読み込み時間（python -X importtime）と、
+起動直後の最初のリクエストの応答時間（事前準備あり・なし）を計測し、JSONで出力する
+
+使い方:
+    python -m bench.startup --repeat 5 --output startup-results.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# 最初のリクエストに使う質問（LLMに回る相談）
+FIRST_QUESTION = "3ヶ月の夜泣きに効く講座を教えて"
+
+# python -X importtime の出力行（self / cumulative はマイクロ秒、名前の前の空白が深さ）
+_IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def _python(arguments: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable] + arguments,
+        cwd=ROOT,
+        env=dict(os.environ, **(env or {})),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_profile(module: str, top: int) -> Dict[str, Any]:
+    """
+    python -X importtime でモジュールの読み込み時間を調べる
+
+    Args:
+        module: 読み込むモジュール
+        top: 上位何件を出すか
+
+    Returns:
+        total_ms: 全体の読み込み時間
+        top_level: module が直接読み込むモジュールの累積時間（長い順）
+        top_self: 各モジュール自身の読み込み時間（長い順）
+    """
+    result = _python(["-X", "importtime", "-c", f"import {module}"])
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({
+                "module": name,
+                "depth": (len(indent) - 1) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            })
+    total = next((entry["cumulative_ms"] for entry in entries if entry["module"] == module), 0.0)
+    # module 自身の直下（深さ1）と、module と同時に読み込まれる深さ0のモジュール
+    top_level = [entry for entry in entries if entry["depth"] <= 1 and entry["module"] != module]
+    return {
+        "module": module,
+        "total_ms": total,
+        "top_level": sorted(top_level, key=lambda entry: -entry["cumulative_ms"])[:top],
+        "top_self": sorted(entries, key=lambda entry: -entry["self_ms"])[:top],
+    }
+
+
+def cold_import_ms(module: str, repeat: int) -> Dict[str, float]:
+    """新しいプロセスで module を読み込むまでの時間（ミリ秒、repeat 回の中央値・最小）"""
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    samples = [float(_python(["-c", code]).stdout.strip().splitlines()[-1]) * 1000 for _ in range(repeat)]
+    return {"median": statistics.median(samples), "min": min(samples)}
+
+
+def first_request(prewarm: bool, args: argparse.Namespace) -> Dict[str, Any]:
+    """新しいプロセスで、起動直後の最初のリクエストの応答時間を計測する（偽のGeminiを使用）"""
+    arguments = [
+        os.path.join("bench", "startup.py"), "--child",
+        "--fake-first-chunk-ms", str(args.fake_first_chunk_ms),
+    ]
+    if prewarm:
+        arguments.append("--prewarm")
+    env = {"GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "bench-fake-key"), "PREWARM": "1" if prewarm else "0"}
+    return json.loads(_python(arguments, env).stdout.strip().splitlines()[-1])
+
+
+def _child(args: argparse.Namespace) -> Dict[str, Any]:
+    """first_request() から起動される側。起動からの各時間を計測して返す"""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from bench.fake_genai import FakeGenAI, FakeGenAIConfig, use_fake_genai
+    from services.knowledge import resolve_guidelines
+    from services.pipeline import respond_stream
+    from services.sheets import get_course_catalog
+    from services.warmup import get_prewarmer, start_prewarm
+
+    result: Dict[str, Any] = {"prewarm": args.prewarm, "import_ms": (time.perf_counter() - started) * 1000}
+    fake = FakeGenAI(FakeGenAIConfig(first_chunk_latency=args.fake_first_chunk_ms / 1000, chunk_latency=0.0), seed=0)
+    with use_fake_genai(fake):
+        if args.prewarm:
+            prewarm_started = time.perf_counter()
+            start_prewarm()
+            get_prewarmer().wait()
+            result["prewarm_ms"] = (time.perf_counter() - prewarm_started) * 1000
+            result["prewarm_steps"] = get_prewarmer().status()["steps"]
+        for label in ("first_request", "second_request"):
+            request_started = time.perf_counter()
+            chunks = respond_stream(FIRST_QUESTION, get_course_catalog(), resolve_guidelines(), use_cache=False)
+            for position, _chunk in enumerate(chunks):
+                if position == 0:
+                    result[f"{label}_first_chunk_ms"] = (time.perf_counter() - request_started) * 1000
+            result[f"{label}_ms"] = (time.perf_counter() - request_started) * 1000
+    return result
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "import_profile": import_profile(args.module, args.top),
+        "cold_import_ms": cold_import_ms(args.module, args.repeat),
+        "first_request": {
+            "without_prewarm": first_request(False, args),
+            "with_prewarm": first_request(True, args),
+        },
+    }
+    cold = results["first_request"]["without_prewarm"]
+    warm = results["first_request"]["with_prewarm"]
+    print(
+        f"import {args.module}: {results['import_profile']['total_ms']:.0f}ms (importtime) "
+        f"{results['cold_import_ms']['median']:.0f}ms (wall) "
+        f"first request: {cold['first_request_ms']:.0f}ms -> {warm['first_request_ms']:.0f}ms with prewarm "
+        f"(prewarm {warm['prewarm_ms']:.0f}ms)",
+        file=sys.stderr,
+    )
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="起動時間と最初のリクエストの応答時間のベンチマーク")
+    parser.add_argument("--module", default="app", help="読み込み時間を計測するモジュール")
+    parser.add_argument("--top", type=int, default=15, help="読み込み時間の上位何件を出すか")
+    parser.add_argument("--repeat", type=int, default=5, help="読み込み時間の計測回数")
+    parser.add_argument("--fake-first-chunk-ms", type=float, default=0, help="偽バックエンドの最初のチャンクまでの遅延")
+    parser.add_argument("--output", help="結果のJSONの出力先（省略時は標準出力）")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--prewarm", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_child(args), ensure_ascii=False))
+        return 0
+
+    results = run(args)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,70 @@
 """
 設定管理
 Streamlit Secrets / 環境変数からAPIキーなどを読み込む
+
+設定は起動時に一度だけ読み込んで Settings（変更不可）として保持する。
+secrets.toml が変更された場合、または reload_settings() を呼んだ場合に読み込み直す
 """
 import os
+import sys
 import json
-from typing import Optional, Dict, Any
-import streamlit as st
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Mapping, Tuple, Callable
+
+# 変更を監視する Streamlit Secrets のファイル
+SECRETS_FILES = (
+    os.path.join(".streamlit", "secrets.toml"),
+    os.path.join("~", ".streamlit", "secrets.toml"),
+)
+
+# secrets.toml の変更を確認する間隔（秒）。これより短い間隔の呼び出しでは確認しない
+SETTINGS_CHECK_INTERVAL_SECONDS = 2.0
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    アプリ全体の設定（読み込み後は変更しない）
+
+    APIキー・認証情報は repr に出さない。
+    認証情報は読み取り専用の MappingProxyType で持ち、ハッシュには含めない（比較には含める）。
+    そのため Settings はキャッシュのキーや集合の要素にそのまま使える
+    """
+
+    gemini_api_key: Optional[str] = field(default=None, repr=False)
+    google_sheets_id: Optional[str] = None
+    google_sheets_credentials: Optional[Mapping[str, Any]] = field(default=None, repr=False, hash=False)
+    course_refresh_interval: int = 300
+    gemini_max_concurrency: int = 8
+    gemini_queue_timeout: int = 30
+    context_cache_enabled: bool = True
+    structured_output_enabled: bool = False
+    metrics_sinks: Tuple[str, ...] = ()
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9464
+    admin_panel_enabled: bool = False
+    prewarm_enabled: bool = True
+    loaded_at: float = field(default=0.0, compare=False)
+
+
+def _get_secrets() -> Any:
+    """
+    Streamlit Secrets を返す（使えない場合はNone）
+    Streamlit は読み込みに時間がかかるため、既に読み込まれている（アプリとして実行中）か、
+    secrets.toml がある場合だけ読み込む（バッチ・ベンチマークでは読み込まない）
+    """
+    st = sys.modules.get("streamlit")
+    if st is None:
+        if not any(os.path.exists(os.path.expanduser(path)) for path in SECRETS_FILES):
+            return None
+        try:
+            import streamlit as st
+        except ImportError:
+            return None
+    return getattr(st, "secrets", None)
 
 def _get_from_secrets_or_env(key: str) -> Optional[str]:
     """
@@ -13,42 +72,64 @@ def _get_from_secrets_or_env(key: str) -> Optional[str]:
     """
     try:
         # Streamlit Secretsから取得を試みる
-        if hasattr(st, 'secrets') and key in st.secrets:
-            return st.secrets[key]
-    except:
+        secrets = _get_secrets()
+        if secrets is not None and key in secrets:
+            return secrets[key]
+    except Exception:
         pass
-    
+
     # 環境変数から取得
     return os.getenv(key)
 
-def get_gemini_api_key() -> Optional[str]:
-    """Gemini APIキーをStreamlit Secrets / 環境変数から取得"""
-    return _get_from_secrets_or_env("GEMINI_API_KEY")
+def _get_int_setting(key: str, default: int, minimum: int) -> int:
+    """
+    整数の設定値を取得（未設定・不正な値の場合はデフォルト値）
+    """
+    value = _get_from_secrets_or_env(key)
+    try:
+        return max(int(value), minimum) if value else default
+    except (TypeError, ValueError):
+        return default
 
-def get_google_sheets_id() -> Optional[str]:
-    """Google Sheets IDをStreamlit Secrets / 環境変数から取得"""
-    return _get_from_secrets_or_env("GOOGLE_SHEETS_ID")
+def _get_bool_setting(key: str, default: bool) -> bool:
+    """
+    真偽値の設定値を取得（"1" / "true" / "on" / "yes" を真とみなす）
+    """
+    value = _get_from_secrets_or_env(key)
+    if value is None or str(value).strip() == "":
+        return default
+    return str(value).strip().lower() in ("1", "true", "on", "yes")
 
-def get_google_sheets_credentials() -> Optional[Dict[str, Any]]:
+def _get_list_setting(key: str) -> Tuple[str, ...]:
+    """
+    カンマ区切りの設定値を取得（小文字にそろえる）
     """
-    Google Sheets認証情報を取得
+    value = _get_from_secrets_or_env(key) or ""
+    return tuple(item.strip().lower() for item in str(value).split(",") if item.strip())
+
+def _load_google_sheets_credentials() -> Optional[Dict[str, Any]]:
+    """
+    Google Sheets認証情報を読み込む
     Streamlit SecretsにJSON文字列がある場合はそれを使用、
     なければファイルパスから読み込む
-    
+
     Returns:
         認証情報の辞書、またはNone
     """
     # 方法1: Streamlit SecretsにJSON文字列がある場合
     try:
-        if hasattr(st, 'secrets') and 'GOOGLE_SHEETS_CREDENTIALS' in st.secrets:
-            creds_str = st.secrets['GOOGLE_SHEETS_CREDENTIALS']
+        secrets = _get_secrets()
+        if secrets is not None and 'GOOGLE_SHEETS_CREDENTIALS' in secrets:
+            creds_str = secrets['GOOGLE_SHEETS_CREDENTIALS']
             if isinstance(creds_str, str):
                 return json.loads(creds_str)
             elif isinstance(creds_str, dict):
                 return creds_str
-    except:
+            else:
+                return dict(creds_str)
+    except Exception:
         pass
-    
+
     # 方法2: ファイルパスが指定されている場合
     credentials_path = _get_from_secrets_or_env("GOOGLE_SHEETS_CREDENTIALS_PATH")
     if credentials_path and os.path.exists(credentials_path):
@@ -58,5 +139,179 @@ def get_google_sheets_credentials() -> Optional[Dict[str, Any]]:
         except Exception as e:
             print(f"認証ファイル読み込みエラー: {e}")
             return None
-    
+
     return None
+
+def _freeze(value: Optional[Dict[str, Any]]) -> Optional[Mapping[str, Any]]:
+    """辞書を読み取り専用にする（Settings の中身を書き換えられないように）"""
+    return MappingProxyType(dict(value)) if value is not None else None
+
+def load_settings() -> Settings:
+    """
+    Streamlit Secrets / 環境変数から設定を読み込む（キャッシュしない）
+
+    Returns:
+        読み込んだSettings
+    """
+    return Settings(
+        gemini_api_key=_get_from_secrets_or_env("GEMINI_API_KEY"),
+        google_sheets_id=_get_from_secrets_or_env("GOOGLE_SHEETS_ID"),
+        google_sheets_credentials=_freeze(_load_google_sheets_credentials()),
+        course_refresh_interval=_get_int_setting("COURSE_REFRESH_INTERVAL_SECONDS", 300, 10),
+        gemini_max_concurrency=_get_int_setting("GEMINI_MAX_CONCURRENCY", 8, 1),
+        gemini_queue_timeout=_get_int_setting("GEMINI_QUEUE_TIMEOUT_SECONDS", 30, 1),
+        context_cache_enabled=_get_bool_setting("GEMINI_CONTEXT_CACHE", True),
+        structured_output_enabled=_get_bool_setting("GEMINI_STRUCTURED_OUTPUT", False),
+        metrics_sinks=_get_list_setting("METRICS_SINKS"),
+        metrics_host=(_get_from_secrets_or_env("METRICS_HOST") or "127.0.0.1").strip(),
+        metrics_port=_get_int_setting("METRICS_PORT", 9464, 1),
+        admin_panel_enabled=_get_bool_setting("ADMIN_PANEL", False),
+        prewarm_enabled=_get_bool_setting("PREWARM", True),
+        loaded_at=time.time(),
+    )
+
+
+def _secrets_signature() -> Tuple[Tuple[str, int, int], ...]:
+    """secrets.toml の更新時刻と大きさ（存在しないファイルは含めない）"""
+    signature = []
+    for path in SECRETS_FILES:
+        try:
+            stat = os.stat(os.path.expanduser(path))
+        except OSError:
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class SettingsStore:
+    """
+    読み込み済みのSettingsを保持する
+
+    get() はキャッシュ済みのSettingsを返し、SETTINGS_CHECK_INTERVAL_SECONDS ごとに
+    secrets.toml の更新時刻・大きさを確認して、変わっていれば読み込み直す。
+    読み込み直して内容が変わった場合は、登録されたリスナーに (変更前, 変更後) を渡す
+    """
+
+    def __init__(self, loader: Callable[[], Settings] = load_settings):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._settings: Optional[Settings] = None
+        self._signature: Tuple[Tuple[str, int, int], ...] = ()
+        self._checked_at = 0.0
+        self._listeners: List[Callable[[Settings, Settings], None]] = []
+        self._stats = {"loads": 0, "reloads": 0}
+
+    def get(self) -> Settings:
+        settings = self._settings
+        if settings is not None and time.monotonic() - self._checked_at < SETTINGS_CHECK_INTERVAL_SECONDS:
+            return settings
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = _secrets_signature()
+            if self._settings is not None and signature == self._signature:
+                return self._settings
+        return self.reload()
+
+    def reload(self) -> Settings:
+        """設定を読み込み直す"""
+        with self._lock:
+            previous = self._settings
+            self._signature = _secrets_signature()
+            self._settings = settings = self._loader()
+            self._checked_at = time.monotonic()
+            self._stats["loads" if previous is None else "reloads"] += 1
+            listeners = list(self._listeners)
+        if previous is not None and previous != settings:
+            for listener in listeners:
+                try:
+                    listener(previous, settings)
+                except Exception as e:
+                    print(f"設定変更の通知エラー: {e}")
+        return settings
+
+    def add_listener(self, listener: Callable[[Settings, Settings], None]) -> None:
+        """設定が変わったときに呼ぶ関数を登録する"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def stats(self) -> Dict[str, int]:
+        """読み込み回数を返す"""
+        with self._lock:
+            return dict(self._stats)
+
+
+_settings_store = SettingsStore()
+
+
+def get_settings() -> Settings:
+    """現在の設定を取得（読み込み済みならキャッシュから）"""
+    return _settings_store.get()
+
+def reload_settings() -> Settings:
+    """設定を読み込み直す（.env を読み込んだ後や、設定を変更した後に呼ぶ）"""
+    return _settings_store.reload()
+
+def on_settings_change(listener: Callable[[Settings, Settings], None]) -> None:
+    """設定が変わったときに listener(変更前, 変更後) を呼ぶ"""
+    _settings_store.add_listener(listener)
+
+def get_gemini_api_key() -> Optional[str]:
+    """Gemini APIキーをStreamlit Secrets / 環境変数から取得"""
+    return get_settings().gemini_api_key
+
+def get_google_sheets_id() -> Optional[str]:
+    """Google Sheets IDをStreamlit Secrets / 環境変数から取得"""
+    return get_settings().google_sheets_id
+
+def get_course_refresh_interval() -> int:
+    """講座データを Google Sheets から再取得する間隔（秒、デフォルト300）"""
+    return get_settings().course_refresh_interval
+
+def get_gemini_max_concurrency() -> int:
+    """プロセス全体でGeminiへ同時に送るリクエスト数の上限（デフォルト8）"""
+    return get_settings().gemini_max_concurrency
+
+def get_gemini_queue_timeout() -> int:
+    """同時実行数の上限に達したとき、空きを待つ最大時間（秒、デフォルト30）"""
+    return get_settings().gemini_queue_timeout
+
+def get_context_cache_enabled() -> bool:
+    """共通のプロンプト前半部分をGemini側でキャッシュして再利用するか（デフォルト有効）"""
+    return get_settings().context_cache_enabled
+
+def get_structured_output_enabled() -> bool:
+    """
+    講座の提案をJSON（構造化出力）で受け取り、講座データから表示するか（デフォルト無効）
+    有効にすると回答はストリーミングされず、JSONを受け取り終えてからまとめて表示される
+    """
+    return get_settings().structured_output_enabled
+
+def get_metrics_sinks() -> List[str]:
+    """メトリクスの出力先（カンマ区切り: "log" / "prometheus"、デフォルトなし）"""
+    return list(get_settings().metrics_sinks)
+
+def get_metrics_host() -> str:
+    """Prometheus形式の /metrics を待ち受けるアドレス（デフォルト127.0.0.1。外部から読む場合は 0.0.0.0 など）"""
+    return get_settings().metrics_host
+
+def get_metrics_port() -> int:
+    """Prometheus形式の /metrics を公開するポート（デフォルト9464）"""
+    return get_settings().metrics_port
+
+def get_admin_panel_enabled() -> bool:
+    """サイドバーに処理時間などの管理パネルを表示するか（デフォルト無効）"""
+    return get_settings().admin_panel_enabled
+
+def get_prewarm_enabled() -> bool:
+    """起動直後にモデル解決・講座データの読み込みなどをバックグラウンドで済ませておくか（デフォルト有効）"""
+    return get_settings().prewarm_enabled
+
+def get_google_sheets_credentials() -> Optional[Dict[str, Any]]:
+    """
+    Google Sheets認証情報を取得（読み込み済みの設定から返す）
+
+    Returns:
+        認証情報の辞書（設定のコピー）、またはNone
+    """
+    credentials = get_settings().google_sheets_credentials
+    return dict(credentials) if credentials is not None else None
@@ -0,0 +1,150 @@
+"""
+画面のアセット（CSS・ロゴ・アイコン）の事前処理
+パスの解決・CSSの圧縮を設定ごとに一度だけ行い、メモリ上から返す
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Sequence
+
+
+_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_PUNCTUATION_SPACE_PATTERN = re.compile(r"\s*([{};,])\s*")
+_STYLE_TAG_PATTERN = re.compile(r"^\s*<style>(.*)</style>\s*$", re.DOTALL)
+
+
+def minify_css(css: str) -> str:
+    """
+    CSSからコメントと不要な空白を取り除く
+    <style> タグで囲まれている場合は中身だけを圧縮する
+
+    Args:
+        css: CSS文字列
+
+    Returns:
+        圧縮したCSS文字列
+    """
+    match = _STYLE_TAG_PATTERN.match(css)
+    body = match.group(1) if match else css
+    body = _COMMENT_PATTERN.sub("", body)
+    body = _WHITESPACE_PATTERN.sub(" ", body)
+    body = _PUNCTUATION_SPACE_PATTERN.sub(r"\1", body)
+    body = body.replace(": ", ":").replace(";}", "}").strip()
+    return f"<style>{body}</style>" if match else body
+
+
+def config_hash(*configs: Any) -> str:
+    """設定（辞書など）からアセットのバージョンを求める"""
+    payload = json.dumps(configs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class AssetBundle:
+    """事前処理済みのアセット"""
+
+    version: str
+    css: str
+    logo_path: Optional[str] = None
+    icon_paths: Dict[str, Optional[str]] = field(default_factory=dict)
+
+    def icon(self, role: str) -> Optional[str]:
+        """ロールのアイコンのパス（存在しない場合はNone）"""
+        return self.icon_paths.get(role)
+
+
+def build_asset_bundle(
+    version: str,
+    assets_dir: str,
+    css: str,
+    logo_candidates: Sequence[str],
+    icon_files: Dict[str, str],
+) -> AssetBundle:
+    """
+    アセットを事前処理する
+
+    Args:
+        version: 設定から求めたバージョン
+        assets_dir: アセットディレクトリのパス
+        css: スタイルシート
+        logo_candidates: ロゴのファイル名の候補（先に見つかったものを使う）
+        icon_files: ロールごとのアイコンのファイル名
+
+    Returns:
+        AssetBundle
+    """
+    logo_path = None
+    for filename in logo_candidates:
+        path = os.path.join(assets_dir, filename)
+        if os.path.exists(path):
+            logo_path = path
+            break
+
+    icon_paths = {}
+    for role, filename in icon_files.items():
+        path = os.path.join(assets_dir, filename)
+        icon_paths[role] = path if os.path.exists(path) else None
+
+    return AssetBundle(
+        version=version,
+        css=minify_css(css),
+        logo_path=logo_path,
+        icon_paths=icon_paths,
+    )
+
+
+class AssetRegistry:
+    """
+    バージョン（設定のハッシュ）ごとに AssetBundle を保持する
+    同じバージョンに対しては、2回目以降はファイルを読まずにメモリ上のものを返す
+    """
+
+    def __init__(self, max_versions: int = 4):
+        self.max_versions = max_versions
+        self._lock = threading.Lock()
+        self._bundles: Dict[str, AssetBundle] = {}
+        self._stats = {"hits": 0, "builds": 0}
+
+    def get(self, version: str, builder: Callable[[], AssetBundle]) -> AssetBundle:
+        """
+        バージョンに対応する AssetBundle を返す（なければ builder で作る）
+
+        Args:
+            version: 設定のハッシュ
+            builder: AssetBundle を作る関数
+
+        Returns:
+            AssetBundle
+        """
+        with self._lock:
+            bundle = self._bundles.get(version)
+            if bundle is not None:
+                self._stats["hits"] += 1
+                return bundle
+            bundle = builder()
+            self._stats["builds"] += 1
+            self._bundles[version] = bundle
+            while len(self._bundles) > self.max_versions:
+                self._bundles.pop(next(iter(self._bundles)))
+            return bundle
+
+    def clear(self) -> None:
+        """保持しているアセットを破棄する（アセットファイルを差し替えた場合など）"""
+        with self._lock:
+            self._bundles.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, versions=len(self._bundles))
+
+
+_asset_registry = AssetRegistry()
+
+
+def get_asset_registry() -> AssetRegistry:
+    """プロセス共通のAssetRegistryを取得"""
+    return _asset_registry
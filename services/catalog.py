@@ -0,0 +1,269 @@
+"""
+講座カタログ
+講座データ（CSV / Google Sheetsの行）を一度だけ解析し、型付きのレコードとして保持する
+"""
+import csv
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+
+# data/courses.csv のヘッダー（列名 → 属性名）
+COURSE_COLUMNS = OrderedDict([
+    ("コース名", "course_name"),
+    ("クラス名", "class_name"),
+    ("講師名", "instructor"),
+    ("講座タイトル", "title"),
+    ("対象年齢", "target_age"),
+    ("内容", "content"),
+    ("感想（一部）", "feedback"),
+    ("該当URL", "url"),
+])
+
+# 存在しないとカタログとして扱えない列
+REQUIRED_COLUMNS = ("講座タイトル", "該当URL")
+
+# 「クラスなし」を表す値
+_EMPTY_MARKERS = ("", "-", "ー", "なし")
+
+# 解析済みカタログを保持する数（データバージョンごと）
+_CATALOG_CACHE_SIZE = 4
+
+
+class CatalogError(ValueError):
+    """講座データの形式が不正な場合のエラー"""
+
+
+class Course:
+    """
+    講座1件分のレコード
+    属性名は COURSE_COLUMNS の値、course_id はタイトルとURLから求めた短いID
+    """
+
+    __slots__ = ("course_id",) + tuple(COURSE_COLUMNS.values())
+
+    def __init__(self, course_id: str, values: Sequence[str]):
+        self.course_id = course_id
+        for attr, value in zip(COURSE_COLUMNS.values(), values):
+            setattr(self, attr, value)
+
+    def get(self, column: str) -> str:
+        """列名（日本語ヘッダー）で値を取得する"""
+        return getattr(self, COURSE_COLUMNS[column])
+
+    def as_row(self) -> List[str]:
+        """ヘッダー順の値のリストを返す"""
+        return [getattr(self, attr) for attr in COURSE_COLUMNS.values()]
+
+    def as_dict(self) -> Dict[str, str]:
+        """列名をキーとした辞書を返す"""
+        return dict(zip(COURSE_COLUMNS.keys(), self.as_row()))
+
+    def __repr__(self) -> str:
+        return f"Course({self.course_id!r}, {self.title!r})"
+
+
+def _course_id(title: str, url: str) -> str:
+    return "c" + hashlib.sha1(f"{title}\n{url}".encode("utf-8")).hexdigest()[:6]
+
+
+def normalize_url(url: str) -> str:
+    """URLのクエリ文字列・末尾のスラッシュを除いて比較できる形にする"""
+    return url.strip().split("?", 1)[0].split("#", 1)[0].rstrip("/")
+
+
+def _is_empty(value: str) -> bool:
+    return value.strip() in _EMPTY_MARKERS
+
+
+class CourseCatalog:
+    """
+    解析済みの講座カタログ（イミュータブル）
+
+    - version: 内容から求めたバージョン。インデックスやキャッシュのキーに使う
+    - warnings: 解析時に見つかった問題（読み飛ばした行など）
+    - by_course / by_class / by_instructor: 各項目での高速な絞り込み
+    """
+
+    def __init__(self, courses: Sequence[Course], version: str, source: str = "", warnings: Optional[List[str]] = None):
+        self.courses: Tuple[Course, ...] = tuple(courses)
+        self.version = version
+        self.source = source
+        self.warnings: List[str] = list(warnings or [])
+        self._by_id: Dict[str, Course] = {}
+        self._by_course: Dict[str, List[Course]] = {}
+        self._by_class: Dict[str, List[Course]] = {}
+        self._by_instructor: Dict[str, List[Course]] = {}
+        self._by_url: Dict[str, Course] = {}
+        for course in self.courses:
+            self._by_id[course.course_id] = course
+            if course.url:
+                self._by_url.setdefault(normalize_url(course.url), course)
+            self._by_course.setdefault(course.course_name, []).append(course)
+            if not _is_empty(course.class_name):
+                self._by_class.setdefault(course.class_name, []).append(course)
+            self._by_instructor.setdefault(course.instructor, []).append(course)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence[str]], source: str = "") -> "CourseCatalog":
+        """
+        ヘッダー行を含む行のリストからカタログを作る
+
+        Args:
+            rows: 1行目がヘッダーの二次元リスト（Google Sheetsの get_all_values() など）
+            source: データの取得元（ログ・表示用）
+
+        Returns:
+            CourseCatalog
+
+        Raises:
+            CatalogError: ヘッダーに必須列がない場合
+        """
+        rows = [row for row in rows if any(cell.strip() for cell in row)]
+        if not rows:
+            raise CatalogError("講座データが空です")
+
+        header = [cell.strip() for cell in rows[0]]
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise CatalogError(f"必須の列がありません: {', '.join(missing)}")
+
+        warnings = []
+        positions = []
+        for column in COURSE_COLUMNS:
+            if column in header:
+                positions.append(header.index(column))
+            else:
+                positions.append(None)
+                warnings.append(f"列「{column}」がありません")
+
+        courses = []
+        seen_ids = set()
+        digest = hashlib.sha1()
+        for line_no, row in enumerate(rows[1:], start=2):
+            values = [row[p].strip() if p is not None and p < len(row) else "" for p in positions]
+            course = Course("", values)
+            if not course.title:
+                warnings.append(f"{line_no}行目: 講座タイトルが空のため読み飛ばしました")
+                continue
+            if course.url and not course.url.startswith(("http://", "https://")):
+                warnings.append(f"{line_no}行目: 該当URLの形式が不正です（{course.url}）")
+
+            course_id = _course_id(course.title, course.url)
+            suffix = 2
+            while course_id in seen_ids:
+                course_id = f"{_course_id(course.title, course.url)}-{suffix}"
+                suffix += 1
+            seen_ids.add(course_id)
+            course.course_id = course_id
+            courses.append(course)
+            digest.update("\x1f".join(values).encode("utf-8"))
+            digest.update(b"\x1e")
+
+        return cls(courses, version=digest.hexdigest()[:16], source=source, warnings=warnings)
+
+    @classmethod
+    def from_csv_text(cls, csv_content: str, source: str = "") -> "CourseCatalog":
+        """
+        CSV文字列からカタログを作る（同じ内容なら解析済みのものを再利用）
+
+        Raises:
+            CatalogError: CSVの形式が不正な場合
+        """
+        key = hashlib.sha1(csv_content.encode("utf-8")).hexdigest()
+        with _catalog_cache_lock:
+            catalog = _catalog_cache.get(key)
+            if catalog is not None:
+                _catalog_cache.move_to_end(key)
+                return catalog
+
+        try:
+            rows = list(csv.reader(io.StringIO(csv_content)))
+        except csv.Error as e:
+            raise CatalogError(f"CSVの解析に失敗しました: {e}")
+        catalog = cls.from_rows(rows, source=source)
+
+        with _catalog_cache_lock:
+            _catalog_cache[key] = catalog
+            while len(_catalog_cache) > _CATALOG_CACHE_SIZE:
+                _catalog_cache.popitem(last=False)
+        return catalog
+
+    def __len__(self) -> int:
+        return len(self.courses)
+
+    def __iter__(self) -> Iterator[Course]:
+        return iter(self.courses)
+
+    def __bool__(self) -> bool:
+        return bool(self.courses)
+
+    def get(self, course_id: str) -> Optional[Course]:
+        """IDで講座を取得する"""
+        return self._by_id.get(course_id)
+
+    def by_url(self, url: str) -> Optional[Course]:
+        """該当URLで講座を取得する（クエリ文字列の違いは無視する）"""
+        return self._by_url.get(normalize_url(url))
+
+    def by_course(self, course_name: str) -> List[Course]:
+        """コース名で講座を絞り込む"""
+        return list(self._by_course.get(course_name, []))
+
+    def by_class(self, class_name: str) -> List[Course]:
+        """クラス名で講座を絞り込む"""
+        return list(self._by_class.get(class_name, []))
+
+    def by_instructor(self, instructor: str) -> List[Course]:
+        """講師名で講座を絞り込む"""
+        return list(self._by_instructor.get(instructor, []))
+
+    def course_names(self) -> List[str]:
+        """コース名の一覧"""
+        return list(self._by_course)
+
+    def class_names(self) -> List[str]:
+        """クラス名の一覧（クラスなしを除く）"""
+        return list(self._by_class)
+
+    def instructors(self) -> List[str]:
+        """講師名の一覧"""
+        return list(self._by_instructor)
+
+    def to_csv(self, courses: Optional[Sequence[Course]] = None) -> str:
+        """
+        講座をCSV形式の文字列にする（プロンプト用）
+
+        Args:
+            courses: 出力する講座（省略時は全件）
+        """
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(list(COURSE_COLUMNS))
+        for course in self.courses if courses is None else courses:
+            writer.writerow(course.as_row())
+        return output.getvalue()
+
+
+_catalog_cache: "OrderedDict[str, CourseCatalog]" = OrderedDict()
+_catalog_cache_lock = threading.Lock()
+
+
+def as_catalog(course_data: Union[str, CourseCatalog, None]) -> Optional[CourseCatalog]:
+    """
+    CSV文字列またはカタログを CourseCatalog に揃える
+
+    Returns:
+        CourseCatalog、データがない・不正な場合はNone
+    """
+    if course_data is None or isinstance(course_data, CourseCatalog):
+        return course_data or None
+    if not course_data.strip():
+        return None
+    try:
+        return CourseCatalog.from_csv_text(course_data)
+    except CatalogError as e:
+        print(f"講座データ解析エラー: {e}")
+        return None
@@ -0,0 +1,211 @@
+"""
+Gemini呼び出しの同時実行制御
+プロセス全体での同時実行数の上限、空き待ちのタイムアウト、429/5xxのリトライを扱う
+"""
+import functools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+from config import get_gemini_max_concurrency, get_gemini_queue_timeout
+from services.metrics import incr
+
+
+T = TypeVar("T")
+
+# リトライ対象のHTTPステータス
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# リトライ対象の例外クラス名（google.api_core.exceptions）
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted",
+    "TooManyRequests",
+    "InternalServerError",
+    "BadGateway",
+    "ServiceUnavailable",
+    "GatewayTimeout",
+    "DeadlineExceeded",
+}
+
+# リトライの設定（指数バックオフ + フルジッター）
+MAX_ATTEMPTS = 3
+BASE_DELAY_SECONDS = 0.5
+MAX_DELAY_SECONDS = 8.0
+
+class QueueTimeoutError(TimeoutError):
+    """同時実行数の上限に達し、待ち時間内に空きが出なかった場合のエラー"""
+
+    def __init__(self, timeout: float):
+        super().__init__(f"リクエストが混み合っています（{timeout:.0f}秒待機）。しばらくしてからもう一度お試しください。")
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    一時的なエラー（429/5xx）で、リトライすれば成功する可能性があるかどうか
+    例外の種類とステータスコードで判定する（メッセージ中の数字では判定しない）
+    """
+    if isinstance(error, QueueTimeoutError):
+        return False
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    # google.api_core.exceptions は code にHTTPステータスを持つ。HTTPエラーは response.status_code
+    for code in (getattr(error, "code", None), getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+            return True
+    return False
+
+
+class ConcurrencyLimiter:
+    """
+    プロセス全体の同時実行数を制限する
+
+    上限に達している間、新しいリクエストは空きが出るまで待つ（キューイング）。
+    待ち時間が timeout を超えた場合は QueueTimeoutError になる。
+    """
+
+    def __init__(self, max_concurrency: int, timeout: float):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._stats = {"active": 0, "waiting": 0, "acquired": 0, "rejected": 0, "retries": 0}
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """実行枠を1つ確保する（空くまで待つ）"""
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self._stats["waiting"] += 1
+        acquired = self._semaphore.acquire(timeout=timeout)
+        with self._lock:
+            self._stats["waiting"] -= 1
+            if not acquired:
+                self._stats["rejected"] += 1
+                incr("gemini_queue_timeouts")
+                raise QueueTimeoutError(timeout)
+            self._stats["active"] += 1
+            self._stats["acquired"] += 1
+
+    def release(self) -> None:
+        """確保した実行枠を返す"""
+        with self._lock:
+            self._stats["active"] -= 1
+        self._semaphore.release()
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._stats["retries"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """実行中・待機中の数などを返す"""
+        with self._lock:
+            return dict(self._stats, max_concurrency=self.max_concurrency)
+
+
+class SlotReleasingIterator:
+    """
+    ストリーミング応答を読み終えた（または close された）時点で実行枠を返すイテレーター
+    途中で読むのをやめた場合も close() かガベージコレクションで枠を返す
+    """
+
+    def __init__(self, iterator: Iterator[T], release: Callable[[], None]):
+        self._iterator = iterator
+        self._release = release
+        self._released = False
+
+    def __iter__(self) -> "SlotReleasingIterator":
+        return self
+
+    def __next__(self) -> T:
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __del__(self):
+        self.close()
+
+
+def call_with_retry(
+    operation: Callable[[], T],
+    limiter: Optional["ConcurrencyLimiter"] = None,
+    max_attempts: int = MAX_ATTEMPTS,
+    base_delay: float = BASE_DELAY_SECONDS,
+    max_delay: float = MAX_DELAY_SECONDS,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """
+    一時的なエラー（429/5xx）の場合にジッター付き指数バックオフでリトライする
+
+    Args:
+        operation: 実行する処理
+        limiter: リトライ回数を記録するリミッター
+        max_attempts: 最大試行回数
+        base_delay: 初回リトライの最大待ち時間（秒）
+        max_delay: 待ち時間の上限（秒）
+        sleep: 待機関数（テスト用に差し替え可能）
+
+    Returns:
+        operation の戻り値
+    """
+    attempt = 1
+    while True:
+        try:
+            return operation()
+        except Exception as e:
+            if attempt >= max_attempts or not is_retryable_error(e):
+                raise
+            if limiter is not None:
+                limiter.record_retry()
+            incr("gemini_retries")
+            sleep(random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1))))
+            attempt += 1
+
+
+_limiter: Optional[ConcurrencyLimiter] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_init_lock = threading.Lock()
+
+
+def get_limiter() -> ConcurrencyLimiter:
+    """プロセス共通のConcurrencyLimiterを取得"""
+    global _limiter
+    with _init_lock:
+        if _limiter is None:
+            _limiter = ConcurrencyLimiter(get_gemini_max_concurrency(), get_gemini_queue_timeout())
+        return _limiter
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """非同期呼び出し用の共有スレッドプールを取得"""
+    global _executor
+    limiter = get_limiter()
+    with _init_lock:
+        if _executor is None:
+            # 実行枠の空き待ちをするスレッドの分だけ多めに用意する
+            _executor = ThreadPoolExecutor(max_workers=limiter.max_concurrency * 4, thread_name_prefix="gemini")
+        return _executor
+
+
+def reset_limits() -> None:
+    """リミッターとスレッドプールを作り直す（テスト・設定変更用）"""
+    global _limiter, _executor
+    with _init_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _limiter = None
+        _executor = None
+
+
+async def run_in_executor(function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """同期関数を共有スレッドプールで実行し、完了を await できるようにする"""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(function, *args, **kwargs))
@@ -0,0 +1,248 @@
+"""
+プロンプト前半部分のコンテキストキャッシュ
+BASE_SYSTEM_PROMPT + ガイドラインのように全リクエストで共通の前半部分を、
+バージョンごとに一度だけプロバイダ側に登録し、以降のリクエストでは後半部分だけを送る
+"""
+import datetime
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+from services.prompt_builder import estimate_tokens
+from services.response_cache import content_version
+
+
+# プロバイダ側キャッシュの有効期間（秒）
+DEFAULT_TTL_SECONDS = 60 * 60
+
+# 期限切れの少し前に作り直す割合
+_REFRESH_RATIO = 0.9
+
+# プロバイダ側キャッシュを作成できる最小トークン数（モデル名の前方一致、上から順に判定）
+# これ未満の前半部分はキャッシュできないため、毎回送る（"uncached"）
+MIN_CACHE_TOKENS_BY_MODEL = (
+    ("gemini-2.5-flash", 1024),
+    ("gemini-2.5-pro", 4096),
+    ("gemini-2.0", 4096),
+    ("gemini-1.5", 32768),
+)
+DEFAULT_MIN_CACHE_TOKENS = 4096
+
+# 最小トークン数に満たないことを示すエラーメッセージ
+# （例: "Cached content is too small. total_token_count=1200, min_total_token_count=4096"）
+_TOO_SMALL_PATTERN = re.compile(r"too small|min_total_token_count", re.IGNORECASE)
+
+# 一時的なエラーで作成できなかった場合に、次に作成を試みるまでの時間（秒）
+RETRY_AFTER_SECONDS = 60.0
+
+# get_model() が返すモード
+MODE_CACHED = "cached"
+MODE_UNCACHED = "uncached"
+
+# キャッシュしない理由
+REASON_TOO_SMALL = "too_small"
+REASON_UNSUPPORTED = "unsupported"
+REASON_ERROR = "error"
+
+
+def min_cache_tokens_for(model_name: str) -> int:
+    """モデルでキャッシュを作成できる最小トークン数"""
+    name = model_name.replace("models/", "")
+    for model_prefix, tokens in MIN_CACHE_TOKENS_BY_MODEL:
+        if name.startswith(model_prefix):
+            return tokens
+    return DEFAULT_MIN_CACHE_TOKENS
+
+
+def is_unsupported_error(error: BaseException) -> bool:
+    """モデル・プロバイダがコンテキストキャッシュに対応していないことを示すエラーかどうか"""
+    if isinstance(error, NotImplementedError) or type(error).__name__ == "MethodNotImplemented":
+        return True
+    return getattr(error, "code", None) == 501
+
+
+def is_too_small_error(error: BaseException) -> bool:
+    """
+    前半部分が最小トークン数に満たないため作成できないことを示すエラーかどうか
+    （400 のうちメッセージが最小トークン数に触れているものだけ。ほかの 400 は一時的なエラーと同じく作り直す）
+    """
+    if type(error).__name__ != "InvalidArgument" and getattr(error, "code", None) != 400:
+        return False
+    return bool(_TOO_SMALL_PATTERN.search(str(error)))
+
+
+class GeminiContextProvider:
+    """
+    google.generativeai のコンテキストキャッシュを使うプロバイダ
+
+    genai は呼び出し時に genai_getter() から取得する（テストではスタブに差し替えられる）
+    """
+
+    def __init__(self, genai_getter: Callable[[], Any]):
+        self._genai = genai_getter
+
+    def create(self, model_name: str, prefix: str, ttl_seconds: float) -> Tuple[Any, Any]:
+        """前半部分をキャッシュに登録し、それを参照するモデルを返す"""
+        genai = self._genai()
+        cached_content = genai.caching.CachedContent.create(
+            model=f"models/{model_name}",
+            display_name="familyship-concierge-prefix",
+            system_instruction=prefix,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+        return genai.GenerativeModel.from_cached_content(cached_content=cached_content), cached_content
+
+    def bind(self, model_name: str, prefix: str) -> Any:
+        """前半部分を system_instruction に持つモデルを返す（キャッシュを作れない場合）"""
+        return self._genai().GenerativeModel(model_name, system_instruction=prefix)
+
+    def delete(self, handle: Any) -> None:
+        """不要になったキャッシュを削除する"""
+        handle.delete()
+
+
+class _Entry:
+    __slots__ = ("version", "model", "handle", "mode", "reason", "expires_at")
+
+    def __init__(self, version: str, model: Any, handle: Any, mode: str, reason: Optional[str], expires_at: float):
+        self.version = version
+        self.model = model
+        self.handle = handle
+        self.mode = mode
+        self.reason = reason
+        self.expires_at = expires_at
+
+
+class ContextCacheManager:
+    """
+    モデルごとに、前半部分を登録済みのモデルインスタンスを保持する
+
+    - 前半部分が変わる（ガイドラインの更新など）とバージョンが変わり、自動的に作り直す
+    - プロバイダ側キャッシュは期限切れの前に作り直し、古いものは削除する
+    - 前半部分がモデルの最小トークン数に満たない・プロバイダが対応していない場合はキャッシュせず、
+      前半部分を system_instruction に持つモデルを返す（毎回送られるため "uncached" として数える）
+    - 対応していないと判断するのは、非対応を示すエラー（501 など）の場合だけ。
+      それ以外のエラーは RETRY_AFTER_SECONDS 後に作成をやり直す
+    - プロバイダへの作成・削除の呼び出しはロックの外で行い、作成中に来たリクエストは待たずに
+      直前の登録（なければキャッシュなし）を使う
+    """
+
+    def __init__(
+        self,
+        provider: Any,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        min_cache_tokens: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._provider = provider
+        self.ttl_seconds = ttl_seconds
+        self.min_cache_tokens = min_cache_tokens
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._creating: Set[str] = set()
+        self._unsupported: Dict[str, str] = {}
+        self._stats = {"hits": 0, "created": 0, "uncached": 0, "failures": 0}
+
+    def _min_tokens(self, model_name: str) -> int:
+        return self.min_cache_tokens if self.min_cache_tokens is not None else min_cache_tokens_for(model_name)
+
+    def _uncached(self, model_name: str, prefix: str, version: str, reason: str, expires_at: float) -> _Entry:
+        return _Entry(version, self._provider.bind(model_name, prefix), None, MODE_UNCACHED, reason, expires_at)
+
+    def _create(self, model_name: str, prefix: str, version: str) -> _Entry:
+        """エントリを作る（プロバイダを呼ぶため、ロックの外で呼ぶ）"""
+        now = self._clock()
+        if model_name in self._unsupported:
+            return self._uncached(model_name, prefix, version, REASON_UNSUPPORTED, float("inf"))
+        if estimate_tokens(prefix) < self._min_tokens(model_name):
+            return self._uncached(model_name, prefix, version, REASON_TOO_SMALL, float("inf"))
+        try:
+            model, handle = self._provider.create(model_name, prefix, self.ttl_seconds)
+            return _Entry(version, model, handle, MODE_CACHED, None, now + self.ttl_seconds * _REFRESH_RATIO)
+        except Exception as e:
+            print(f"コンテキストキャッシュ作成エラー: {e}")
+            with self._lock:
+                self._stats["failures"] += 1
+                if is_unsupported_error(e):
+                    # 対応していないモデルでは以降キャッシュの作成を試みない
+                    self._unsupported[model_name] = str(e)
+            if is_unsupported_error(e):
+                return self._uncached(model_name, prefix, version, REASON_UNSUPPORTED, float("inf"))
+            if is_too_small_error(e):
+                # この内容では作成できない（前半部分が変われば作り直す）
+                return self._uncached(model_name, prefix, version, REASON_TOO_SMALL, float("inf"))
+            return self._uncached(model_name, prefix, version, REASON_ERROR, now + RETRY_AFTER_SECONDS)
+
+    def get_model(self, model_name: str, prefix: str) -> Tuple[Any, str]:
+        """
+        前半部分を登録済みのモデルを返す
+
+        Args:
+            model_name: モデル名
+            prefix: 全リクエスト共通の前半部分
+
+        Returns:
+            (モデル, "cached"（プロバイダ側キャッシュ） または "uncached"（キャッシュできず、前半部分も毎回送る）)
+        """
+        version = content_version(model_name, prefix)
+        with self._lock:
+            entry = self._entries.get(model_name)
+            fresh = entry is not None and entry.version == version
+            if fresh and self._clock() < entry.expires_at:
+                self._stats["hits" if entry.mode == MODE_CACHED else "uncached"] += 1
+                return entry.model, entry.mode
+            if model_name in self._creating:
+                # 別のリクエストが作成中。同じ内容の登録があればそれを使い、なければキャッシュせずに送る
+                if fresh:
+                    self._stats["hits" if entry.mode == MODE_CACHED else "uncached"] += 1
+                    return entry.model, entry.mode
+                self._stats["uncached"] += 1
+                return self._provider.bind(model_name, prefix), MODE_UNCACHED
+            self._creating.add(model_name)
+        try:
+            new_entry = self._create(model_name, prefix, version)
+        finally:
+            with self._lock:
+                self._creating.discard(model_name)
+        with self._lock:
+            old_entry = self._entries.get(model_name)
+            self._entries[model_name] = new_entry
+            self._stats["created" if new_entry.mode == MODE_CACHED else "uncached"] += 1
+        if old_entry is not new_entry:
+            self._delete(old_entry)
+        return new_entry.model, new_entry.mode
+
+    def _delete(self, entry: Optional[_Entry]) -> None:
+        if entry is None or entry.handle is None:
+            return
+        try:
+            self._provider.delete(entry.handle)
+        except Exception:
+            # 期限切れで既に消えている場合などは無視する
+            pass
+
+    def discard(self, model_name: str) -> None:
+        """モデルが使えなくなった場合（404など）に登録を破棄する"""
+        with self._lock:
+            entry = self._entries.pop(model_name, None)
+        self._delete(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ヒット・作成回数などを返す
+
+        hits: 作成済みのキャッシュを使った回数
+        created: キャッシュを作成した回数
+        uncached: キャッシュを使えず前半部分も送った回数（理由は not_cacheable）
+        failures: 作成に失敗した回数
+        """
+        with self._lock:
+            return dict(
+                self._stats,
+                models={name: entry.mode for name, entry in self._entries.items()},
+                not_cacheable={
+                    name: entry.reason for name, entry in self._entries.items() if entry.mode == MODE_UNCACHED
+                },
+                unsupported=dict(self._unsupported),
+            )
@@ -0,0 +1,205 @@
+"""
+会話の状態管理
+直近のやりとりはそのまま、古いやりとりは要約に畳み込み、案内済みの講座を記録する
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Sequence
+from services.catalog import CourseCatalog
+from services.facets import extract_age_months, extract_topics
+
+
+# そのまま残す直近のやりとりの数（ユーザーとアシスタントの1往復を1ターンとする）
+RECENT_TURNS = 2
+
+# 直近のメッセージ1件あたりの最大文字数
+RECENT_MESSAGE_MAX_CHARS = 1200
+
+# 要約全体の最大文字数（超えた分は古い行から捨てる）
+SUMMARY_MAX_CHARS = 600
+
+# 要約1行あたりの最大文字数
+SUMMARY_LINE_MAX_CHARS = 80
+
+# この文字数未満の続きの質問は、前の質問と合わせて講座を検索する（「もっと小さい子向けは？」など）
+FOLLOW_UP_MAX_CHARS = 40
+
+# 前の質問の続き（条件の付け足し）であることを示す言い回し
+FOLLOW_UP_MARKERS = ("もっと", "ほか", "他に", "他の", "別の", "それ", "その", "向け", "続き", "次の")
+
+_URL_PATTERN = re.compile(r"https?://[^\s)\]>）」]+")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_HEADING_LINE_PATTERN = re.compile(r"^\s*#+\s.*$", re.MULTILINE)
+_MARKDOWN_PATTERN = re.compile(r"^\s*(?:[-*]|\d+\.)\s+|\*\*|__", re.MULTILINE)
+_SENTENCE_END_PATTERN = re.compile(r"(?<=[。！？!?])|\n")
+
+_ROLE_LABELS = {"user": "ユーザー", "assistant": "シップちゃん"}
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = _WHITESPACE_PATTERN.sub(" ", text).strip()
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def _first_sentence(text: str) -> str:
+    """マークダウンの記号を除いた最初の文（空行・見出しの行は飛ばす）"""
+    text = _MARKDOWN_PATTERN.sub("", _HEADING_LINE_PATTERN.sub("", text or ""))
+    for sentence in _SENTENCE_END_PATTERN.split(text):
+        if sentence.strip():
+            return sentence.strip()
+    return ""
+
+
+def follow_up_query(user_input: str, previous_question: str) -> str:
+    """
+    講座の検索に使う質問を決める
+
+    短く、前の質問への条件の付け足し（FOLLOW_UP_MARKERS を含むか月齢だけを示す）で、
+    自分では話題を示していない質問だけ前の質問と合わせる。
+    新しい話題の質問・続きと判断できない質問に、前の話題の講座を持ち込まないため
+
+    Args:
+        user_input: 今回のユーザーの入力
+        previous_question: 前回のユーザーの質問
+
+    Returns:
+        検索に使う質問
+    """
+    if not previous_question or len(user_input) >= FOLLOW_UP_MAX_CHARS or extract_topics(user_input):
+        return user_input
+    if any(marker in user_input for marker in FOLLOW_UP_MARKERS) or extract_age_months(user_input) is not None:
+        return f"{user_input} {previous_question}"
+    return user_input
+
+
+def find_recommended_courses(response: str, catalog: Optional[CourseCatalog]) -> List[str]:
+    """
+    応答に含まれる講座のURLから、案内した講座のIDを求める
+
+    Args:
+        response: アシスタントの応答
+        catalog: 講座カタログ
+
+    Returns:
+        講座IDのリスト（応答に出てきた順、重複なし）
+    """
+    if not catalog or not response:
+        return []
+    course_ids = []
+    for url in _URL_PATTERN.findall(response):
+        course = catalog.by_url(url)
+        if course is not None and course.course_id not in course_ids:
+            course_ids.append(course.course_id)
+    return course_ids
+
+
+@dataclass(frozen=True)
+class ConversationContext:
+    """プロンプトに渡す会話の文脈"""
+
+    history: str = ""
+    recommended_ids: FrozenSet[str] = field(default_factory=frozenset)
+    retrieval_query: str = ""
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.history and not self.recommended_ids
+
+
+class ConversationState:
+    """
+    1セッション分の会話の状態（st.session_state に保持する）
+
+    - 直近 RECENT_TURNS ターンはそのままプロンプトに含める
+    - それより古いメッセージは1件ずつ短い要約行に畳み込む（既に畳み込んだ分は作り直さない）
+    - 案内した講座のIDを記録し、次のターン以降は講座データから除外する
+    """
+
+    def __init__(self, recent_turns: int = RECENT_TURNS, summary_max_chars: int = SUMMARY_MAX_CHARS):
+        self.recent_turns = recent_turns
+        self.summary_max_chars = summary_max_chars
+        self.summary_lines: List[str] = []
+        self.recommended_ids: List[str] = []
+        self._folded = 0
+
+    def _summarize(self, message: Dict, catalog: Optional[CourseCatalog]) -> str:
+        label = _ROLE_LABELS.get(message.get("role"), message.get("role", ""))
+        titles = []
+        for course_id in message.get("course_ids", []):
+            course = catalog.get(course_id) if catalog else None
+            if course is not None:
+                titles.append(course.title)
+        if titles:
+            return _shorten(f"{label}: 講座を案内（{'、'.join(titles)}）", SUMMARY_LINE_MAX_CHARS)
+        # 本文は最初の文だけにし、読み取れる話題を添える
+        content = message.get("content", "")
+        topics = extract_topics(content)
+        topic_note = f"（話題: {'、'.join(topics)}）" if topics else ""
+        return _shorten(f"{label}{topic_note}: {_first_sentence(content)}", SUMMARY_LINE_MAX_CHARS)
+
+    def _fold(self, messages: Sequence[Dict], catalog: Optional[CourseCatalog]) -> None:
+        """直近のターンより古いメッセージのうち、未処理のものだけを要約に追加する"""
+        if len(messages) < self._folded:
+            # 履歴がリセットされた場合
+            self.reset()
+        foldable = len(messages) - self.recent_turns * 2
+        while self._folded < foldable:
+            self.summary_lines.append(self._summarize(messages[self._folded], catalog))
+            self._folded += 1
+        while self.summary_lines and sum(len(line) for line in self.summary_lines) > self.summary_max_chars:
+            self.summary_lines.pop(0)
+
+    def build_context(self, user_input: str, messages: Sequence[Dict], catalog: Optional[CourseCatalog] = None) -> ConversationContext:
+        """
+        これまでのメッセージからプロンプト用の文脈を作る
+
+        Args:
+            user_input: 今回のユーザーの入力（messages には含めない）
+            messages: これまでのメッセージ（{"role", "content"} の辞書のリスト）
+            catalog: 講座カタログ（要約に講座名を使う）
+
+        Returns:
+            ConversationContext
+        """
+        self._fold(messages, catalog)
+        lines = []
+        if self.summary_lines:
+            lines.append("【これまでの要約】")
+            lines.extend(f"- {line}" for line in self.summary_lines)
+        recent = messages[self._folded:]
+        if recent:
+            lines.append("【直近のやりとり】")
+            for message in recent:
+                label = _ROLE_LABELS.get(message.get("role"), message.get("role", ""))
+                content = message.get("content", "")
+                if len(content) > RECENT_MESSAGE_MAX_CHARS:
+                    content = content[:RECENT_MESSAGE_MAX_CHARS] + "…"
+                lines.append(f"{label}: {content}")
+
+        previous_questions = [m.get("content", "") for m in messages if m.get("role") == "user"]
+        retrieval_query = follow_up_query(user_input, previous_questions[-1] if previous_questions else "")
+
+        return ConversationContext(
+            history="\n".join(lines),
+            recommended_ids=frozenset(self.recommended_ids),
+            retrieval_query=retrieval_query,
+        )
+
+    def record_response(self, response: str, catalog: Optional[CourseCatalog]) -> List[str]:
+        """
+        アシスタントの応答から案内した講座を記録する
+
+        Returns:
+            今回の応答で案内した講座IDのリスト
+        """
+        course_ids = find_recommended_courses(response, catalog)
+        for course_id in course_ids:
+            if course_id not in self.recommended_ids:
+                self.recommended_ids.append(course_id)
+        return course_ids
+
+    def reset(self) -> None:
+        """会話の状態を初期化する"""
+        self.summary_lines = []
+        self.recommended_ids = []
+        self._folded = 0
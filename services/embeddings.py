@@ -0,0 +1,341 @@
+"""
+講座のベクトル検索
+講座タイトル・内容・感想をベクトルに変換して float32 の行列に保持し、1回の行列ベクトル積で検索する
+埋め込みの計算は差し替え可能（デフォルトはネットワーク不要のハッシュ埋め込み）
+numpy は任意の依存関係で、search_courses(method="embedding") を指定したときだけ使う
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Tuple
+from services.catalog import Course, CourseCatalog
+from services.search import DEFAULT_TOP_K, tokenize
+
+# numpy（読み込みに時間がかかるため、最初に使うときに読み込む。ない環境ではベクトル検索を使わない）
+np: Any = None
+_numpy_checked = False
+
+
+# 埋め込みに使う列
+EMBEDDING_FIELDS = ("講座タイトル", "内容", "感想（一部）")
+
+# ハッシュ埋め込みの次元数
+DEFAULT_DIMENSION = 512
+
+# 一度に埋め込みを計算する件数
+DEFAULT_BATCH_SIZE = 64
+
+# 保存先（講座データと同じ data/ 以下のキャッシュディレクトリ）
+EMBEDDING_DIR = os.path.join(os.path.dirname(__file__), "..", "data", ".cache")
+EMBEDDING_MATRIX_PATH = os.path.join(EMBEDDING_DIR, "course_embeddings.npy")
+EMBEDDING_META_PATH = os.path.join(EMBEDDING_DIR, "course_embeddings.json")
+
+# データバージョンごとに保持するインデックスの数
+_INDEX_CACHE_SIZE = 4
+
+
+def _load_numpy() -> bool:
+    """numpy を読み込む（初回のみ）。読み込めた場合はTrue"""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+        _numpy_checked = True
+    return np is not None
+
+
+def is_available() -> bool:
+    """numpy がインストールされていてベクトル検索を使えるかどうか"""
+    return _load_numpy()
+
+
+def course_text(course: Course) -> str:
+    """講座の埋め込みに使うテキスト"""
+    return "\n".join(course.get(column) for column in EMBEDDING_FIELDS)
+
+
+def _row_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class HashingEmbedder:
+    """
+    文字n-gramを特徴量ハッシュで固定次元に落とすローカルの埋め込み
+    ネットワークもモデルも不要で、同じテキストには常に同じベクトルを返す
+    """
+
+    def __init__(self, dimension: int = DEFAULT_DIMENSION):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        """
+        テキストをベクトルに変換する
+
+        Args:
+            texts: テキストのリスト
+
+        Returns:
+            (len(texts), dimension) の float32 行列（各行はL2正規化済み）
+        """
+        _load_numpy()
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for gram in tokenize(text):
+                counts[gram] = counts.get(gram, 0) + 1
+            for gram, count in counts.items():
+                digest = zlib.crc32(gram.encode("utf-8"))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                matrix[row, digest % self.dimension] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class EmbeddingIndex:
+    """
+    講座ベクトルの行列（行の位置はカタログ内の講座の位置と一致する）
+    """
+
+    def __init__(self, version: str, embedder_name: str, matrix: "np.ndarray", row_hashes: List[str]):
+        self.version = version
+        self.embedder_name = embedder_name
+        self.matrix = matrix
+        self.row_hashes = row_hashes
+
+    def __len__(self) -> int:
+        return len(self.row_hashes)
+
+    def search(
+        self,
+        query_vector: "np.ndarray",
+        top_k: int = DEFAULT_TOP_K,
+        allowed: Optional[AbstractSet[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        質問のベクトルに近い講座を検索する
+
+        Args:
+            query_vector: 質問のベクトル（L2正規化済み）
+            top_k: 返す件数
+            allowed: 対象にする講座の位置。Noneなら全件
+
+        Returns:
+            (カタログ内の位置, コサイン類似度) のリスト（類似度の高い順）
+        """
+        if not len(self) or top_k <= 0:
+            return []
+        scores = self.matrix @ query_vector
+        if allowed is not None:
+            mask = np.full(len(scores), -np.inf, dtype=np.float32)
+            positions = np.fromiter(allowed, dtype=np.intp, count=len(allowed))
+            mask[positions] = scores[positions]
+            scores = mask
+        k = min(top_k, len(scores))
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(position), float(scores[position])) for position in ranked if np.isfinite(scores[position]) and scores[position] > 0]
+
+
+def build_embedding_index(
+    catalog: CourseCatalog,
+    embedder: Any,
+    previous: Optional[EmbeddingIndex] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Tuple[EmbeddingIndex, int]:
+    """
+    カタログの講座ベクトルを計算する
+    前回のインデックスと内容が同じ行はベクトルを再利用し、変わった行だけを計算する
+
+    Args:
+        catalog: 講座カタログ
+        embedder: 埋め込み（name, dimension, embed(texts) を持つ）
+        previous: 前回のインデックス
+        batch_size: 一度に埋め込みを計算する件数
+
+    Returns:
+        (EmbeddingIndex, 計算し直した行数)
+    """
+    _load_numpy()
+    texts = [course_text(course) for course in catalog]
+    row_hashes = [_row_hash(text) for text in texts]
+    matrix = np.zeros((len(texts), embedder.dimension), dtype=np.float32)
+
+    reusable: Dict[str, int] = {}
+    if previous is not None and previous.embedder_name == embedder.name:
+        reusable = {row_hash: row for row, row_hash in enumerate(previous.row_hashes)}
+
+    pending = []
+    for row, row_hash in enumerate(row_hashes):
+        previous_row = reusable.get(row_hash)
+        if previous_row is not None:
+            matrix[row] = previous.matrix[previous_row]
+        else:
+            pending.append(row)
+
+    for start in range(0, len(pending), batch_size):
+        rows = pending[start:start + batch_size]
+        matrix[rows] = embedder.embed([texts[row] for row in rows])
+
+    return EmbeddingIndex(catalog.version, embedder.name, np.ascontiguousarray(matrix), row_hashes), len(pending)
+
+
+def save_embedding_index(
+    index: EmbeddingIndex,
+    matrix_path: str = EMBEDDING_MATRIX_PATH,
+    meta_path: str = EMBEDDING_META_PATH,
+) -> bool:
+    """
+    インデックスを保存する（書き込み途中のファイルを読まないよう、一時ファイルから置き換える）
+
+    Returns:
+        保存できた場合はTrue
+    """
+    tmp_paths: List[str] = []
+    try:
+        os.makedirs(os.path.dirname(matrix_path), exist_ok=True)
+        fd, tmp_matrix = tempfile.mkstemp(dir=os.path.dirname(matrix_path), suffix=".npy.tmp")
+        tmp_paths.append(tmp_matrix)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, index.matrix)
+        meta = {"version": index.version, "embedder": index.embedder_name, "row_hashes": index.row_hashes}
+        fd, tmp_meta = tempfile.mkstemp(dir=os.path.dirname(meta_path), suffix=".json.tmp")
+        tmp_paths.append(tmp_meta)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_matrix, matrix_path)
+        os.replace(tmp_meta, meta_path)
+        return True
+    except Exception as e:
+        print(f"講座ベクトルの保存エラー: {str(e)}")
+        return False
+    finally:
+        # 置き換えられなかった一時ファイルを残さない
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def load_embedding_index(
+    matrix_path: str = EMBEDDING_MATRIX_PATH,
+    meta_path: str = EMBEDDING_META_PATH,
+) -> Optional[EmbeddingIndex]:
+    """
+    保存済みのインデックスを読み込む（行列はメモリマップで開く）
+
+    Returns:
+        EmbeddingIndex、ない・壊れている場合はNone
+    """
+    if not (os.path.exists(matrix_path) and os.path.exists(meta_path)) or not _load_numpy():
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode="r")
+        if matrix.ndim != 2 or matrix.shape[0] != len(meta["row_hashes"]) or matrix.dtype != np.float32:
+            return None
+        return EmbeddingIndex(meta["version"], meta["embedder"], matrix, meta["row_hashes"])
+    except Exception as e:
+        print(f"講座ベクトルの読み込みエラー: {str(e)}")
+        return None
+
+
+class EmbeddingStore:
+    """
+    データバージョンごとの EmbeddingIndex を保持する
+
+    - 初回は保存済みのインデックスを読み込み、内容が変わった行だけを計算し直す
+    - 計算し直した行があれば保存する
+    """
+
+    def __init__(self, embedder: Any = None, persist: bool = True):
+        self.embedder = embedder
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[str, EmbeddingIndex]" = OrderedDict()
+        self._latest: Optional[EmbeddingIndex] = None
+        self._loaded = False
+        self._stats = {"builds": 0, "rows_embedded": 0, "rows_reused": 0}
+
+    def _get_embedder(self) -> Any:
+        if self.embedder is None:
+            self.embedder = HashingEmbedder()
+        return self.embedder
+
+    def get_index(self, catalog: CourseCatalog) -> EmbeddingIndex:
+        """
+        カタログに対応するインデックスを取得する
+
+        Args:
+            catalog: 講座カタログ
+
+        Returns:
+            EmbeddingIndex
+        """
+        with self._lock:
+            index = self._indexes.get(catalog.version)
+            if index is not None:
+                self._indexes.move_to_end(catalog.version)
+                return index
+
+            if not self._loaded:
+                self._loaded = True
+                if self.persist:
+                    self._latest = load_embedding_index()
+
+            embedder = self._get_embedder()
+            index, embedded = build_embedding_index(catalog, embedder, previous=self._latest)
+            self._stats["builds"] += 1
+            self._stats["rows_embedded"] += embedded
+            self._stats["rows_reused"] += len(index) - embedded
+            if self.persist and (embedded or self._latest is None or self._latest.version != index.version):
+                save_embedding_index(index)
+
+            self._latest = index
+            self._indexes[catalog.version] = index
+            while len(self._indexes) > _INDEX_CACHE_SIZE:
+                self._indexes.popitem(last=False)
+            return index
+
+    def search(
+        self,
+        query: str,
+        catalog: CourseCatalog,
+        top_k: int = DEFAULT_TOP_K,
+        allowed: Optional[AbstractSet[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        質問に近い講座を検索する
+
+        Args:
+            query: 検索クエリ
+            catalog: 講座カタログ
+            top_k: 返す件数
+            allowed: 対象にする講座の位置。Noneなら全件
+
+        Returns:
+            (カタログ内の位置, コサイン類似度) のリスト（類似度の高い順）
+        """
+        index = self.get_index(catalog)
+        query_vector = self._get_embedder().embed([query])[0]
+        return index.search(query_vector, top_k, allowed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, versions=len(self._indexes))
+
+
+_embedding_store = EmbeddingStore()
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """プロセス共通のEmbeddingStoreを取得"""
+    return _embedding_store
@@ -0,0 +1,262 @@
+"""
+講座の絞り込み（ファセット）
+対象年齢を月齢の区間に、コース名・クラス名をファセットに変換し、
+質問から読み取った子どもの月齢・話題に合う講座だけを検索・プロンプトの対象にする
+"""
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from services.catalog import CourseCatalog
+
+
+# 話題と、その話題を表す語
+# 質問の判定に使うほか、話題名・語を名前に含むクラス（なければコース）をその話題の講座とみなす。
+# クラス名・コース名は講座データから読み取るため、名前が変わっても語を含んでいれば対応は保たれる
+TOPIC_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "ねんね": ("ねんね", "夜泣き", "寝かしつけ", "睡眠", "寝ない", "昼寝", "夜間断乳", "朝寝"),
+    "ごはん": ("離乳食", "幼児食", "ごはん", "ご飯", "食事", "偏食", "食べ"),
+    "英語": ("英語", "英会話", "バイリンガル", "フォニックス"),
+    "モンテッソーリ": ("モンテ", "モンテッソーリ", "おしごと"),
+    "知育": ("知育", "絵本", "ひらがな", "パズル"),
+    "発達": ("発達", "寝返り", "ずりばい", "はいはい", "ハイハイ", "つかまり立ち", "歩かない", "運動"),
+}
+
+# 年齢の上限（対象年齢が「0～6歳」なら6歳11ヶ月まで）
+_MONTHS_PER_YEAR = 12
+
+_YEAR_UNIT = r"(?:歳|才)"
+_MONTH_UNIT = r"(?:ヶ月|ケ月|か月|カ月|ヵ月)"
+_RANGE_SEPARATOR = r"\s*[~〜～\-ー－]\s*"
+
+# 「0～6歳」「6ヶ月～2歳」「3歳～」など
+_RANGE_PATTERN = re.compile(
+    rf"(\d+(?:\.\d+)?)\s*({_YEAR_UNIT}|{_MONTH_UNIT})?{_RANGE_SEPARATOR}(\d+(?:\.\d+)?)?\s*({_YEAR_UNIT}|{_MONTH_UNIT})?"
+)
+# 「1歳半」「1歳3ヶ月」「生後3ヶ月」「2才」
+_AGE_PATTERN = re.compile(rf"(\d+)\s*{_YEAR_UNIT}\s*(半|(\d+)\s*{_MONTH_UNIT})?|(\d+)\s*{_MONTH_UNIT}")
+_NEWBORN_PATTERN = re.compile(r"新生児|生まれたばかり")
+
+# データバージョンごとに保持するインデックスの数
+_INDEX_CACHE_SIZE = 4
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "")
+
+
+def _to_months(value: str, unit: Optional[str]) -> int:
+    number = float(value)
+    if unit and re.fullmatch(_YEAR_UNIT, unit):
+        return int(number * _MONTHS_PER_YEAR)
+    return int(number)
+
+
+def parse_age_range(text: str) -> Optional[Tuple[int, int]]:
+    """
+    対象年齢の文字列を月齢の区間に変換する
+
+    Args:
+        text: 対象年齢（例: "0～6歳", "6ヶ月～2歳", "3歳"）
+
+    Returns:
+        (下限の月齢, 上限の月齢)。年齢の指定がない・読み取れない場合はNone
+    """
+    text = _normalize(text)
+    match = _RANGE_PATTERN.search(text)
+    if match:
+        low, low_unit, high, high_unit = match.groups()
+        # 「0～6歳」のように単位が片方だけの場合は同じ単位とみなす
+        low_unit = low_unit or high_unit
+        if high is None:
+            return _to_months(low, low_unit), _MONTHS_PER_YEAR * 100
+        upper = _to_months(high, high_unit)
+        if high_unit is None or re.fullmatch(_YEAR_UNIT, high_unit):
+            upper += _MONTHS_PER_YEAR - 1
+        return _to_months(low, low_unit), upper
+    age = extract_age_months(text)
+    if age is None:
+        return None
+    if re.search(_YEAR_UNIT, text) and not re.search(_MONTH_UNIT, text):
+        return age, age + _MONTHS_PER_YEAR - 1
+    return age, age
+
+
+def extract_age_months(text: str) -> Optional[int]:
+    """
+    質問から子どもの月齢を読み取る（最初に見つかったもの）
+
+    Args:
+        text: ユーザーの質問（例: "生後3ヶ月の夜泣き", "1歳半の離乳食"）
+
+    Returns:
+        月齢。読み取れない場合はNone
+    """
+    text = _normalize(text)
+    if _NEWBORN_PATTERN.search(text):
+        return 0
+    match = _AGE_PATTERN.search(text)
+    if not match:
+        return None
+    years, extra, extra_months, months = match.groups()
+    if months is not None:
+        return int(months)
+    age = int(years) * _MONTHS_PER_YEAR
+    if extra == "半":
+        age += 6
+    elif extra_months is not None:
+        age += int(extra_months)
+    return age
+
+
+def topic_facets(topic: str, class_names: List[str], course_names: List[str]) -> List[str]:
+    """
+    話題に対応するクラス名（該当するクラスがなければコース名）を返す
+
+    Args:
+        topic: 話題（TOPIC_KEYWORDS のキー）
+        class_names: 講座データのクラス名
+        course_names: 講座データのコース名
+
+    Returns:
+        話題名か話題の語を名前に含むクラス名・コース名
+    """
+    words = [_normalize(word) for word in (topic,) + TOPIC_KEYWORDS.get(topic, ())]
+    for names in (class_names, course_names):
+        matched = [name for name in names if any(word in _normalize(name) for word in words)]
+        if matched:
+            return matched
+    return []
+
+
+def extract_topics(text: str) -> List[str]:
+    """
+    質問から話題を読み取る
+
+    Args:
+        text: ユーザーの質問
+
+    Returns:
+        話題のリスト（TOPIC_KEYWORDS のキー、定義の順）
+    """
+    text = _normalize(text)
+    return [topic for topic, keywords in TOPIC_KEYWORDS.items() if any(keyword in text for keyword in keywords)]
+
+
+@dataclass(frozen=True)
+class FacetQuery:
+    """質問から読み取った絞り込み条件"""
+
+    age_months: Optional[int] = None
+    topics: Tuple[str, ...] = ()
+
+    @property
+    def is_empty(self) -> bool:
+        return self.age_months is None and not self.topics
+
+
+def extract_facets(text: str) -> FacetQuery:
+    """質問から月齢と話題を読み取る"""
+    return FacetQuery(age_months=extract_age_months(text), topics=tuple(extract_topics(text)))
+
+
+class FacetIndex:
+    """
+    講座の対象年齢（月齢の区間）と話題のインデックス
+
+    位置はカタログ内の講座の位置と一致する。対象年齢が読み取れない講座（「なし」など）は
+    どの月齢にも該当するものとして扱う。話題はカタログのクラス名・コース名から対応付け（topic_facets()）、
+    対応するクラス・コースがない話題は unmatched_topics に入れてログに出す。
+    """
+
+    def __init__(self, catalog: CourseCatalog):
+        self.version = catalog.version
+        self._all = frozenset(range(len(catalog)))
+        self._intervals: List[Optional[Tuple[int, int]]] = [parse_age_range(course.target_age) for course in catalog]
+        facets: Dict[str, set] = {}
+        for position, course in enumerate(catalog):
+            for value in (course.course_name, course.class_name):
+                if value:
+                    facets.setdefault(value, set()).add(position)
+        class_names, course_names = catalog.class_names(), catalog.course_names()
+        self._topics: Dict[str, FrozenSet[int]] = {}
+        self.topic_facets: Dict[str, List[str]] = {}
+        for topic in TOPIC_KEYWORDS:
+            names = topic_facets(topic, class_names, course_names)
+            self.topic_facets[topic] = names
+            self._topics[topic] = frozenset(position for name in names for position in facets.get(name, ()))
+        self.unmatched_topics = tuple(topic for topic, names in self.topic_facets.items() if not names)
+        if self.unmatched_topics and catalog:
+            print(
+                f"話題に対応するクラス・コースがありません: {', '.join(self.unmatched_topics)}"
+                "（クラス名が変わった場合は services/facets.py の TOPIC_KEYWORDS を確認してください）"
+            )
+        self._age_cache: Dict[int, FrozenSet[int]] = {}
+
+    def for_age(self, age_months: int) -> FrozenSet[int]:
+        """月齢が対象年齢に含まれる講座の位置"""
+        positions = self._age_cache.get(age_months)
+        if positions is None:
+            positions = frozenset(
+                position
+                for position, interval in enumerate(self._intervals)
+                if interval is None or interval[0] <= age_months <= interval[1]
+            )
+            self._age_cache[age_months] = positions
+        return positions
+
+    def for_topics(self, topics: Tuple[str, ...]) -> FrozenSet[int]:
+        """話題に該当する講座の位置"""
+        positions: FrozenSet[int] = frozenset()
+        for topic in topics:
+            positions |= self._topics.get(topic, frozenset())
+        return positions
+
+    def filter(self, query: FacetQuery) -> Tuple[Optional[FrozenSet[int]], Optional[FrozenSet[int]]]:
+        """
+        条件に合う講座の位置を返す
+
+        Args:
+            query: 絞り込み条件
+
+        Returns:
+            (月齢と話題の両方に合う講座の位置, 月齢に合う講座の位置)。
+            該当がない・条件がない場合はそれぞれNone（絞り込まない）
+        """
+        by_age = self.for_age(query.age_months) if query.age_months is not None else None
+        by_topic = None
+        if query.topics:
+            by_topic = self.for_topics(query.topics)
+            if by_age is not None:
+                by_topic &= by_age
+        return by_topic or None, by_age or None
+
+
+_index_cache: "OrderedDict[str, FacetIndex]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_facet_index(catalog: CourseCatalog) -> FacetIndex:
+    """
+    カタログに対応するファセットインデックスを取得する（データバージョンごとに一度だけ構築）
+
+    Args:
+        catalog: 講座カタログ
+
+    Returns:
+        FacetIndex
+    """
+    with _index_cache_lock:
+        index = _index_cache.get(catalog.version)
+        if index is not None:
+            _index_cache.move_to_end(catalog.version)
+            return index
+
+    index = FacetIndex(catalog)
+    with _index_cache_lock:
+        _index_cache[catalog.version] = index
+        while len(_index_cache) > _INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
@@ -1,35 +1,402 @@
 # ナレッジ（ガイドライン）読み込みサービス
+import functools
+import hashlib
 import os
-from typing import Optional
+import re
+import threading
+import unicodedata
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple, Union
 
 
-def load_default_guidelines() -> Optional[str]:
+# デフォルトのガイドラインのファイル
+DEFAULT_GUIDELINES_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "guidelines.md")
+
+# バージョンの長さ（sha1 の先頭の文字数）
+_VERSION_LENGTH = 16
+
+
+def guideline_version(text: str) -> str:
+    """ガイドラインの内容から求めたバージョン（sha1 の先頭16文字）"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:_VERSION_LENGTH]
+
+
+@dataclass(frozen=True)
+class GuidelineDocument:
+    """
+    読み込み済みのガイドライン（イミュータブル）
+
+    同じ内容のガイドラインは GuidelineStore で1つのオブジェクトにまとめる。
+    比較・ハッシュは version だけで行うため、プロンプト・索引・応答キャッシュのキーにそのまま使える
+
+    text: ガイドラインのテキスト
+    version: 内容から求めたバージョン
+    source: 読み込み元（"default" / "upload" など）
+    """
+
+    text: str = field(compare=False, repr=False)
+    version: str
+    source: str = field(default="", compare=False)
+
+    def __str__(self) -> str:
+        return self.text
+
+
+# ガイドラインとして受け付ける型（テキストまたは読み込み済みのガイドライン）
+GuidelineData = Union[str, GuidelineDocument, None]
+
+
+class GuidelineStore:
+    """
+    ガイドラインの読み込みと共有
+
+    - 内容のハッシュ（version）で同じガイドラインを1つのオブジェクトにまとめる（使われなくなったものは破棄）
+    - ファイルは更新時刻と大きさが変わった場合だけ読み直す
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents: "weakref.WeakValueDictionary[str, GuidelineDocument]" = weakref.WeakValueDictionary()
+        self._files: Dict[str, Tuple[int, int, Optional[GuidelineDocument]]] = {}
+        self._stats = {"file_reads": 0, "file_hits": 0, "interned": 0, "shared": 0}
+
+    def intern(self, text: Optional[str], source: str = "") -> Optional[GuidelineDocument]:
+        """
+        テキストをガイドラインにする（同じ内容のものがあればそれを返す）
+
+        Args:
+            text: ガイドラインのテキスト
+            source: 読み込み元
+
+        Returns:
+            GuidelineDocument、テキストが空ならNone
+        """
+        text = (text or "").strip()
+        if not text:
+            return None
+        version = guideline_version(text)
+        with self._lock:
+            document = self._documents.get(version)
+            if document is not None:
+                self._stats["shared"] += 1
+                return document
+            document = GuidelineDocument(text=text, version=version, source=source)
+            self._documents[version] = document
+            self._stats["interned"] += 1
+            return document
+
+    def load_file(self, path: str, source: str = "") -> Optional[GuidelineDocument]:
+        """
+        ファイルからガイドラインを読み込む（更新時刻と大きさが前回と同じなら読み直さない）
+
+        Args:
+            path: ファイルのパス
+            source: 読み込み元
+
+        Returns:
+            GuidelineDocument、ファイルがない・読めない場合はNone
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached[:2] == signature:
+                self._stats["file_hits"] += 1
+                return cached[2]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except Exception as e:
+            print(f"ガイドライン読み込みエラー: {e}")
+            return None
+        # 読み込み済みのファイルは強参照で保持する（WeakValueDictionary から消えないように）
+        document = self.intern(text, source or os.path.basename(path))
+        with self._lock:
+            self._files[path] = (signature[0], signature[1], document)
+            self._stats["file_reads"] += 1
+        return document
+
+    def stats(self) -> Dict[str, int]:
+        """ファイルの読み込み回数・共有したガイドラインの数などを返す"""
+        with self._lock:
+            return dict(self._stats, documents=len(self._documents))
+
+
+_guideline_store = GuidelineStore()
+
+
+def get_guideline_store() -> GuidelineStore:
+    """プロセス共通のGuidelineStoreを取得"""
+    return _guideline_store
+
+
+def as_guidelines(guidelines: GuidelineData) -> Optional[GuidelineDocument]:
+    """
+    テキストまたはガイドラインを GuidelineDocument に揃える
+
+    Returns:
+        GuidelineDocument、空の場合はNone
+    """
+    if guidelines is None or isinstance(guidelines, GuidelineDocument):
+        return guidelines
+    return _guideline_store.intern(guidelines)
+
+
+def load_default_guidelines() -> Optional[GuidelineDocument]:
     """
     デフォルトのガイドラインを読み込む。
-    data/guidelines.md を返す。存在しなければ None。
+    data/guidelines.md を返す（前回から変更がなければ読み直さない）。存在しなければ None。
     """
-    base_dir = os.path.dirname(__file__)
-    path = os.path.join(base_dir, "..", "data", "guidelines.md")
-    if not os.path.exists(path):
-        return None
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception:
-        return None
+    return _guideline_store.load_file(DEFAULT_GUIDELINES_PATH, "default")
 
 
-def load_guidelines_from_text(content: Optional[str]) -> Optional[str]:
-    """アップロードや入力テキストからガイドラインを受け取り、そのまま返す。"""
-    if not content:
-        return None
-    text = content.strip()
-    return text if text else None
+def load_guidelines_from_text(content: Optional[str]) -> Optional[GuidelineDocument]:
+    """アップロードや入力テキストからガイドラインを受け取る（同じ内容なら共有する）。"""
+    return _guideline_store.intern(content, "upload")
 
 
-def resolve_guidelines(upload_text: Optional[str] = None) -> Optional[str]:
+def resolve_guidelines(upload_text: GuidelineData = None) -> Optional[GuidelineDocument]:
     """
     ガイドラインを決定する。
     優先順位: アップロード/入力 > デフォルトファイル。
     """
+    if isinstance(upload_text, GuidelineDocument):
+        return upload_text
     return load_guidelines_from_text(upload_text) or load_default_guidelines()
+
+
+# ----------------------------------------------------------------------------
+# 見出しごとのセクション分割と、質問に関係するセクションの選択
+# ----------------------------------------------------------------------------
+
+# 見出しにこれらの語を含むセクションは、質問に関係なく常にプロンプトに含める（運営方針など）
+ALWAYS_ON_HEADINGS = ("概要", "方針", "コンセプト", "ルール", "注意事項")
+
+# 1回のプロンプトに含める、質問に関係するセクションの最大数
+MAX_MATCHED_SECTIONS = 3
+
+# 最も関連度の高いセクションに対して、これ未満の関連度のセクションは含めない
+MIN_RELATIVE_SCORE = 0.5
+
+# 見出しから取り出したキーワードの末尾から除く語（「退会手続き」→「退会」）
+_TITLE_SUFFIXES = ("の悩み", "について", "手続き", "の活用", "設定", "制度", "機能", "方法")
+
+# どのセクションにも出てくるため、キーワードとして使わない語
+_STOP_TERMS = frozenset(("育児", "子育て", "悩み", "相談", "子ども", "子供", "こども", "内容", "手順"))
+
+# キーワードとして使う語の文字数
+_MIN_TERM_CHARS = 2
+_MAX_TERM_CHARS = 12
+
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+_RULE_PATTERN = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_NUMBER_PATTERN = re.compile(r"^[\d０-９]+[.．、)）]\s*")
+_TERM_SEPARATOR_PATTERN = re.compile(r"[、,，・/／（）()【】\[\]「」『』:：\s]+")
+_EMPHASIS_PATTERN = re.compile(r"\*\*(.+?)\*\*|「(.+?)」|【(.+?)】")
+
+
+def _normalize_term(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower().strip()
+
+
+def _split_terms(text: str) -> List[str]:
+    """見出し・強調語をキーワードに分ける"""
+    terms = []
+    for piece in _TERM_SEPARATOR_PATTERN.split(_normalize_term(_NUMBER_PATTERN.sub("", text))):
+        head, _, rest = piece.partition("の")
+        if head in _STOP_TERMS and rest:
+            piece = rest
+        for suffix in _TITLE_SUFFIXES:
+            if piece.endswith(suffix) and len(piece) - len(suffix) >= _MIN_TERM_CHARS:
+                piece = piece[: -len(suffix)]
+                break
+        if _MIN_TERM_CHARS <= len(piece) <= _MAX_TERM_CHARS and piece not in _STOP_TERMS:
+            terms.append(piece)
+    return terms
+
+
+@dataclass
+class GuidelineSection:
+    """
+    ガイドラインの見出し1つ分
+
+    heading: 見出しの行（"### 【ご飯・食事の悩み】" など）
+    title: 見出しの文字列
+    level: 見出しのレベル（# の数）
+    body: 見出しの直下の本文（子の見出しより前の部分）
+    parent: 親の見出しの位置（なければ None）
+    children: 子の見出しの位置
+    title_terms: 見出しから取り出したキーワード
+    terms: 本文の強調語・話題の関連語を含むキーワード
+    always_on: 質問に関係なく常に含めるかどうか
+    """
+
+    heading: str
+    title: str
+    level: int
+    body: str = ""
+    parent: Optional[int] = None
+    children: List[int] = field(default_factory=list)
+    title_terms: FrozenSet[str] = frozenset()
+    terms: FrozenSet[str] = frozenset()
+    always_on: bool = False
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self.children
+
+    def render(self) -> str:
+        return f"{self.heading}\n{self.body}".rstrip()
+
+
+class GuidelineOutline:
+    """
+    Markdownのガイドラインを見出しの木に分け、質問に関係するセクションを選ぶ
+
+    - 見出しより前の部分・ALWAYS_ON_HEADINGS を含む見出しの配下・
+      子を持つ見出しの直下の本文（「お悩みを相談されたら」の案内ルールなど）は常に含める
+    - それ以外の見出し（「【ねんね、寝かしつけ、夜泣きの悩み】」など）は、質問にキーワードが
+      含まれる場合だけ含める。キーワードは見出し・強調語（**…** / 「…」）と、
+      services.facets.TOPIC_KEYWORDS で同じ話題に属する語
+    """
+
+    def __init__(self, text: str):
+        self.preamble = ""
+        self.sections: List[GuidelineSection] = []
+        self._parse(text or "")
+        for section in self.sections:
+            self._classify(section)
+
+    def _parse(self, text: str) -> None:
+        stack: List[int] = []
+        body: List[str] = []
+        in_fence = False
+
+        def flush() -> None:
+            content = "\n".join(line for line in body if not _RULE_PATTERN.match(line)).strip()
+            if self.sections:
+                self.sections[-1].body = content
+            else:
+                self.preamble = content
+            body.clear()
+
+        for line in text.splitlines():
+            if _FENCE_PATTERN.match(line):
+                in_fence = not in_fence
+            match = None if in_fence else _HEADING_PATTERN.match(line)
+            if match is None:
+                body.append(line)
+                continue
+            flush()
+            level = len(match.group(1))
+            while stack and self.sections[stack[-1]].level >= level:
+                stack.pop()
+            parent = stack[-1] if stack else None
+            position = len(self.sections)
+            self.sections.append(GuidelineSection(heading=line.strip(), title=match.group(2), level=level, parent=parent))
+            if parent is not None:
+                self.sections[parent].children.append(position)
+            stack.append(position)
+        flush()
+
+    def _ancestors(self, section: GuidelineSection) -> List[GuidelineSection]:
+        ancestors = []
+        while section.parent is not None:
+            section = self.sections[section.parent]
+            ancestors.append(section)
+        return ancestors
+
+    def _classify(self, section: GuidelineSection) -> None:
+        from services.facets import TOPIC_KEYWORDS
+
+        lineage = [section] + self._ancestors(section)
+        section.always_on = any(word in item.title for item in lineage for word in ALWAYS_ON_HEADINGS)
+
+        title_terms = set(_split_terms(section.title))
+        terms = set(title_terms)
+        for groups in _EMPHASIS_PATTERN.findall(section.body):
+            for emphasized in groups:
+                if emphasized:
+                    terms.update(_split_terms(emphasized))
+        searchable = _normalize_term(section.title + "\n" + section.body)
+        for topic, keywords in TOPIC_KEYWORDS.items():
+            related = [_normalize_term(word) for word in keywords]
+            if any(word in _normalize_term(section.title) for word in related + [_normalize_term(topic)]):
+                terms.update(related)
+            elif sum(word in searchable for word in related) >= 2:
+                terms.update(related)
+        section.title_terms = frozenset(title_terms)
+        section.terms = frozenset(terms)
+
+    def _is_static(self, section: GuidelineSection) -> bool:
+        """前半部分（全リクエスト共通）に含めるかどうか"""
+        return section.always_on or not section.is_leaf
+
+    def static_text(self) -> str:
+        """
+        常に含める部分（見出しより前の部分・運営方針・子を持つ見出しの直下の本文）と、
+        質問に応じて選ぶ見出しの一覧
+
+        Returns:
+            全リクエストで共通のガイドラインのテキスト
+        """
+        blocks = [self.preamble] if self.preamble else []
+        for section in self.sections:
+            if section.always_on or (not section.is_leaf and section.body):
+                blocks.append(section.render())
+        titles = [section.title for section in self.sections if not self._is_static(section)]
+        if titles:
+            blocks.append(
+                "（次の項目は、質問に関係する場合に「質問に関連するガイドライン」として示します: "
+                + " / ".join(titles)
+                + "）"
+            )
+        return "\n\n".join(block for block in blocks if block)
+
+    def select(self, query: str, limit: int = MAX_MATCHED_SECTIONS) -> List[GuidelineSection]:
+        """
+        質問に関係するセクションを関連度の高い順に選ぶ
+
+        Args:
+            query: ユーザーの質問
+            limit: 選ぶセクションの最大数
+
+        Returns:
+            セクションのリスト（該当なしは空）。最も関連度の高いセクションの
+            MIN_RELATIVE_SCORE 倍に満たないセクションは含めない
+        """
+        text = _normalize_term(query)
+        if not text:
+            return []
+        scored = []
+        for position, section in enumerate(self.sections):
+            if self._is_static(section):
+                continue
+            score = sum(len(term) * (2 if term in section.title_terms else 1) for term in section.terms if term in text)
+            if score:
+                scored.append((-score, position, section))
+        scored.sort(key=lambda item: item[:2])
+        best = -scored[0][0] if scored else 0
+        return [section for score, _, section in scored[:limit] if -score >= best * MIN_RELATIVE_SCORE]
+
+    def render_section(self, section: GuidelineSection) -> str:
+        """親の見出しを「 > 」でつないだ見出しと本文"""
+        path = [item.title for item in reversed(self._ancestors(section)) if item.level > 1]
+        heading = "#" * max(section.level, 2) + " " + " > ".join(path + [section.title])
+        return f"{heading}\n{section.body}".rstrip()
+
+
+def get_guideline_outline(guidelines: GuidelineData) -> GuidelineOutline:
+    """ガイドラインを見出しの木に分ける（同じバージョンは分割済みのものを返す）"""
+    return _outline_for(as_guidelines(guidelines))
+
+
+@functools.lru_cache(maxsize=8)
+def _outline_for(document: Optional[GuidelineDocument]) -> GuidelineOutline:
+    return GuidelineOutline(document.text if document else "")
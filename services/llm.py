@@ -1,8 +1,219 @@
 """Gemini LLM呼び出しサービス"""
-import google.generativeai as genai
-from typing import Optional, List
-from config import get_gemini_api_key
-from prompts import build_system_prompt
+import threading
+import time
+from typing import Optional, List, Dict, Any, Tuple, Iterator, Union
+from config import get_gemini_api_key, get_settings
+from services.catalog import CourseCatalog, as_catalog
+from services.conversation import ConversationContext
+from services.knowledge import GuidelineData, as_guidelines
+from services.metrics import incr, record_stage, stage
+from services.context_cache import ContextCacheManager, GeminiContextProvider
+from services.prompt_builder import PREFIX_SEPARATOR, assemble_prompt_parts
+from services.recommendations import (
+    STRUCTURED_GENERATION_CONFIG,
+    looks_like_json,
+    parse_structured_answer,
+    render_structured_answer,
+    salvage_empathy,
+)
+from services.concurrency import SlotReleasingIterator, call_with_retry, get_limiter, run_in_executor
+from services.response_cache import content_version, get_response_cache
+from services.search import DEFAULT_TOP_K
+from services.sheets import find_courses
+
+# 講座データとして受け付ける型（CSV文字列またはカタログ）
+CourseData = Union[str, CourseCatalog, None]
+
+
+# モデルの優先順位（上から順に試す）
+# 先頭は共通の前半部分（約1.5k〜4kトークン）をコンテキストキャッシュできるモデル
+# （services/context_cache.py の MIN_CACHE_TOKENS_BY_MODEL。1.5系は最小32kトークンのため毎回送られる）
+PREFERRED_MODELS = [
+    'gemini-2.5-flash',
+    'gemini-1.5-flash',
+    'gemini-1.5-pro',
+    'gemini-pro',
+]
+
+# 解決済みモデルを再利用する時間（秒）。経過後は次の呼び出しで再解決する
+MODEL_CACHE_TTL_SECONDS = 60 * 60
+
+_configure_lock = threading.Lock()
+_configured_api_key: Optional[str] = None
+
+# google.generativeai（読み込みに時間がかかるため、最初に使うときに読み込む）
+# テスト・ベンチマークでは bench/fake_genai.py がこの変数を差し替える
+genai: Any = None
+_import_lock = threading.Lock()
+
+
+def get_genai() -> Any:
+    """google.generativeai を返す（初回のみ読み込む）"""
+    global genai
+    if genai is None:
+        with _import_lock:
+            if genai is None:
+                import google.generativeai
+
+                genai = google.generativeai
+    return genai
+
+
+def _configure(api_key: str) -> None:
+    """APIキーが変わったときだけ genai.configure を呼ぶ"""
+    global _configured_api_key
+    with _configure_lock:
+        if _configured_api_key != api_key:
+            get_genai().configure(api_key=api_key)
+            _configured_api_key = api_key
+
+
+def _is_not_found_error(error: Exception) -> bool:
+    """モデルが見つからない（404）エラーかどうか"""
+    error_str = str(error)
+    return "404" in error_str or "not found" in error_str.lower()
+
+
+class ModelResolver:
+    """
+    利用するGeminiモデルを解決し、GenerativeModelをプロセス全体で使い回す。
+
+    - 最初の呼び出しで利用可能なモデル一覧を取得し、優先順位に従ってモデルを決める
+    - 以降はTTLが切れるまで同じインスタンスを返す（Streamlitのセッション間でも共有）
+    - 404エラーなどで invalidate() された場合は次の呼び出しで再解決する
+    - ヒット/ミス回数を stats() で確認できる
+
+    genai はモジュール変数を呼び出し時に参照する（get_genai()）ため、テストでは
+    services.llm.genai をスタブに差し替えて reset_model_cache() すればよい。
+    """
+
+    def __init__(
+        self,
+        preferred_models: Optional[List[str]] = None,
+        ttl_seconds: float = MODEL_CACHE_TTL_SECONDS,
+    ):
+        self.preferred_models = list(preferred_models or PREFERRED_MODELS)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._api_key: Optional[str] = None
+        self._model_name: Optional[str] = None
+        self._model: Any = None
+        self._available_models: Optional[List[str]] = None
+        self._resolved_at = 0.0
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "invalidations": 0}
+
+    def _is_fresh(self, api_key: str) -> bool:
+        return (
+            self._model is not None
+            and self._api_key == api_key
+            and time.monotonic() - self._resolved_at < self.ttl_seconds
+        )
+
+    def _load_available_models(self, api_key: str) -> List[str]:
+        if self._available_models is None or self._api_key != api_key:
+            self._available_models = list_available_models()
+        return self._available_models
+
+    def _resolve(self, api_key: str) -> None:
+        """優先順位に従ってモデルを決める（ロック取得済みで呼ぶこと）"""
+        _configure(api_key)
+        # TTL切れ・無効化後はモデル一覧も取り直す
+        self._available_models = None
+        available_models = self._load_available_models(api_key)
+        self._api_key = api_key
+
+        candidates = [name for name in self.preferred_models if name in available_models]
+        # 利用可能なモデル一覧から選べなかった場合は優先モデルを直接試す
+        candidates += [name for name in self.preferred_models if name not in candidates]
+
+        last_error = None
+        for model_name in candidates:
+            try:
+                model = get_genai().GenerativeModel(model_name)
+            except Exception as e:
+                last_error = e
+                continue
+            self._model_name = model_name
+            self._model = model
+            self._resolved_at = time.monotonic()
+            return
+
+        error_msg = "モデルの初期化に失敗しました。\n"
+        if available_models:
+            error_msg += f"利用可能なモデル: {', '.join(available_models[:10])}\n"
+        if last_error:
+            error_msg += f"エラー詳細: {str(last_error)}"
+        raise ValueError(error_msg)
+
+    def get_model(self, api_key: str) -> Tuple[str, Any]:
+        """
+        解決済みのモデルを返す。未解決・期限切れの場合は解決してから返す。
+
+        Returns:
+            (モデル名, GenerativeModelインスタンス)
+        """
+        with self._lock:
+            if self._is_fresh(api_key):
+                self._stats["hits"] += 1
+                return self._model_name, self._model
+            self._stats["misses"] += 1
+            if self._model is not None:
+                self._stats["refreshes"] += 1
+            self._resolve(api_key)
+            return self._model_name, self._model
+
+    def available_models(self, api_key: str) -> List[str]:
+        """キャッシュ済みの利用可能モデル一覧を返す（未取得なら取得する）"""
+        with self._lock:
+            _configure(api_key)
+            return list(self._load_available_models(api_key))
+
+    def adopt(self, model_name: str, model: Any) -> None:
+        """代替モデルで生成に成功した場合、以降はそのモデルを使う"""
+        with self._lock:
+            self._model_name = model_name
+            self._model = model
+            self._resolved_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """解決済みモデルを破棄し、次回呼び出しで再解決させる"""
+        with self._lock:
+            if self._model is not None:
+                self._stats["invalidations"] += 1
+            self._model_name = None
+            self._model = None
+            self._available_models = None
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュの統計情報を返す"""
+        with self._lock:
+            return dict(self._stats, model=self._model_name)
+
+
+_model_resolver = ModelResolver()
+
+
+def get_model_resolver() -> ModelResolver:
+    """プロセス共通のModelResolverを取得"""
+    return _model_resolver
+
+
+# 共通の前半部分を登録済みのモデル（genai は get_genai() で呼び出し時に参照するためスタブに差し替えられる）
+_context_cache = ContextCacheManager(GeminiContextProvider(get_genai))
+
+
+def get_context_cache() -> ContextCacheManager:
+    """プロセス共通のContextCacheManagerを取得"""
+    return _context_cache
+
+
+def reset_model_cache() -> None:
+    """モデルキャッシュ・コンテキストキャッシュと統計を初期化する（テスト・設定変更用）"""
+    global _model_resolver, _context_cache, _configured_api_key
+    with _configure_lock:
+        _configured_api_key = None
+    _model_resolver = ModelResolver()
+    _context_cache = ContextCacheManager(GeminiContextProvider(get_genai))
 
 
 def initialize_gemini() -> bool:
@@ -10,7 +221,7 @@ def initialize_gemini() -> bool:
     api_key = get_gemini_api_key()
     if not api_key:
         return False
-    genai.configure(api_key=api_key)
+    _configure(api_key)
     return True
 
 
@@ -20,8 +231,8 @@ def list_available_models() -> List[str]:
         api_key = get_gemini_api_key()
         if not api_key:
             return []
-        genai.configure(api_key=api_key)
-        models = genai.list_models()
+        _configure(api_key)
+        models = get_genai().list_models()
         model_names = []
         for m in models:
             if 'generateContent' in m.supported_generation_methods:
@@ -33,128 +244,299 @@ def list_available_models() -> List[str]:
         return []
 
 
-def _build_prompt(user_input: str, course_data: Optional[str], guidelines: Optional[str]) -> str:
+def _build_prompt(user_input: str, course_data: CourseData, guidelines: GuidelineData) -> str:
     """
     ガイドラインと講座データを統合したプロンプトを組み立てる。
+    講座データは質問に関連する上位の講座だけを含め、全体をトークン予算内に収める。
     """
-    system_prompt = build_system_prompt(guidelines or "")
-    if course_data:
-        return f"""{system_prompt}
-
-# 講座データベース（CSV形式）
-{course_data}
+    prefix, request_part = _build_prompt_parts(user_input, as_catalog(course_data), guidelines)
+    return prefix + PREFIX_SEPARATOR + request_part
 
-上記の講座データベースを参考に、以下のユーザーの悩みに対して適切な講座を2〜3件提案してください。
 
-ユーザーの悩み：
-{user_input}
-"""
-
-    return f"""{system_prompt}
+def _build_prompt_parts(
+    user_input: str,
+    catalog: Optional[CourseCatalog],
+    guidelines: GuidelineData,
+    conversation: Optional[ConversationContext] = None,
+    structured: bool = False,
+) -> Tuple[str, str]:
+    """
+    プロンプトを「全リクエスト共通の前半部分」と「リクエストごとの後半部分」に分けて組み立てる。
+    会話の文脈がある場合は、案内済みの講座を講座データから除き、会話の要約を含める。
+    structured の場合は、講座IDを含む講座データとJSONでの回答の指示を含める。
+    """
+    conversation = conversation or ConversationContext()
+    courses = None
+    recommended_titles = []
+    query = conversation.retrieval_query or user_input
+    if catalog:
+        excluded = conversation.recommended_ids
+        candidates = find_courses(query, catalog, DEFAULT_TOP_K + len(excluded))
+        courses = [course for course in candidates if course.course_id not in excluded][:DEFAULT_TOP_K]
+        if not courses:
+            # 該当する講座がない場合は、講座を選ばせない指示になる（services/prompt_builder.py）
+            incr("retrieval_empty")
+        recommended_titles = [
+            catalog.get(course_id).title for course_id in sorted(excluded) if catalog.get(course_id) is not None
+        ]
+    prefix, request_part, _metrics = assemble_prompt_parts(
+        user_input,
+        courses,
+        guidelines,
+        history=conversation.history,
+        recommended_titles=recommended_titles,
+        guideline_query=query,
+        structured=structured and courses is not None,
+    )
+    return prefix, request_part
 
-ユーザーの悩み：
-{user_input}
 
-上記の悩みに対して、優しく共感しながら応答してください。名前を呼ぶ必要はありません。温かくサポートする姿勢で回答してください。
-"""
+def _iter_text(response: Any) -> Iterator[str]:
+    """ストリーミング応答からテキストのチャンクだけを取り出す"""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # セーフティフィルタ等でテキストを持たないチャンクは読み飛ばす
+            continue
+        if text:
+            yield text
 
 
-def generate_response(user_input: str, course_data: Optional[str] = None, guidelines: Optional[str] = None) -> str:
+def _start_stream(
+    model: Any, prompt: str, generation_config: Optional[Dict[str, Any]] = None
+) -> Tuple[Optional[str], SlotReleasingIterator]:
     """
-    ユーザーの入力に対してGeminiで回答を生成
+    ストリーミング生成を開始し、最初のチャンクまで受け取る。
+    モデルのエラー（404など）は最初のチャンクまでに発生するため、ここで検知できる。
     
-    Args:
-        user_input: ユーザーの悩み・質問
-        course_data: 講座データ（CSV形式、後で実装時に対応）
-    
-    Returns:
-        AIが生成した回答テキスト
+    - プロセス全体の同時実行数の上限内で実行する（枠は応答を読み終えるまで保持）
+    - 429/5xx の場合は枠を返してからジッター付きバックオフでリトライする
     """
+    limiter = get_limiter()
+    options = {"generation_config": generation_config} if generation_config else {}
+
+    def attempt() -> Tuple[Optional[str], SlotReleasingIterator]:
+        limiter.acquire()
+        try:
+            chunks = _iter_text(model.generate_content(prompt, stream=True, **options))
+            first_chunk = next(chunks, None)
+        except BaseException:
+            limiter.release()
+            raise
+        return first_chunk, SlotReleasingIterator(chunks, limiter.release)
+
+    return call_with_retry(attempt, limiter=limiter)
+
+
+def _stream_from_model(
+    user_input: str,
+    catalog: Optional[CourseCatalog],
+    guidelines: GuidelineData,
+    conversation: Optional[ConversationContext] = None,
+    structured: bool = False,
+) -> Iterator[str]:
+    """Geminiを呼び出して回答をストリーミング生成する（キャッシュなし。structured ならJSONで受け取る）"""
     # Gemini APIの初期化
-    api_key = get_gemini_api_key()
+    with stage("config_lookup"):
+        settings = get_settings()
+    api_key = settings.gemini_api_key
     if not api_key:
         raise ValueError("GEMINI_API_KEY環境変数が設定されていません")
     
-    genai.configure(api_key=api_key)
-    
-    # モデルの設定（優先順位に従って試す）
-    preferred_models = [
-        'gemini-1.5-flash',
-        'gemini-1.5-pro',
-        'gemini-pro',
-    ]
+    # モデルの取得（解決済みならキャッシュから）
+    resolver = get_model_resolver()
+    with stage("model_resolution"):
+        model_name, model = resolver.get_model(api_key)
     
-    model = None
-    last_error = None
+    with stage("prompt_build"):
+        prefix, request_part = _build_prompt_parts(user_input, catalog, guidelines, conversation, structured)
+        prompt = prefix + PREFIX_SEPARATOR + request_part
+    generation_config = STRUCTURED_GENERATION_CONFIG if structured else None
     
-    # まず利用可能なモデル一覧を取得して、その中から優先モデルを選ぶ
-    try:
-        available_models = list_available_models()
-        if available_models:
-            for preferred in preferred_models:
-                if preferred in available_models:
-                    try:
-                        model = genai.GenerativeModel(preferred)
-                        break
-                    except:
-                        continue
-    except:
-        pass
-    
-    # 利用可能なモデル一覧から選べなかった場合、直接試す
-    if model is None:
-        for model_name in preferred_models:
-            try:
-                model = genai.GenerativeModel(model_name)
-                break
-            except Exception as e:
-                last_error = e
-                continue
-    
-    if model is None:
-        # エラーメッセージに利用可能なモデルを含める
-        error_msg = "モデルの初期化に失敗しました。\n"
+    # 共通の前半部分を登録済みのモデルがあれば、後半部分だけを送る
+    target_model, contents = model, prompt
+    if settings.context_cache_enabled:
         try:
-            available = list_available_models()
-            if available:
-                error_msg += f"利用可能なモデル: {', '.join(available[:10])}\n"
-        except:
-            pass
-        if last_error:
-            error_msg += f"エラー詳細: {str(last_error)}"
-        raise ValueError(error_msg)
-    
-    prompt = _build_prompt(user_input, course_data, guidelines)
+            with stage("context_cache"):
+                target_model, mode = get_context_cache().get_model(model_name, prefix)
+            contents = request_part
+            incr(f"context_cache_{mode}")
+        except Exception as e:
+            incr("context_cache_errors")
+            print(f"コンテキストキャッシュ利用エラー: {e}")
     
     # 回答生成（エラー時は別のモデルを試す）
+    started = time.perf_counter()
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        first_chunk, chunks = _start_stream(target_model, contents, generation_config)
     except Exception as e:
-        # エラーが発生した場合、利用可能な他のモデルを試す
         error_str = str(e)
-        if "404" in error_str or "not found" in error_str.lower():
-            try:
-                available_models = list_available_models()
-                if available_models:
-                    # 利用可能なモデルを順に試す
-                    for alt_model_name in available_models:
-                        try:
-                            alt_model = genai.GenerativeModel(alt_model_name)
-                            response = alt_model.generate_content(prompt)
-                            return response.text
-                        except:
-                            continue
-            except:
-                pass
+        available = []
+        first_chunk = chunks = None
+        if _is_not_found_error(e):
+            # モデルが見つからない場合はキャッシュを破棄し、利用可能な他のモデルを順に試す
+            resolver.invalidate()
+            get_context_cache().discard(model_name)
+            available = resolver.available_models(api_key)
+            for alt_model_name in available:
+                if alt_model_name == model_name:
+                    continue
+                try:
+                    alt_model = get_genai().GenerativeModel(alt_model_name)
+                    first_chunk, chunks = _start_stream(alt_model, prompt, generation_config)
+                except Exception:
+                    continue
+                resolver.adopt(alt_model_name, alt_model)
+                incr("model_fallbacks")
+                break
         
         # すべての試行が失敗した場合
-        try:
-            available = list_available_models()
+        if chunks is None:
             if available:
                 error_msg = f"モデルの呼び出しに失敗しました。\n利用可能なモデル: {', '.join(available[:5])}\nエラー: {error_str}"
             else:
                 error_msg = f"モデルの呼び出しに失敗しました: {error_str}"
-        except:
-            error_msg = f"モデルの呼び出しに失敗しました: {error_str}"
-        raise ValueError(error_msg)
+            raise ValueError(error_msg)
+    
+    record_stage("generation_first_chunk", time.perf_counter() - started)
+    try:
+        if first_chunk is not None:
+            yield first_chunk
+        yield from chunks
+    finally:
+        # 途中で読むのをやめた場合も実行枠を返す
+        chunks.close()
+        record_stage("generation", time.perf_counter() - started)
+
+
+def _generate_structured(
+    user_input: str,
+    catalog: CourseCatalog,
+    guidelines: GuidelineData,
+    conversation: Optional[ConversationContext] = None,
+) -> Iterator[str]:
+    """
+    講座の提案をJSONで受け取り、講座データから回答を組み立てる
+    JSONとして読めない場合は、共感の文章（empathy）が読み取れればそれを返し、
+    読み取れずJSONを返そうとしていれば通常の形式で生成し直し、そうでなければそのまま返す
+    """
+    text = "".join(_stream_from_model(user_input, catalog, guidelines, conversation, structured=True))
+    answer = parse_structured_answer(text, catalog)
+    if answer is not None:
+        if answer.dropped:
+            incr("structured_output_dropped_courses", answer.dropped)
+        yield render_structured_answer(answer, catalog)
+        return
+    incr("structured_output_fallbacks")
+    if not looks_like_json(text):
+        yield text
+        return
+    empathy = salvage_empathy(text)
+    if empathy:
+        incr("structured_output_salvaged")
+        yield empathy
+        return
+    incr("structured_output_regenerations")
+    yield from _stream_from_model(user_input, catalog, guidelines, conversation)
+
+
+def generate_response_stream(
+    user_input: str,
+    course_data: CourseData = None,
+    guidelines: GuidelineData = None,
+    use_cache: bool = True,
+    conversation: Optional[ConversationContext] = None,
+    structured: Optional[bool] = None,
+) -> Iterator[str]:
+    """
+    ユーザーの入力に対してGeminiで回答をストリーミング生成
+    同じ（または表記ゆれ程度に違う）質問への回答はキャッシュから返す
+    
+    Args:
+        user_input: ユーザーの悩み・質問
+        course_data: 講座データ（カタログまたはCSV形式）
+        guidelines: 運営ガイドライン
+        use_cache: 応答キャッシュを使うかどうか
+        conversation: これまでの会話の文脈（services/conversation.py）
+        structured: 講座の提案をJSONで受け取るか（Noneなら設定 GEMINI_STRUCTURED_OUTPUT に従う）。
+            JSONの場合は回答をまとめて1つのチャンクで返す
+    
+    Yields:
+        AIが生成した回答テキストのチャンク（届いた順）
+    """
+    catalog = as_catalog(course_data)
+    guidelines = as_guidelines(guidelines)
+    if structured is None:
+        structured = get_settings().structured_output_enabled
+    structured = structured and catalog is not None
+    # 会話の続きは文脈によって答えが変わるため、応答キャッシュは使わない
+    if conversation is not None and not conversation.is_empty:
+        use_cache = False
+    cache = get_response_cache() if use_cache else None
+    # 講座データ・ガイドラインが変わればバージョンが変わり、古い回答は使われない
+    version = content_version(
+        catalog.version if catalog else "", guidelines.version if guidelines else "", "structured" if structured else ""
+    )
+    if cache is not None:
+        cached = cache.get(user_input, version)
+        if cached is not None:
+            incr("response_cache_hits")
+            yield cached
+            return
+        incr("response_cache_misses")
+    
+    parts = []
+    if structured:
+        chunks = _generate_structured(user_input, catalog, guidelines, conversation)
+    else:
+        chunks = _stream_from_model(user_input, catalog, guidelines, conversation)
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    
+    # 最後まで生成できた回答だけを保存する
+    if cache is not None:
+        cache.put(user_input, version, "".join(parts))
+
+
+def generate_response(
+    user_input: str,
+    course_data: CourseData = None,
+    guidelines: GuidelineData = None,
+    use_cache: bool = True,
+    conversation: Optional[ConversationContext] = None,
+) -> str:
+    """
+    ユーザーの入力に対してGeminiで回答を生成
+    generate_response_stream() のチャンクをまとめて返す互換ラッパー
+    
+    Args:
+        user_input: ユーザーの悩み・質問
+        course_data: 講座データ（カタログまたはCSV形式）
+        guidelines: 運営ガイドライン
+        use_cache: 応答キャッシュを使うかどうか
+        conversation: これまでの会話の文脈
+    
+    Returns:
+        AIが生成した回答テキスト
+    """
+    return "".join(generate_response_stream(user_input, course_data, guidelines, use_cache, conversation))
+
+
+async def generate_response_async(
+    user_input: str,
+    course_data: CourseData = None,
+    guidelines: GuidelineData = None,
+    use_cache: bool = True,
+    conversation: Optional[ConversationContext] = None,
+) -> str:
+    """
+    generate_response() の非同期版
+    共有スレッドプールで実行するため、呼び出し側のスレッド（イベントループ）を塞がない。
+    同時実行数の上限・リトライは同期版と共通。
+    
+    Returns:
+        AIが生成した回答テキスト
+    """
+    return await run_in_executor(generate_response, user_input, course_data, guidelines, use_cache, conversation)
@@ -0,0 +1,293 @@
+"""
+処理時間の計測とメトリクス
+1回のやりとりごとにトレースIDを振り、段階ごとの処理時間とカウンターを記録する
+集計結果はシンク（ログ・Prometheus形式のエンドポイント・管理パネル）から参照できる
+"""
+import contextlib
+import contextvars
+import json
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+# 段階ごとに保持する直近の処理時間の数（パーセンタイルの計算用）
+SAMPLE_SIZE = 512
+
+# Prometheus のメトリクス名の接頭辞
+METRIC_PREFIX = "familyship"
+
+_METRIC_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Trace:
+    """1回のやりとり（チャット1往復など）の計測結果"""
+
+    def __init__(self, name: str, **attributes: Any):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.error: Optional[str] = None
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            "attributes": dict(self.attributes),
+            "error": self.error,
+        }
+
+
+class _StageStats:
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+
+        def pick(ratio: float) -> float:
+            return ordered[min(int(ratio * len(ordered)), len(ordered) - 1)] * 1000 if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": pick(0.50),
+            "p95_ms": pick(0.95),
+            "max_ms": self.max * 1000,
+        }
+
+
+class LogSink:
+    """トレースを1行のJSONとして出力するシンク"""
+
+    def emit(self, trace: Trace) -> None:
+        print(json.dumps(dict(trace.as_dict(), event="trace"), ensure_ascii=False))
+
+
+class MetricsRegistry:
+    """
+    段階ごとの処理時間とカウンターのプロセス全体の集計
+
+    トレースが終わるたびに、登録されたシンク（emit(trace) を持つオブジェクト）に渡す
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, _StageStats] = {}
+        self._counters: Dict[str, int] = {}
+        self._sinks: List[Any] = []
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=20)
+
+    def record_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = _StageStats()
+            stats.add(seconds)
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_sink(self, sink: Any) -> None:
+        with self._lock:
+            if all(type(existing) is not type(sink) for existing in self._sinks):
+                self._sinks.append(sink)
+
+    def emit(self, trace: Trace) -> None:
+        """終わったトレースを直近の一覧に加え、シンクに渡す"""
+        with self._lock:
+            self._recent.append(trace.as_dict())
+            sinks = list(self._sinks)
+        for sink in sinks:
+            try:
+                sink.emit(trace)
+            except Exception as e:
+                print(f"メトリクス出力エラー: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """段階ごとの処理時間・カウンター・直近のトレース"""
+        with self._lock:
+            return {
+                "stages": {name: stats.as_dict() for name, stats in self._stages.items()},
+                "counters": dict(self._counters),
+                "recent_traces": list(self._recent),
+            }
+
+    def render_prometheus(self) -> str:
+        """Prometheus のテキスト形式で出力する"""
+        lines = []
+        with self._lock:
+            stages = {name: (stats.count, stats.total) for name, stats in self._stages.items()}
+            counters = dict(self._counters)
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_seconds summary")
+        for name, (count, total) in sorted(stages.items()):
+            label = _METRIC_NAME_PATTERN.sub("_", name)
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{label}"}} {count}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{label}"}} {total:.6f}')
+        for name, value in sorted(counters.items()):
+            metric = f"{METRIC_PREFIX}_{_METRIC_NAME_PATTERN.sub('_', name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """集計を初期化する（シンクは残す）"""
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._recent.clear()
+
+
+_registry = MetricsRegistry()
+_current_trace: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("current_trace", default=None)
+
+
+def get_metrics() -> MetricsRegistry:
+    """プロセス共通のMetricsRegistryを取得"""
+    return _registry
+
+
+def current_trace() -> Optional[Trace]:
+    """実行中のトレース（なければNone）"""
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def trace(name: str, **attributes: Any) -> Iterator[Trace]:
+    """
+    トレースを開始する（既に実行中のトレースがあればそれを使う）
+
+    with ブロックを抜けると全体の処理時間を "total" として記録し、シンクに渡す
+    """
+    existing = _current_trace.get()
+    if existing is not None:
+        yield existing
+        return
+    current = Trace(name, **attributes)
+    token = _current_trace.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        record_stage(f"{name}.total", time.perf_counter() - started)
+        _registry.emit(current)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """段階の処理時間を記録する（実行中のトレースにも加える）"""
+    _registry.record_stage(name, seconds)
+    current = _current_trace.get()
+    if current is not None:
+        current.add_stage(name, seconds)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """with ブロックの処理時間を段階 name として記録する"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def incr(name: str, value: int = 1) -> None:
+    """カウンターを増やす（実行中のトレースにも加える）"""
+    _registry.incr(name, value)
+    current = _current_trace.get()
+    if current is not None:
+        current.incr(name, value)
+
+
+def _prometheus_handler() -> type:
+    """/metrics を返すリクエストハンドラ（http.server は使うときだけ読み込む）"""
+    from http.server import BaseHTTPRequestHandler
+
+    class PrometheusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = _registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PrometheusHandler
+
+
+# /metrics の待ち受けアドレスのデフォルト（外部から読む場合は METRICS_HOST で指定する）
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+_server: Any = None
+_configure_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = DEFAULT_METRICS_HOST) -> bool:
+    """
+    Prometheus 形式の /metrics エンドポイントを別スレッドで起動する（プロセスごとに一度だけ）
+    デフォルトでは同じマシンからしか読めない 127.0.0.1 で待ち受ける
+
+    Returns:
+        起動している場合はTrue
+    """
+    from http.server import ThreadingHTTPServer
+
+    global _server
+    with _configure_lock:
+        if _server is not None:
+            return True
+        try:
+            _server = ThreadingHTTPServer((host, port), _prometheus_handler())
+        except OSError as e:
+            print(f"メトリクスサーバーの起動エラー: {e}")
+            return False
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return True
+
+
+def configure_metrics() -> None:
+    """設定（METRICS_SINKS / METRICS_HOST / METRICS_PORT）に従ってシンクを登録する（何度呼んでもよい）"""
+    from config import get_metrics_host, get_metrics_port, get_metrics_sinks
+
+    sinks = get_metrics_sinks()
+    if "log" in sinks:
+        _registry.add_sink(LogSink())
+    if "prometheus" in sinks:
+        start_metrics_server(get_metrics_port(), get_metrics_host())
@@ -0,0 +1,63 @@
+"""
+1回のチャットのやりとりの処理
+ファストパスの振り分けとGeminiによる回答生成をまとめる（Streamlitに依存しない）
+"""
+import time
+from typing import Iterator, Optional
+from services.catalog import CourseCatalog
+from services.conversation import ConversationContext
+from services.knowledge import GuidelineData
+from services.llm import generate_response_stream
+from services.router import PATH_LLM, get_query_router
+
+
+def respond_stream(
+    user_input: str,
+    catalog: Optional[CourseCatalog],
+    guidelines: GuidelineData,
+    conversation: Optional[ConversationContext] = None,
+    use_cache: bool = True,
+    structured: Optional[bool] = None,
+) -> Iterator[str]:
+    """
+    ユーザーの入力に対する回答をストリーミングで生成する
+    講座の場所を聞くだけの質問は、Geminiを呼ばずに定型文で答える（services/router.py）
+
+    Args:
+        user_input: ユーザーの入力
+        catalog: 講座カタログ
+        guidelines: 運営ガイドライン
+        conversation: これまでの会話の文脈
+        use_cache: 応答キャッシュを使うかどうか
+        structured: 講座の提案をJSONで受け取るか（Noneなら設定に従う）
+
+    Yields:
+        回答テキストのチャンク
+    """
+    router = get_query_router()
+    started = time.perf_counter()
+    answer = router.route(user_input, catalog)
+    if answer is not None:
+        return iter([answer])
+    chunks = generate_response_stream(
+        user_input, catalog, guidelines, use_cache=use_cache, conversation=conversation, structured=structured
+    )
+    # ファストパスと比べられるように、振り分けの判定の時間も含めて記録する
+    return router.timed(PATH_LLM, chunks, started)
+
+
+def respond(
+    user_input: str,
+    catalog: Optional[CourseCatalog],
+    guidelines: GuidelineData,
+    conversation: Optional[ConversationContext] = None,
+    use_cache: bool = True,
+    structured: Optional[bool] = None,
+) -> str:
+    """
+    respond_stream() のチャンクをまとめて返す
+
+    Returns:
+        回答テキスト
+    """
+    return "".join(respond_stream(user_input, catalog, guidelines, conversation, use_cache, structured))
@@ -0,0 +1,412 @@
+"""
+プロンプトの組み立て
+セクションごとのトークン数を見積もり、予算を超える場合は価値の低い部分から削る
+"""
+import csv
+import functools
+import io
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from prompts import build_system_prompt
+from services.catalog import COURSE_COLUMNS, Course
+from services.knowledge import GuidelineData, GuidelineDocument, as_guidelines, get_guideline_outline
+from services.recommendations import ID_COLUMN, STRUCTURED_NO_COURSES_INSTRUCTIONS, STRUCTURED_OUTPUT_INSTRUCTIONS
+
+
+# トークン数の概算に使う係数
+# 日本語（かな・漢字・全角記号）は1文字 ≒ 1トークン、英数字は4文字 ≒ 1トークンとして多めに見積もる
+CJK_TOKENS_PER_CHAR = 1.0
+ASCII_CHARS_PER_TOKEN = 4.0
+
+# 最初の削減段階で「感想（一部）」を切り詰める長さ（文字数）
+FEEDBACK_EXCERPT_CHARS = 120
+
+_FEEDBACK_POSITION = list(COURSE_COLUMNS).index("感想（一部）")
+_TRUNCATED_MARK = "…"
+_GUIDELINES_TRUNCATED_NOTE = "\n（ガイドラインの残りは文字数の上限により省略しました）"
+
+# 共通の前半部分とリクエストごとの後半部分の区切り
+PREFIX_SEPARATOR = "\n\n"
+
+# 講座を選ばせるときの指示
+COURSE_INSTRUCTIONS = "上記の講座データベースを参考に、以下のユーザーの悩みに対して適切な講座を2〜3件提案してください。"
+
+# 質問に該当する講座が1件もない場合の指示（空の講座データで講座を選ばせると、存在しない講座を作りやすいため）
+NO_COURSES_INSTRUCTIONS = (
+    "講座データベースに、以下のユーザーの悩みに該当する講座はありませんでした。講座名やURLは挙げずに、"
+    "優しく共感しながら一般的なアドバイスを伝えてください。ガイドラインで案内するよう指示されている内容は案内してください。"
+)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    テキストのトークン数を概算する（APIを呼ばない文字数ベースの見積もり）
+
+    Args:
+        text: 対象テキスト
+
+    Returns:
+        トークン数の見積もり
+    """
+    if not text:
+        return 0
+    ascii_chars = 0
+    cjk_chars = 0
+    for ch in text:
+        if ord(ch) < 128:
+            ascii_chars += 1
+        elif unicodedata.east_asian_width(ch) in ("W", "F", "A"):
+            cjk_chars += 1
+        else:
+            ascii_chars += 1
+    return int(cjk_chars * CJK_TOKENS_PER_CHAR + ascii_chars / ASCII_CHARS_PER_TOKEN + 0.999)
+
+
+@dataclass(frozen=True)
+class PromptBudget:
+    """
+    セクションごとのトークン予算
+
+    guidelines: 運営ガイドラインのうち常に含める部分（超えた分は末尾から省略）
+    guideline_sections: 運営ガイドラインのうち質問に関係するセクション（関連度の低いセクションから省略）
+    courses: 講座データ（感想の切り詰め → 感想の削除 → 下位の講座の削除の順に削る）
+    user_input: ユーザーの入力（超えた分は末尾から省略）
+    history: これまでの会話（超えた分は古い方から省略）
+    total: プロンプト全体（BASE_SYSTEM_PROMPTを含む。超える場合は講座データの予算を減らす）
+    """
+
+    guidelines: int = 4000
+    guideline_sections: int = 1500
+    courses: int = 6000
+    user_input: int = 1000
+    history: int = 1500
+    total: int = 12000
+
+
+DEFAULT_BUDGET = PromptBudget()
+
+
+@dataclass
+class PromptMetrics:
+    """1回分のプロンプトの大きさ"""
+
+    section_tokens: Dict[str, int] = field(default_factory=dict)
+    total_tokens: int = 0
+    total_chars: int = 0
+    courses_included: int = 0
+    courses_dropped: int = 0
+    feedback_trimmed: int = 0
+    guideline_sections: int = 0
+    guidelines_truncated: bool = False
+    user_input_truncated: bool = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "section_tokens": dict(self.section_tokens),
+            "total_tokens": self.total_tokens,
+            "total_chars": self.total_chars,
+            "courses_included": self.courses_included,
+            "courses_dropped": self.courses_dropped,
+            "feedback_trimmed": self.feedback_trimmed,
+            "guideline_sections": self.guideline_sections,
+            "guidelines_truncated": self.guidelines_truncated,
+            "user_input_truncated": self.user_input_truncated,
+        }
+
+
+def _truncate_to_budget(text: str, budget: int) -> Tuple[str, bool]:
+    """トークン予算に収まるように末尾を省略する（行単位で切る）"""
+    if estimate_tokens(text) <= budget:
+        return text, False
+    kept = []
+    used = 0
+    for line in text.splitlines(keepends=True):
+        tokens = estimate_tokens(line)
+        if used + tokens > budget:
+            break
+        kept.append(line)
+        used += tokens
+    return "".join(kept).rstrip(), True
+
+
+def _truncate_head_to_budget(text: str, budget: int) -> str:
+    """トークン予算に収まるように先頭（古い方）を省略する（行単位で切る）"""
+    if estimate_tokens(text) <= budget:
+        return text
+    kept = []
+    used = 0
+    for line in reversed(text.splitlines()):
+        tokens = estimate_tokens(line)
+        if used + tokens > budget:
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(reversed(kept))
+
+
+def _row_tokens(row: List[str]) -> int:
+    return estimate_tokens("".join(row)) + len(row)
+
+
+def fit_course_rows(courses: Sequence[Course], budget: int) -> Tuple[List[List[str]], PromptMetrics]:
+    """
+    講座の行を予算に収める（courses は関連度の高い順）
+
+    1. 下位の講座から順に「感想（一部）」を FEEDBACK_EXCERPT_CHARS 文字に切り詰める
+    2. それでも超える場合は、下位の講座から順に「感想（一部）」を削除する
+    3. それでも超える場合は、下位の講座から削除する
+
+    Returns:
+        (行のリスト, 削減の記録を持つ PromptMetrics)
+    """
+    metrics = PromptMetrics()
+    rows = [course.as_row() for course in courses]
+    row_tokens = [_row_tokens(row) for row in rows]
+    header_tokens = _row_tokens(list(COURSE_COLUMNS))
+    trimmed_rows = set()
+
+    def total() -> int:
+        return header_tokens + sum(row_tokens)
+
+    for shorten in (True, False):
+        for i in reversed(range(len(rows))):
+            if total() <= budget:
+                break
+            feedback = rows[i][_FEEDBACK_POSITION]
+            if shorten and len(feedback) > FEEDBACK_EXCERPT_CHARS:
+                rows[i][_FEEDBACK_POSITION] = feedback[:FEEDBACK_EXCERPT_CHARS] + _TRUNCATED_MARK
+            elif not shorten and feedback:
+                rows[i][_FEEDBACK_POSITION] = ""
+            else:
+                continue
+            trimmed_rows.add(i)
+            row_tokens[i] = _row_tokens(rows[i])
+
+    while rows and total() > budget:
+        rows.pop()
+        row_tokens.pop()
+        trimmed_rows.discard(len(rows))
+        metrics.courses_dropped += 1
+
+    metrics.feedback_trimmed = len(trimmed_rows)
+    metrics.courses_included = len(rows)
+    return rows, metrics
+
+
+def _rows_to_csv(rows: List[List[str]], ids: Optional[Sequence[str]] = None) -> str:
+    """講座の行をCSVにする（ids を渡した場合は先頭にIDの列を加える）"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if ids is None:
+        writer.writerow(list(COURSE_COLUMNS))
+        writer.writerows(rows)
+    else:
+        writer.writerow([ID_COLUMN] + list(COURSE_COLUMNS))
+        writer.writerows([course_id] + row for course_id, row in zip(ids, rows))
+    return output.getvalue()
+
+
+def build_static_prefix(guidelines: GuidelineData, budget: PromptBudget = DEFAULT_BUDGET) -> Tuple[str, int, bool]:
+    """
+    全リクエストで共通の前半部分（BASE_SYSTEM_PROMPT + ガイドラインのうち常に含める部分）を組み立てる
+    同じバージョンのガイドラインに対しては組み立て済みのものを返す
+
+    Returns:
+        (前半部分, ガイドラインのトークン数, ガイドラインを省略したかどうか)
+    """
+    return _build_static_prefix(as_guidelines(guidelines), budget)
+
+
+@functools.lru_cache(maxsize=8)
+def _build_static_prefix(guidelines: Optional[GuidelineDocument], budget: PromptBudget) -> Tuple[str, int, bool]:
+    guideline_text, truncated = _truncate_to_budget(get_guideline_outline(guidelines).static_text(), budget.guidelines)
+    if truncated:
+        guideline_text += _GUIDELINES_TRUNCATED_NOTE
+    return build_system_prompt(guideline_text), estimate_tokens(guideline_text), truncated
+
+
+def select_guideline_block(guidelines: GuidelineData, query: str, budget: int) -> Tuple[str, int]:
+    """
+    質問に関係するガイドラインのセクションを予算内で選ぶ（関連度の高い順に入る分だけ）
+
+    Returns:
+        (「質問に関連するガイドライン」のブロック, 含めたセクション数)
+    """
+    outline = get_guideline_outline(guidelines)
+    blocks = []
+    used = 0
+    for section in outline.select(query):
+        text = outline.render_section(section)
+        tokens = estimate_tokens(text)
+        if used + tokens > budget:
+            continue
+        blocks.append(text)
+        used += tokens
+    if not blocks:
+        return "", 0
+    return "# 質問に関連するガイドライン\n" + "\n\n".join(blocks) + "\n\n", len(blocks)
+
+
+def assemble_prompt_parts(
+    user_input: str,
+    courses: Optional[Sequence[Course]],
+    guidelines: GuidelineData,
+    budget: PromptBudget = DEFAULT_BUDGET,
+    history: Optional[str] = None,
+    recommended_titles: Sequence[str] = (),
+    guideline_query: Optional[str] = None,
+    structured: bool = False,
+) -> Tuple[str, str, PromptMetrics]:
+    """
+    プロンプトを「共通の前半部分」と「リクエストごとの後半部分」に分けて予算内で組み立てる
+    前半部分はガイドラインが変わらない限り同じ文字列になるため、プロバイダ側のキャッシュに載せられる
+    ガイドラインのうち話題ごとのセクションは、質問に関係するものだけを後半部分に含める
+
+    Args:
+        user_input: ユーザーの悩み・質問
+        courses: プロンプトに含める講座（関連度の高い順）。Noneなら講座データなし、
+            空（予算に1件も収まらない場合を含む）なら該当する講座がない旨の指示にする
+        guidelines: 運営ガイドライン
+        budget: セクションごとのトークン予算
+        history: これまでの会話（要約と直近のやりとり）
+        recommended_titles: 既に案内した講座のタイトル
+        guideline_query: ガイドラインのセクションを選ぶための質問（省略時は user_input）
+        structured: 講座データにIDの列を加え、JSONで回答するよう指示する（services/recommendations.py）
+
+    Returns:
+        (前半部分, 後半部分, PromptMetrics)
+    """
+    guidelines = as_guidelines(guidelines)
+    prefix, guideline_tokens, guidelines_truncated = build_static_prefix(guidelines, budget)
+    user_text, user_input_truncated = _truncate_to_budget(user_input, budget.user_input)
+    guideline_block, guideline_sections = select_guideline_block(
+        guidelines, guideline_query or user_input, budget.guideline_sections
+    )
+
+    context_block = ""
+    if history:
+        context_block += f"# これまでの会話\n{_truncate_head_to_budget(history, budget.history)}\n\n"
+    if recommended_titles:
+        titles = "\n".join(f"- {title}" for title in recommended_titles)
+        context_block += f"# 既に案内した講座（同じ講座を繰り返し提案しないでください）\n{titles}\n\n"
+
+    section_tokens = {
+        "system": estimate_tokens(prefix) - guideline_tokens,
+        "guidelines": guideline_tokens,
+        "user_input": estimate_tokens(user_text),
+        "history": estimate_tokens(context_block),
+        "guideline_sections": estimate_tokens(guideline_block),
+    }
+    context_block = guideline_block + context_block
+
+    if courses is not None:
+        instructions = STRUCTURED_OUTPUT_INSTRUCTIONS if structured else COURSE_INSTRUCTIONS
+
+        def course_request(course_csv: str) -> str:
+            return f"""{context_block}# 講座データベース（CSV形式・質問に関連する講座を抜粋）
+{course_csv}
+
+{instructions}
+
+ユーザーの悩み：
+{user_text}
+"""
+
+        # 全体の予算から前半部分と講座データ以外の後半部分（見出し・指示を含む）を引いた残りを講座データに使う
+        fixed_tokens = estimate_tokens(prefix) + estimate_tokens(course_request(""))
+        courses_budget = min(budget.courses, budget.total - fixed_tokens)
+        rows, metrics = fit_course_rows(courses, max(courses_budget, 0))
+        ids = [course.course_id for course in courses[:len(rows)]] if structured else None
+        if rows:
+            course_csv = _rows_to_csv(rows, ids)
+            section_tokens["courses"] = estimate_tokens(course_csv)
+            request_part = course_request(course_csv)
+        else:
+            # 該当する講座がない（予算に収まらない）場合は、講座を選ばせずに一般的なアドバイスを求める
+            section_tokens["courses"] = 0
+            no_courses = STRUCTURED_NO_COURSES_INSTRUCTIONS if structured else NO_COURSES_INSTRUCTIONS
+            request_part = f"""{context_block}{no_courses}
+
+ユーザーの悩み：
+{user_text}
+"""
+    else:
+        metrics = PromptMetrics()
+        request_part = f"""{context_block}ユーザーの悩み：
+{user_text}
+
+上記の悩みに対して、優しく共感しながら応答してください。名前を呼ぶ必要はありません。温かくサポートする姿勢で回答してください。
+"""
+
+    metrics.section_tokens = section_tokens
+    metrics.total_tokens = estimate_tokens(prefix) + estimate_tokens(request_part)
+    metrics.total_chars = len(prefix) + len(PREFIX_SEPARATOR) + len(request_part)
+    metrics.guideline_sections = guideline_sections
+    metrics.guidelines_truncated = guidelines_truncated
+    metrics.user_input_truncated = user_input_truncated
+    _prompt_stats.record(metrics)
+    return prefix, request_part, metrics
+
+
+def assemble_prompt(
+    user_input: str,
+    courses: Optional[Sequence[Course]],
+    guidelines: GuidelineData,
+    budget: PromptBudget = DEFAULT_BUDGET,
+) -> Tuple[str, PromptMetrics]:
+    """
+    ガイドラインと講座データを統合したプロンプトを予算内で組み立てる
+
+    Args:
+        user_input: ユーザーの悩み・質問
+        courses: プロンプトに含める講座（関連度の高い順）。Noneなら講座データなし
+        guidelines: 運営ガイドライン
+        budget: セクションごとのトークン予算
+
+    Returns:
+        (プロンプト, PromptMetrics)
+    """
+    prefix, request_part, metrics = assemble_prompt_parts(user_input, courses, guidelines, budget)
+    return prefix + PREFIX_SEPARATOR + request_part, metrics
+
+
+class PromptStats:
+    """プロンプトの大きさの集計（プロセス全体）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total_tokens = 0
+        self._max_tokens = 0
+        self._trimmed = 0
+        self._last: Optional[PromptMetrics] = None
+
+    def record(self, metrics: PromptMetrics) -> None:
+        with self._lock:
+            self._count += 1
+            self._total_tokens += metrics.total_tokens
+            self._max_tokens = max(self._max_tokens, metrics.total_tokens)
+            if metrics.courses_dropped or metrics.feedback_trimmed or metrics.guidelines_truncated:
+                self._trimmed += 1
+            self._last = metrics
+
+    def snapshot(self) -> Dict[str, Any]:
+        """件数・平均/最大トークン数・削減が発生した件数・直近の内訳を返す"""
+        with self._lock:
+            return {
+                "prompts": self._count,
+                "avg_tokens": self._total_tokens / self._count if self._count else 0,
+                "max_tokens": self._max_tokens,
+                "trimmed_prompts": self._trimmed,
+                "last": self._last.as_dict() if self._last else None,
+            }
+
+
+_prompt_stats = PromptStats()
+
+
+def get_prompt_stats() -> PromptStats:
+    """プロセス共通のPromptStatsを取得"""
+    return _prompt_stats
@@ -0,0 +1,173 @@
+"""
+構造化出力（JSON）による講座の提案
+Geminiには共感の文章・講座ID・おすすめの理由だけをJSONで返してもらい、
+講座タイトル・対象年齢・URLは講座データから埋めて表示する（URLは必ず講座データと一致する）
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from services.catalog import Course, CourseCatalog
+
+
+# 1回の回答で案内する講座の最大数
+MAX_RECOMMENDATIONS = 3
+
+# Gemini に JSON だけを返させる設定
+STRUCTURED_GENERATION_CONFIG: Dict[str, Any] = {"response_mime_type": "application/json"}
+
+# プロンプトの講座データに加えるIDの列名
+ID_COLUMN = "ID"
+
+# 構造化出力のときに、講座データの後ろに付ける指示
+STRUCTURED_OUTPUT_INSTRUCTIONS = """上記の講座データベースを参考に、以下のユーザーの悩みに対して適切な講座を2〜3件選んでください。
+
+# 出力形式（「提案の構成」の指示より優先）
+次の形式のJSONだけを出力してください。講座タイトル・対象年齢・URLは書かないでください（アプリが講座データから表示します）。
+{"empathy": "悩みへの共感とアドバイス（マークダウン可）", "recommendations": [{"course_id": "講座データベースのID列の値", "reason": "おすすめの理由（1〜2文）"}], "closing": "締めの一言（省略可）"}
+- ガイドラインで案内するよう指示されている内容（URLを含む）は empathy か closing に書いてください。
+- 該当する講座がない場合は recommendations を空にし、empathy の中で一般的なアドバイスを伝えてください。"""
+
+# 構造化出力のときに、該当する講座がない場合に付ける指示（講座名・URLを作らせない）
+STRUCTURED_NO_COURSES_INSTRUCTIONS = """講座データベースに、以下のユーザーの悩みに該当する講座はありませんでした。講座名やURLは挙げないでください。
+
+# 出力形式（「提案の構成」の指示より優先）
+次の形式のJSONだけを出力してください。
+{"empathy": "悩みへの共感と一般的なアドバイス（マークダウン可）", "recommendations": [], "closing": "締めの一言（省略可）"}
+- ガイドラインで案内するよう指示されている内容（URLを含む）は empathy か closing に書いてください。"""
+
+# 講座の案内の表示形式（services/router.py の定型文と同じ形）
+COURSE_CARD_TEMPLATE = """- 【{title}】
+  - おすすめの理由：{reason}
+  - 対象年齢：{target_age}
+  - 視聴はこちら：{url}"""
+
+_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+# 壊れたJSONから empathy の文字列だけを取り出す（閉じた文字列のみ）
+_EMPATHY_PATTERN = re.compile(r'"empathy"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+@dataclass(frozen=True)
+class Recommendation:
+    """提案する講座1件（course_id は講座カタログに存在するもの）"""
+
+    course_id: str
+    reason: str
+
+
+@dataclass(frozen=True)
+class StructuredAnswer:
+    """
+    構造化出力を検証した結果
+
+    empathy: 共感の文章
+    recommendations: 提案する講座（カタログにない・重複したIDは除いたもの）
+    closing: 締めの一言
+    dropped: 除いた講座の数
+    """
+
+    empathy: str
+    recommendations: Tuple[Recommendation, ...] = ()
+    closing: str = ""
+    dropped: int = 0
+
+
+def looks_like_json(text: str) -> bool:
+    """JSONとして返そうとした応答かどうか（壊れていても真）"""
+    return (text or "").lstrip().startswith(("{", "```"))
+
+
+def _load_json(text: str) -> Any:
+    text = _FENCE_PATTERN.sub("", (text or "").strip())
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+
+def _as_text(value: Any) -> str:
+    return value.strip() if isinstance(value, str) else ""
+
+
+def parse_structured_answer(text: str, catalog: CourseCatalog) -> Optional[StructuredAnswer]:
+    """
+    構造化出力を検証する
+
+    Args:
+        text: Geminiの応答
+        catalog: 講座カタログ（course_id の確認に使う）
+
+    Returns:
+        StructuredAnswer。JSONとして読めない・共感の文章も講座もない場合はNone
+    """
+    payload = _load_json(text)
+    if not isinstance(payload, dict):
+        return None
+    items = payload.get("recommendations")
+    recommendations: List[Recommendation] = []
+    dropped = 0
+    for item in items if isinstance(items, list) else []:
+        course_id = _as_text(item.get("course_id")) if isinstance(item, dict) else ""
+        if (
+            catalog.get(course_id) is None
+            or any(existing.course_id == course_id for existing in recommendations)
+            or len(recommendations) >= MAX_RECOMMENDATIONS
+        ):
+            dropped += 1
+            continue
+        recommendations.append(Recommendation(course_id, _as_text(item.get("reason"))))
+    empathy = _as_text(payload.get("empathy"))
+    if not empathy and not recommendations:
+        return None
+    return StructuredAnswer(empathy, tuple(recommendations), _as_text(payload.get("closing")), dropped)
+
+
+def salvage_empathy(text: str) -> str:
+    """
+    JSONとして読めない応答から、共感の文章（empathy）だけを取り出す
+
+    Args:
+        text: Geminiの応答
+
+    Returns:
+        共感の文章。取り出せない場合は空文字
+    """
+    match = _EMPATHY_PATTERN.search(text or "")
+    if not match:
+        return ""
+    try:
+        return _as_text(json.loads(match.group(1)))
+    except ValueError:
+        return ""
+
+
+def render_course_card(course: Course, reason: str) -> str:
+    """講座データから講座の案内を作る"""
+    return COURSE_CARD_TEMPLATE.format(
+        title=" ".join(course.title.split()),
+        reason=reason or "お悩みに関連する内容を扱っています。",
+        target_age=course.target_age or "指定なし",
+        url=course.url,
+    )
+
+
+def render_structured_answer(answer: StructuredAnswer, catalog: CourseCatalog) -> str:
+    """
+    検証済みの構造化出力を、これまでの回答と同じ形のマークダウンにする
+
+    Returns:
+        回答テキスト
+    """
+    blocks = [answer.empathy] if answer.empathy else []
+    cards = [
+        render_course_card(catalog.get(item.course_id), item.reason)
+        for item in answer.recommendations
+    ]
+    if cards:
+        blocks.append("\n".join(cards))
+    if answer.closing:
+        blocks.append(answer.closing)
+    return "\n\n".join(blocks)
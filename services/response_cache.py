@@ -0,0 +1,177 @@
+"""
+応答キャッシュ
+よくある質問への回答を、正規化した質問文・講座データ・ガイドラインのバージョンをキーに再利用する
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+
+# キャッシュする件数の上限
+DEFAULT_MAX_ENTRIES = 256
+
+# キャッシュの有効期間（秒）
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+
+# 表記ゆれ程度の違いとみなす類似度（文字bigramのJaccard係数）。Noneで完全一致のみ
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+
+# 正規化で取り除く文字（空白・記号・句読点）
+_STRIP_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+_DIGIT_PATTERN = re.compile(r"\d+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    質問文を正規化する（全角/半角・大文字/小文字・空白・記号・句読点の違いを吸収）
+
+    Args:
+        question: ユーザーの質問
+
+    Returns:
+        正規化した質問文
+    """
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    return _STRIP_PATTERN.sub("", text)
+
+
+def _bigrams(text: str) -> FrozenSet[str]:
+    if len(text) < 2:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+
+def content_version(*parts: Optional[str]) -> str:
+    """講座データ・ガイドラインなどのバージョンをまとめて1つのバージョンにする"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()[:16]
+
+
+class _Entry:
+    __slots__ = ("response", "created_at", "grams", "digits")
+
+    def __init__(self, response: str, created_at: float, grams: FrozenSet[str], digits: Tuple[str, ...]):
+        self.response = response
+        self.created_at = created_at
+        self.grams = grams
+        self.digits = digits
+
+
+class ResponseCache:
+    """
+    LRU + TTL の応答キャッシュ
+
+    - キーは（講座データ・ガイドラインのバージョン, 正規化した質問文）
+    - 完全一致で見つからない場合、同じバージョンの中から文字bigramの類似度が
+      しきい値以上の質問を探す（月齢・年齢などの数字が異なる質問は別扱い）
+    - バージョンがキーに含まれるため、講座データやガイドラインが変わると自動的に無効になる
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        similarity_threshold: Optional[float] = DEFAULT_SIMILARITY_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0}
+
+    def _is_expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.created_at >= self.ttl_seconds
+
+    def _find_similar(self, version: str, grams: FrozenSet[str], digits: Tuple[str, ...], now: float) -> Optional[_Entry]:
+        best_entry = None
+        best_score = self.similarity_threshold
+        for (entry_version, _question), entry in self._entries.items():
+            if entry_version != version or entry.digits != digits or self._is_expired(entry, now):
+                continue
+            union = len(grams | entry.grams)
+            score = len(grams & entry.grams) / union if union else 0.0
+            if score >= best_score:
+                best_entry, best_score = entry, score
+        return best_entry
+
+    def get(self, question: str, version: str) -> Optional[str]:
+        """
+        キャッシュされた応答を取得する
+
+        Args:
+            question: ユーザーの質問
+            version: 講座データ・ガイドラインのバージョン
+
+        Returns:
+            キャッシュされた応答、なければNone
+        """
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        key = (version, normalized)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry, now):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry.response
+
+            if self.similarity_threshold is not None:
+                entry = self._find_similar(version, _bigrams(normalized), tuple(_DIGIT_PATTERN.findall(normalized)), now)
+                if entry is not None:
+                    self._stats["near_hits"] += 1
+                    return entry.response
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, question: str, version: str, response: str) -> None:
+        """
+        応答をキャッシュに保存する
+
+        Args:
+            question: ユーザーの質問
+            version: 講座データ・ガイドラインのバージョン
+            response: 生成された応答
+        """
+        normalized = normalize_question(question)
+        if not normalized or not response:
+            return
+        key = (version, normalized)
+        entry = _Entry(response, time.monotonic(), _bigrams(normalized), tuple(_DIGIT_PATTERN.findall(normalized)))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        """キャッシュを空にする"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率などの統計情報を返す"""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+_response_cache = ResponseCache()
+
+
+def get_response_cache() -> ResponseCache:
+    """プロセス共通のResponseCacheを取得"""
+    return _response_cache
@@ -0,0 +1,228 @@
+"""
+質問の振り分け（ファストパス）
+「○○の講座はどこ？」のように講座の場所を聞くだけの質問は、Geminiを呼ばずに
+講座データの該当URLから定型文で答える。確信が持てない質問はLLMに回す
+"""
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Tuple
+from services.catalog import Course, CourseCatalog
+from services.metrics import incr
+
+
+# 経路の名前
+PATH_FAST = "fast_path"
+PATH_LLM = "llm"
+# ファストパスで答えられずLLMに回した質問（振り分けの判定にかかった時間を記録する）
+PATH_MISS = "fast_path_miss"
+
+# 講座の場所を聞いていると判断する言い回し（正規化後の文字列で判定）
+NAVIGATION_KEYWORDS = (
+    "どこ", "場所", "url", "リンク", "視聴", "見たい", "見れ", "見られ", "みたい", "アーカイブ", "開け", "ひらけ", "見つから",
+)
+
+# これより長い質問は相談とみなし、ファストパスを使わない
+MAX_QUERY_CHARS = 80
+
+# 一致とみなす講座タイトル・講師名・クラス名の最小文字数（「水」「にぐ」のような短い名前の誤一致を防ぐ）
+MIN_TITLE_CHARS = 3
+MIN_NAME_CHARS = 3
+
+# 定型文で案内する講座の最大数（これを超える場合はLLMに任せる）
+MAX_FAST_PATH_COURSES = 8
+
+# 講師名・クラス名だけで一致した場合に定型文で案内する講座の最大数
+# （「かなこ先生の講座はどこ？」のように講師の講座がすべて当たる質問は、どの講座かを決められないためLLMに任せる）
+MAX_NAME_MATCH_COURSES = 3
+
+_STRIP_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+_NAME_SEPARATOR_PATTERN = re.compile(r"[、,/・]")
+
+
+def normalize_name(text: str) -> str:
+    """全角/半角・大文字/小文字・カタカナ/ひらがな・記号の違いを吸収する"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = "".join(chr(ord(ch) - 0x60) if "ァ" <= ch <= "ヶ" else ch for ch in text)
+    return _STRIP_PATTERN.sub("", text)
+
+
+def is_navigational(text: str) -> bool:
+    """講座の場所を聞く質問かどうか"""
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    return any(keyword in normalized for keyword in NAVIGATION_KEYWORDS)
+
+
+class NavigationIndex:
+    """講座タイトル・講師名・クラス名から講座を引くための索引（データバージョンごとに構築）"""
+
+    def __init__(self, catalog: CourseCatalog):
+        self.version = catalog.version
+        self.titles: List[Tuple[str, Course]] = []
+        self.names: Dict[str, List[Course]] = {}
+        for course in catalog:
+            keys = {normalize_name(line) for line in [course.title] + course.title.splitlines()}
+            self.titles.extend((key, course) for key in keys if len(key) >= MIN_TITLE_CHARS)
+            for value in _NAME_SEPARATOR_PATTERN.split(course.instructor) + [course.class_name]:
+                key = normalize_name(value)
+                if len(key) >= MIN_NAME_CHARS:
+                    courses = self.names.setdefault(key, [])
+                    if course not in courses:
+                        courses.append(course)
+        # 長い名前から順に照合する（部分一致で短い名前に取られないように）
+        self.titles.sort(key=lambda item: -len(item[0]))
+
+    def match(self, text: str) -> List[Course]:
+        """
+        質問に含まれる講座タイトル（なければ講師名・クラス名）に該当する講座を返す
+
+        Args:
+            text: ユーザーの質問
+
+        Returns:
+            該当する講座のリスト（該当なし、または講師名・クラス名だけで
+            MAX_NAME_MATCH_COURSES 件を超えて一致し、講座を決められない場合は空）
+        """
+        query = normalize_name(text)
+        matched: List[Course] = []
+        for key, course in self.titles:
+            if key in query and course not in matched:
+                matched.append(course)
+        if matched:
+            return matched
+        for key, courses in self.names.items():
+            if key in query:
+                matched.extend(course for course in courses if course not in matched)
+        if len(matched) > MAX_NAME_MATCH_COURSES:
+            return []
+        return matched
+
+
+def format_fast_answer(courses: List[Course]) -> str:
+    """講座の案内を定型文で作る"""
+    lines = ["お探しの講座はこちらです！", ""]
+    for course in courses:
+        title = " ".join(course.title.split())
+        lines.append(f"- 【{title}】")
+        if course.target_age:
+            lines.append(f"  - 対象年齢：{course.target_age}")
+        lines.append(f"  - 視聴はこちら：{course.url}")
+    lines.append("")
+    lines.append("ほかにも気になることがあれば、お気軽に聞いてくださいね。")
+    return "\n".join(lines)
+
+
+class _PathStats:
+    __slots__ = ("requests", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.requests = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "avg_ms": self.total_seconds / self.requests * 1000 if self.requests else 0.0,
+            "max_ms": self.max_seconds * 1000,
+        }
+
+
+class QueryRouter:
+    """
+    質問をファストパス（定型文）とLLMに振り分け、経路ごとの件数と応答時間を集計する
+
+    ファストパスを使うのは次の条件をすべて満たす場合だけ:
+    - 質問が短く（MAX_QUERY_CHARS 文字未満）、場所を聞く言い回しを含む
+    - 講座タイトル・講師名・クラス名のいずれかに一致し、該当講座が MAX_FAST_PATH_COURSES 件以下
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Optional[NavigationIndex] = None
+        self._stats: Dict[str, _PathStats] = {PATH_FAST: _PathStats(), PATH_LLM: _PathStats(), PATH_MISS: _PathStats()}
+
+    def _get_index(self, catalog: CourseCatalog) -> NavigationIndex:
+        with self._lock:
+            index = self._index
+        if index is None or index.version != catalog.version:
+            index = NavigationIndex(catalog)
+            with self._lock:
+                self._index = index
+        return index
+
+    def prepare(self, catalog: CourseCatalog) -> None:
+        """カタログの索引を先に作っておく（起動時の事前準備用）"""
+        self._get_index(catalog)
+
+    def route(self, user_input: str, catalog: Optional[CourseCatalog]) -> Optional[str]:
+        """
+        ファストパスで答えられる場合は定型文の回答を返す
+
+        Args:
+            user_input: ユーザーの入力
+            catalog: 講座カタログ
+
+        Returns:
+            定型文の回答。LLMに回す場合はNone
+        """
+        started = time.perf_counter()
+        answer = self._answer(user_input, catalog)
+        if answer is None:
+            self.record(PATH_MISS, time.perf_counter() - started)
+            return None
+        self.record(PATH_FAST, time.perf_counter() - started)
+        incr("fast_path_hits")
+        return answer
+
+    def _answer(self, user_input: str, catalog: Optional[CourseCatalog]) -> Optional[str]:
+        if not catalog or len(user_input) >= MAX_QUERY_CHARS or not is_navigational(user_input):
+            return None
+        courses = self._get_index(catalog).match(user_input)
+        if not courses or len(courses) > MAX_FAST_PATH_COURSES:
+            return None
+        return format_fast_answer(courses)
+
+    def record(self, path: str, seconds: float) -> None:
+        """経路ごとの応答時間を記録する"""
+        with self._lock:
+            stats = self._stats[path]
+            stats.requests += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def timed(self, path: str, chunks: Iterator[str], started: Optional[float] = None) -> Iterator[str]:
+        """
+        ストリーミング応答を読み終えるまでの時間を記録する
+
+        Args:
+            path: 経路の名前
+            chunks: 応答のチャンク
+            started: 計測の開始時刻（time.perf_counter()。省略時は読み始めた時刻）。
+                route() の前の時刻を渡すと、振り分けの判定の時間も含めて記録する
+        """
+        started = time.perf_counter() if started is None else started
+        try:
+            yield from chunks
+        finally:
+            self.record(path, time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        経路ごとの件数・平均/最大応答時間（ミリ秒）とファストパスの割合を返す
+        fast_path_miss はLLMに回した質問の振り分けの判定にかかった時間（llm の時間に含まれる）
+        """
+        with self._lock:
+            total = self._stats[PATH_FAST].requests + self._stats[PATH_LLM].requests
+            result: Dict[str, object] = {path: stats.as_dict() for path, stats in self._stats.items()}
+            result["fast_path_rate"] = self._stats[PATH_FAST].requests / total if total else 0.0
+            return result
+
+
+_router = QueryRouter()
+
+
+def get_query_router() -> QueryRouter:
+    """プロセス共通のQueryRouterを取得"""
+    return _router
@@ -0,0 +1,185 @@
+"""
+講座検索インデックス
+日本語の文字n-gramによるBM25で、質問に関連する講座を絞り込む
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import AbstractSet, Any, Dict, List, Optional, Tuple
+from services.catalog import CourseCatalog
+
+
+# 検索対象の列と重み（タイトルに含まれる語を強めに評価する）
+SEARCH_FIELDS = {
+    "講座タイトル": 2.0,
+    "内容": 1.0,
+    "感想（一部）": 0.5,
+}
+
+# プロンプトに含める講座の件数（デフォルト）
+DEFAULT_TOP_K = 5
+
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# n-gramの長さ
+NGRAM_SIZE = 2
+
+# データバージョンごとに保持するインデックスの数
+_INDEX_CACHE_SIZE = 4
+
+# 記号・空白で区切り、区切りをまたぐn-gramを作らない
+_SEPARATOR_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """全角/半角や大文字/小文字の揺れを吸収する"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text: str, n: int = NGRAM_SIZE) -> List[str]:
+    """
+    テキストを文字n-gramに分割する
+
+    Args:
+        text: 対象テキスト
+        n: n-gramの長さ
+
+    Returns:
+        n-gramのリスト（重複あり）
+    """
+    grams = []
+    for segment in _SEPARATOR_PATTERN.split(normalize_text(text)):
+        if not segment:
+            continue
+        if len(segment) < n:
+            grams.append(segment)
+            continue
+        grams.extend(segment[i:i + n] for i in range(len(segment) - n + 1))
+    return grams
+
+
+class CourseSearchIndex:
+    """
+    講座データに対するBM25インデックス
+
+    構築時に転置インデックスを作り、検索時は質問に含まれるn-gramの
+    ポスティングだけを走査する。文書番号はカタログ内の講座の位置と一致する。
+    """
+
+    def __init__(self, catalog: CourseCatalog, state: Optional[Dict[str, Any]] = None):
+        self.version = catalog.version
+        self._doc_count = len(catalog)
+        self._postings: Dict[str, List[Tuple[int, float]]] = {}
+        self._doc_lengths: List[float] = []
+        self._avg_doc_length = 0.0
+        if state is not None and state.get("version") == catalog.version:
+            # スナップショットから復元（再構築しない）
+            self._postings = state["postings"]
+            self._doc_lengths = state["doc_lengths"]
+            self._avg_doc_length = state["avg_doc_length"]
+        else:
+            self._build(catalog)
+
+    def to_state(self) -> Dict[str, Any]:
+        """スナップショット保存用に、組み込み型だけからなる辞書を返す"""
+        return {
+            "version": self.version,
+            "postings": self._postings,
+            "doc_lengths": self._doc_lengths,
+            "avg_doc_length": self._avg_doc_length,
+        }
+
+    def _build(self, catalog: CourseCatalog) -> None:
+        term_frequencies: Dict[str, Dict[int, float]] = {}
+        for doc_id, course in enumerate(catalog.courses):
+            length = 0.0
+            for column, weight in SEARCH_FIELDS.items():
+                for gram in tokenize(course.get(column)):
+                    postings = term_frequencies.setdefault(gram, {})
+                    postings[doc_id] = postings.get(doc_id, 0.0) + weight
+                    length += weight
+            self._doc_lengths.append(length)
+
+        self._postings = {term: list(docs.items()) for term, docs in term_frequencies.items()}
+        if self._doc_lengths:
+            self._avg_doc_length = sum(self._doc_lengths) / len(self._doc_lengths) or 1.0
+
+    def __len__(self) -> int:
+        return self._doc_count
+
+    def search(
+        self,
+        query: str,
+        top_k: int = DEFAULT_TOP_K,
+        allowed: Optional[AbstractSet[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        質問に関連する講座を検索する
+
+        Args:
+            query: 検索クエリ（ユーザーの質問）
+            top_k: 返す件数
+            allowed: 対象にする講座の位置（ファセットで絞り込んだ結果）。Noneなら全件
+
+        Returns:
+            (カタログ内の位置, スコア) のリスト（スコアの高い順）
+        """
+        doc_count = self._doc_count
+        if not doc_count or top_k <= 0:
+            return []
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[doc_id] / self._avg_doc_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k]
+
+
+_index_cache: "OrderedDict[str, CourseSearchIndex]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_search_index(catalog: CourseCatalog) -> CourseSearchIndex:
+    """
+    カタログに対応するインデックスを取得する（データバージョンごとに一度だけ構築）
+
+    Args:
+        catalog: 講座カタログ
+
+    Returns:
+        CourseSearchIndex
+    """
+    with _index_cache_lock:
+        index = _index_cache.get(catalog.version)
+        if index is not None:
+            _index_cache.move_to_end(catalog.version)
+            return index
+
+    index = CourseSearchIndex(catalog)
+    with _index_cache_lock:
+        _index_cache[catalog.version] = index
+        while len(_index_cache) > _INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def register_search_index(index: CourseSearchIndex) -> None:
+    """構築済み（スナップショットから復元した）インデックスをキャッシュに登録する"""
+    with _index_cache_lock:
+        _index_cache[index.version] = index
+        _index_cache.move_to_end(index.version)
+        while len(_index_cache) > _INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
@@ -3,63 +3,86 @@
 Google Sheets / CSVファイルから講座データを読み込む
 """
 import os
-import csv
-import io
-from typing import List, Dict, Optional
-from config import get_google_sheets_id, get_google_sheets_credentials
+import threading
+import time
+from typing import Any, Callable, List, Dict, Optional, Tuple
+from config import get_course_refresh_interval, get_google_sheets_id
+from services.catalog import COURSE_COLUMNS, CatalogError, Course, CourseCatalog
+from services.embeddings import get_embedding_store, is_available as embeddings_available
+from services.metrics import incr, stage
+from services.facets import extract_facets, get_facet_index
+from services.search import DEFAULT_TOP_K, get_search_index
+from services.sheets_client import get_sheets_client_manager
+from services.snapshot import load_snapshot, save_snapshot
 
 
-def load_from_google_sheets() -> Optional[str]:
+# デフォルトの講座データ
+DEFAULT_CSV_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'courses.csv')
+
+# fetch_from_google_sheets() の結果
+FETCH_DISABLED = "disabled"    # Google Sheetsが未設定（またはgspread未インストール）
+FETCH_UNCHANGED = "unchanged"  # 前回取得時からシートが更新されていない
+FETCH_UPDATED = "updated"      # 新しいデータを取得した
+
+# search_courses() の検索方法
+SEARCH_METHOD_AUTO = "auto"
+SEARCH_METHOD_BM25 = "bm25"
+SEARCH_METHOD_EMBEDDING = "embedding"
+
+
+def fetch_from_google_sheets(known_revision: Optional[str] = None) -> Tuple[str, Optional[CourseCatalog], Optional[str]]:
     """
-    Google Sheetsから講座データを読み込む
+    Google Sheetsから講座データを取得する
+    シートの最終更新日時が known_revision と同じ場合はダウンロードしない
+    認証済みクライアントはプロセス内で使い回す（services/sheets_client.py）
+    
+    Args:
+        known_revision: 前回取得時の最終更新日時
     
     Returns:
-        CSV形式の講座データ文字列、またはNone
+        (結果, 講座カタログ, 最終更新日時)
+        結果は FETCH_DISABLED / FETCH_UNCHANGED / FETCH_UPDATED のいずれか
+    
+    Raises:
+        Exception: 認証・通信・データ形式のエラー
     """
     try:
-        import gspread
-        from google.oauth2.service_account import Credentials
-        
-        sheets_id = get_google_sheets_id()
-        credentials_dict = get_google_sheets_credentials()
-        
-        if not sheets_id or not credentials_dict:
-            return None
-        
-        scopes = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        
-        # 認証情報の辞書からCredentialsオブジェクトを作成
-        creds = Credentials.from_service_account_info(credentials_dict, scopes=scopes)
-        client = gspread.authorize(creds)
-        
-        # スプレッドシートを開く
-        spreadsheet = client.open_by_key(sheets_id)
-        worksheet = spreadsheet.sheet1  # 最初のシートを取得
-        
-        # データを取得
-        values = worksheet.get_all_values()
-        
-        if not values:
-            return None
-        
-        # CSV形式の文字列に変換
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerows(values)
-        return output.getvalue()
-        
+        import gspread  # noqa: F401
     except ImportError:
         # gspreadがインストールされていない場合
-        return None
+        return FETCH_DISABLED, None, None
+    
+    manager = get_sheets_client_manager()
+    sheets_id = get_google_sheets_id()
+    if not sheets_id or not manager.has_credentials():
+        return FETCH_DISABLED, None, None
+    
+    # 更新されていなければここで終了
+    revision = manager.get_revision(sheets_id)
+    if revision is not None and revision == known_revision:
+        return FETCH_UNCHANGED, None, revision
+    
+    # データを取得し、行をそのままカタログに変換（CSVへの再変換はしない）
+    values = manager.fetch_values(sheets_id, header_columns=list(COURSE_COLUMNS))
+    return FETCH_UPDATED, CourseCatalog.from_rows(values, source="google_sheets"), revision
+
+
+def load_from_google_sheets() -> Optional[CourseCatalog]:
+    """
+    Google Sheetsから講座データを読み込む
+    
+    Returns:
+        講座カタログ、またはNone
+    """
+    try:
+        _status, catalog, _revision = fetch_from_google_sheets()
+        return catalog
     except Exception as e:
         print(f"Google Sheets読み込みエラー: {e}")
         return None
 
 
-def load_from_csv_file(csv_content: str) -> Optional[str]:
+def load_from_csv_file(csv_content: str) -> Optional[CourseCatalog]:
     """
     アップロードされたCSVコンテンツからデータを読み込む
     
@@ -67,31 +90,30 @@ def load_from_csv_file(csv_content: str) -> Optional[str]:
         csv_content: CSVファイルの内容（文字列）
     
     Returns:
-        CSV形式の講座データ文字列、またはNone
+        講座カタログ、またはNone
     """
     try:
-        # 文字列をそのまま返す（検証は必要に応じて追加）
         if csv_content and len(csv_content.strip()) > 0:
-            return csv_content
+            return CourseCatalog.from_csv_text(csv_content, source="upload")
         return None
-    except Exception as e:
+    except CatalogError as e:
         print(f"CSV読み込みエラー: {e}")
         return None
 
 
-def load_from_default_csv() -> Optional[str]:
+def load_from_default_csv() -> Optional[CourseCatalog]:
     """
     デフォルトのCSVファイルから講座データを読み込む
     
     Returns:
-        CSV形式の講座データ文字列、またはNone
+        講座カタログ、またはNone
     """
-    csv_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'courses.csv')
+    csv_path = DEFAULT_CSV_PATH
     
     try:
         if os.path.exists(csv_path):
             with open(csv_path, 'r', encoding='utf-8') as f:
-                return f.read()
+                return CourseCatalog.from_csv_text(f.read(), source="default_csv")
         else:
             return None
     except Exception as e:
@@ -99,32 +121,299 @@ def load_from_default_csv() -> Optional[str]:
         return None
 
 
-def load_course_data() -> Optional[str]:
+def load_course_data() -> Optional[CourseCatalog]:
     """
     講座データを読み込む（優先順位：Google Sheets > デフォルトCSV）
     
     Returns:
-        CSV形式の講座データ文字列、またはNone
+        講座カタログ、またはNone
+    """
+    with stage("course_data_load"):
+        # 優先順位1: Google Sheets（環境変数が設定されている場合）
+        data = load_from_google_sheets()
+        if data:
+            return data
+        
+        # 優先順位2: デフォルトCSV
+        return load_from_default_csv()
+
+
+def find_courses(query: str, catalog: CourseCatalog, top_k: int = DEFAULT_TOP_K, use_facets: bool = True) -> List[Course]:
     """
-    # 優先順位1: Google Sheets（環境変数が設定されている場合）
-    data = load_from_google_sheets()
-    if data:
-        return data
+    カタログから質問に関連する講座を検索する
+    質問から読み取った月齢・話題で対象の講座を絞り込んだうえで（services/facets.py）、
+    文字n-gramのBM25インデックス（データバージョンごとに一度だけ構築）で順位を付ける
     
-    # 優先順位2: デフォルトCSV
-    return load_from_default_csv()
+    Args:
+        query: 検索クエリ
+        catalog: 講座カタログ
+        top_k: 返す件数
+        use_facets: 月齢・話題による絞り込みを行うかどうか
+    
+    Returns:
+        講座レコードのリスト（関連度の高い順）
+    """
+    if not catalog or not query:
+        return []
+    by_topic, by_age = get_facet_index(catalog).filter(extract_facets(query)) if use_facets else (None, None)
+    index = get_search_index(catalog)
+    positions: List[int] = []
+    if by_topic is not None:
+        # 話題に合う講座を優先する（質問と語が重ならない講座も含める）
+        positions = [position for position, _score in index.search(query, top_k, by_topic)]
+        positions += sorted(by_topic - set(positions))[:top_k - len(positions)]
+    if len(positions) < top_k:
+        # 残りは月齢に合う講座から関連度順に補う
+        for position, _score in index.search(query, top_k, by_age):
+            if len(positions) >= top_k:
+                break
+            if position not in positions:
+                positions.append(position)
+    return [catalog.courses[position] for position in positions]
 
 
-def search_courses(query: str) -> List[Dict]:
+def search_courses(
+    query: str,
+    catalog: Optional[CourseCatalog] = None,
+    top_k: int = DEFAULT_TOP_K,
+    method: str = SEARCH_METHOD_BM25,
+) -> List[Dict]:
     """
     講座データを検索する
-    後で実装：現在は空のリストを返す
     
     Args:
         query: 検索クエリ
+        catalog: 講座カタログ（省略時は get_course_catalog() の現在のカタログ）
+        top_k: 返す件数
+        method: 検索方法
+            "bm25": 文字n-gramのBM25（find_courses()、デフォルト）
+            "embedding": 講座ベクトルとのコサイン類似度（services/embeddings.py、numpyが必要。
+                numpyがない場合は "bm25" で検索する）
+            "auto": numpyがあれば "embedding"、なければ "bm25"
+    
+    Returns:
+        講座データのリスト（列名をキーとした辞書、関連度の高い順）
+    """
+    if catalog is None:
+        catalog = get_course_catalog()
+    if not catalog or not query:
+        return []
+    if method == SEARCH_METHOD_AUTO:
+        method = SEARCH_METHOD_EMBEDDING if embeddings_available() else SEARCH_METHOD_BM25
+    if method == SEARCH_METHOD_EMBEDDING and not embeddings_available():
+        print("numpyがインストールされていないため、BM25で検索します")
+        method = SEARCH_METHOD_BM25
+    if method == SEARCH_METHOD_EMBEDDING:
+        _by_topic, by_age = get_facet_index(catalog).filter(extract_facets(query))
+        results = get_embedding_store().search(query, catalog, top_k, by_age)
+        return [catalog.courses[position].as_dict() for position, _score in results]
+    return [course.as_dict() for course in find_courses(query, catalog, top_k)]
+
+
+def _default_csv_signature() -> Optional[Tuple[int, int]]:
+    """デフォルトCSVの更新日時とサイズ（変更検知用）"""
+    try:
+        stat = os.stat(DEFAULT_CSV_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CatalogRefresher:
+    """
+    講座カタログをバックグラウンドで定期的に更新する
+    
+    - リクエスト側は current() でメモリ上のカタログを参照するだけで、Sheetsの取得を待たない
+    - シートの最終更新日時が変わっていなければダウンロードしない
+    - 新しいカタログは解析が完了してから参照を差し替える（アトミックな入れ替え）
+    - 取得に失敗した場合は直前のカタログ、なければデフォルトCSVを使い続ける
+    - 取得したカタログはスナップショットに保存し、次回起動時はそこから即座に応答を始める
+    """
+    
+    def __init__(
+        self,
+        interval_seconds: Optional[float] = None,
+        fetcher: Callable[[Optional[str]], Tuple[str, Optional[CourseCatalog], Optional[str]]] = fetch_from_google_sheets,
+        fallback_loader: Callable[[], Optional[CourseCatalog]] = load_from_default_csv,
+        use_snapshot: bool = True,
+    ):
+        self.interval_seconds = interval_seconds if interval_seconds is not None else get_course_refresh_interval()
+        self._fetcher = fetcher
+        self._fallback_loader = fallback_loader
+        self._use_snapshot = use_snapshot
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._fallback_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._catalog: Optional[CourseCatalog] = None
+        self._revision: Optional[str] = None
+        self._fallback_signature: Optional[Tuple[int, int]] = None
+        self._stats: Dict[str, Any] = {
+            "updates": 0,
+            "unchanged": 0,
+            "failures": 0,
+            "fallbacks": 0,
+            "snapshot_loads": 0,
+            "last_refresh_at": None,
+            "last_error": None,
+        }
+    
+    def current(self) -> Optional[CourseCatalog]:
+        """
+        現在のカタログを返す（ネットワークアクセスはしない）
+        まだカタログがない場合はスナップショット、なければデフォルトCSVを読み込んで返す
+        """
+        catalog = self._catalog
+        if catalog is None:
+            self._load_initial()
+            catalog = self._catalog
+        return catalog
+    
+    def _load_initial(self) -> None:
+        """起動直後のカタログを用意する（スナップショット > デフォルトCSV）"""
+        if self._use_snapshot:
+            with self._fallback_lock:
+                if self._catalog is None:
+                    restored = load_snapshot()
+                    if restored is not None and restored[0].source == "google_sheets" and not get_google_sheets_id():
+                        # Sheetsの設定が外された後は、前回Sheetsから取得したスナップショットを使わない
+                        restored = None
+                    if restored is not None:
+                        catalog, revision = restored
+                        with self._lock:
+                            self._catalog = catalog
+                            self._revision = revision
+                            self._stats["snapshot_loads"] += 1
+        if self._catalog is None:
+            self._load_fallback()
+    
+    def _swap(self, catalog: CourseCatalog, revision: Optional[str] = None) -> None:
+        with self._lock:
+            self._catalog = catalog
+            self._revision = revision
+    
+    def _load_fallback(self) -> None:
+        """
+        デフォルトCSVを読み込む（ファイルが変わっていなければ読み直さない）
+        Sheetsが使えない状態で呼ばれるため、Sheets・スナップショットのカタログも置き換える
+        """
+        with self._fallback_lock:
+            signature = _default_csv_signature()
+            with self._lock:
+                if (
+                    self._catalog is not None
+                    and self._catalog.source == "default_csv"
+                    and signature == self._fallback_signature
+                ):
+                    return
+            catalog = self._fallback_loader()
+            if catalog is not None:
+                with self._lock:
+                    self._catalog = catalog
+                    self._revision = None
+                    self._fallback_signature = signature
+                    self._stats["fallbacks"] += 1
+    
+    def refresh(self) -> bool:
+        """
+        Google Sheetsの更新を確認し、変わっていればカタログを差し替える
+        
+        Returns:
+            bool: カタログが差し替えられた場合はTrue
+        """
+        with self._refresh_lock:
+            before = self._catalog
+            try:
+                with stage("catalog_refresh"):
+                    status, catalog, revision = self._fetcher(self._revision)
+            except Exception as e:
+                print(f"Google Sheets更新エラー: {e}")
+                incr("catalog_refresh_failures")
+                with self._lock:
+                    self._stats["failures"] += 1
+                    self._stats["last_error"] = str(e)
+                # 直前のカタログがなければスナップショットかデフォルトCSVで代替する
+                if self._catalog is None:
+                    self._load_initial()
+                return self._catalog is not before
+            
+            with self._lock:
+                self._stats["last_refresh_at"] = time.time()
+                self._stats["last_error"] = None
+            if status == FETCH_UPDATED and catalog:
+                self._swap(catalog, revision)
+                incr("catalog_updates")
+                with self._lock:
+                    self._stats["updates"] += 1
+                if self._use_snapshot:
+                    save_snapshot(catalog, revision)
+            elif status == FETCH_UNCHANGED:
+                with self._lock:
+                    self._stats["unchanged"] += 1
+            else:
+                # Sheetsが未設定の場合はデフォルトCSVの変更を反映する
+                self._load_fallback()
+            return self._catalog is not before
+    
+    def _run(self) -> None:
+        # スナップショットがあれば先に読み込み、その最終更新日時でSheetsを再検証する
+        if self._catalog is None:
+            self._load_initial()
+        while True:
+            self.refresh()
+            if self._stop_event.wait(self.interval_seconds):
+                return
+    
+    def start(self) -> None:
+        """バックグラウンドでの定期更新を開始する（起動済みなら何もしない）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="catalog-refresher", daemon=True)
+            self._thread.start()
+    
+    def stop(self) -> None:
+        """定期更新を停止する"""
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+    
+    def stats(self) -> Dict[str, Any]:
+        """更新状況を返す"""
+        with self._lock:
+            catalog = self._catalog
+            return dict(
+                self._stats,
+                revision=self._revision,
+                source=catalog.source if catalog else None,
+                version=catalog.version if catalog else None,
+                courses=len(catalog) if catalog else 0,
+            )
+
+
+_catalog_refresher: Optional[CatalogRefresher] = None
+_catalog_refresher_lock = threading.Lock()
+
+
+def get_catalog_refresher() -> CatalogRefresher:
+    """プロセス共通のCatalogRefresherを取得する（初回呼び出しで定期更新を開始）"""
+    global _catalog_refresher
+    with _catalog_refresher_lock:
+        if _catalog_refresher is None:
+            _catalog_refresher = CatalogRefresher()
+            _catalog_refresher.start()
+        return _catalog_refresher
+
+
+def get_course_catalog() -> Optional[CourseCatalog]:
+    """
+    現在の講座カタログを取得する（リクエスト処理用）
+    Sheetsの取得はバックグラウンドで行われるため、ここで待たされることはない
     
     Returns:
-        講座データのリスト
+        講座カタログ、またはNone
     """
-    # TODO: 講座データから検索して該当するものを返す
-    return []
+    return get_catalog_refresher().current()
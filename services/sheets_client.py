@@ -0,0 +1,183 @@
+"""
+Google Sheetsクライアントの管理
+認証済みのgspreadクライアントをプロセス内で使い回し、取得のたびに認証し直さないようにする
+"""
+import threading
+from typing import Any, Dict, List, Optional
+from config import Settings, get_google_sheets_credentials, on_settings_change
+
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+# スプレッドシートの最終更新日時を取得する Drive API（gspread 5.x 用）
+DRIVE_FILE_URL = "https://www.googleapis.com/drive/v3/files/{}"
+
+
+def column_letter(index: int) -> str:
+    """1始まりの列番号をA1形式の列名に変換する（1 → A, 27 → AA）"""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+class SheetsClientManager:
+    """
+    gspreadクライアントをプロセス全体で共有する
+
+    - 認証情報は最初の一度だけ読み込む（JSONファイルの再読込をしない）
+    - gspread.authorize() はプロセスで一度だけ。内部の AuthorizedSession が
+      HTTPのコネクションを保持し（keep-alive）、アクセストークンの期限切れ時は自動で更新する
+    - ワークシートのメタデータも使い回す（最終更新日時は毎回 Drive API から取得する）
+    - 取得範囲は前回のヘッダーから使っている列までに絞る
+    - 認証やメタデータのエラー時は reset() して一度だけやり直す
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._credentials: Any = None
+        self._client: Any = None
+        self._worksheets: Dict[str, Any] = {}
+        self._used_columns: Dict[str, int] = {}
+        self._stats = {"authorizations": 0, "fetches": 0, "resets": 0}
+
+    def has_credentials(self) -> bool:
+        """
+        認証情報が設定されているかどうか
+        見つかった認証情報は保持し、以降は読み込み直さない
+        """
+        from google.oauth2.service_account import Credentials
+
+        with self._lock:
+            if self._credentials is None:
+                credentials_dict = get_google_sheets_credentials()
+                if not credentials_dict:
+                    return False
+                self._credentials = Credentials.from_service_account_info(credentials_dict, scopes=SCOPES)
+            return True
+
+    def _get_client(self):
+        """認証済みクライアントを返す（初回のみ認証する）"""
+        with self._lock:
+            if self._client is None:
+                import gspread
+
+                if not self.has_credentials():
+                    raise ValueError("Google Sheetsの認証情報が設定されていません")
+                self._client = gspread.authorize(self._credentials)
+                self._stats["authorizations"] += 1
+            return self._client
+
+    def _get_worksheet(self, sheets_id: str):
+        """最初のワークシートを返す（メタデータはキャッシュする）"""
+        with self._lock:
+            worksheet = self._worksheets.get(sheets_id)
+            if worksheet is None:
+                spreadsheet = self._get_client().open_by_key(sheets_id)
+                worksheet = spreadsheet.sheet1  # 最初のシートを取得
+                self._worksheets[sheets_id] = worksheet
+            return worksheet
+
+    def _with_retry(self, operation):
+        """操作を実行し、失敗した場合はクライアントを作り直して一度だけ再試行する"""
+        try:
+            return operation()
+        except Exception:
+            self.reset()
+            return operation()
+
+    def get_revision(self, sheets_id: str) -> Optional[str]:
+        """
+        スプレッドシートの最終更新日時を取得する（変更検知用）
+        取得できない場合はNone（その場合は毎回ダウンロードする）
+
+        Spreadsheet.lastUpdateTime は open_by_key の時点の値のまま変わらない（gspread 5.x）ため、
+        毎回 Drive API のファイル情報を取得する
+        """
+        def operation():
+            client = self._get_client()
+            if hasattr(client, "get_file_drive_metadata"):
+                return client.get_file_drive_metadata(sheets_id)["modifiedTime"]  # gspread 6.x
+            response = client.request(  # gspread 5.x
+                "get", DRIVE_FILE_URL.format(sheets_id), params={"fields": "modifiedTime", "supportsAllDrives": True}
+            )
+            return response.json()["modifiedTime"]
+
+        try:
+            return self._with_retry(operation)
+        except Exception:
+            return None
+
+    def fetch_values(self, sheets_id: str, header_columns: Optional[List[str]] = None) -> List[List[str]]:
+        """
+        最初のワークシートの値を取得する
+
+        Args:
+            sheets_id: スプレッドシートID
+            header_columns: 必要な列名。指定した場合、次回以降はこれらを含む列までに範囲を絞る
+
+        Returns:
+            行のリスト（1行目はヘッダー）
+        """
+        def operation():
+            worksheet = self._get_worksheet(sheets_id)
+            used_columns = self._used_columns.get(sheets_id)
+            if used_columns:
+                # 列を絞って取得（行は値がある最終行までしか返らない）
+                values = worksheet.get(f"A1:{column_letter(used_columns)}")
+            else:
+                values = worksheet.get_all_values()
+            with self._lock:
+                self._stats["fetches"] += 1
+            return [list(row) for row in values]
+
+        values = self._with_retry(operation)
+        if header_columns and values:
+            header = [cell.strip() for cell in values[0]]
+            positions = [header.index(column) + 1 for column in header_columns if column in header]
+            with self._lock:
+                if len(positions) == len(header_columns):
+                    self._used_columns[sheets_id] = max(positions)
+                else:
+                    # ヘッダーが変わった場合は次回シート全体を取得し直す
+                    self._used_columns.pop(sheets_id, None)
+        return values
+
+    def reset(self) -> None:
+        """クライアントとメタデータを破棄する（認証情報は保持する）"""
+        with self._lock:
+            self._client = None
+            self._worksheets.clear()
+            self._used_columns.clear()
+            self._stats["resets"] += 1
+
+    def forget_credentials(self) -> None:
+        """認証情報も含めて破棄する（次の取得で読み込み直す）"""
+        with self._lock:
+            self._credentials = None
+            self.reset()
+
+    def stats(self) -> Dict[str, int]:
+        """認証・取得の回数を返す"""
+        with self._lock:
+            return dict(self._stats)
+
+
+_client_manager = SheetsClientManager()
+
+
+def _on_settings_change(previous: Settings, current: Settings) -> None:
+    if previous.google_sheets_credentials != current.google_sheets_credentials:
+        _client_manager.forget_credentials()
+
+
+on_settings_change(_on_settings_change)
+
+
+def get_sheets_client_manager() -> SheetsClientManager:
+    """プロセス共通のSheetsClientManagerを取得"""
+    return _client_manager
@@ -0,0 +1,105 @@
+"""
+講座カタログのスナップショット
+Google Sheetsから取得したカタログを検索インデックスごとローカルに保存し、
+コールドスタート時にSheetsへアクセスせずに読み込めるようにする
+
+ファイルは pickle で読み込むため、読み込むと任意のコードを実行できてしまう。
+保存先（data/.cache/）はアプリだけが書き込めるようにし、外部から受け取ったファイルを置かないこと
+"""
+import os
+import pickle
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+from services.catalog import Course, CourseCatalog
+from services.search import CourseSearchIndex, get_search_index, register_search_index
+
+
+# スナップショットの保存先
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", ".cache")
+SNAPSHOT_PATH = os.path.join(SNAPSHOT_DIR, "courses.snapshot")
+
+# ファイル先頭の識別子と形式のバージョン（形式を変えたら上げる）
+_MAGIC = b"FSCATSNP"
+FORMAT_VERSION = 1
+
+
+def save_snapshot(catalog: CourseCatalog, revision: Optional[str] = None, path: str = SNAPSHOT_PATH) -> bool:
+    """
+    カタログと検索インデックスをスナップショットとして保存する
+    一時ファイルに書いてから置き換えるため、読み込み中に壊れたファイルが見えることはない
+
+    Args:
+        catalog: 講座カタログ
+        revision: シートの最終更新日時（起動後の再検証で使う）
+        path: 保存先
+
+    Returns:
+        bool: 保存できた場合はTrue
+    """
+    payload = {
+        "catalog_version": catalog.version,
+        "source": catalog.source,
+        "revision": revision,
+        "created_at": time.time(),
+        "warnings": catalog.warnings,
+        "courses": [(course.course_id, course.as_row()) for course in catalog],
+        "search_index": get_search_index(catalog).to_state(),
+    }
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".courses-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_MAGIC)
+                f.write(bytes([FORMAT_VERSION]))
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return True
+    except Exception as e:
+        print(f"スナップショット保存エラー: {e}")
+        return False
+
+
+def _read_payload(path: str) -> Optional[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        data = f.read()
+    header_size = len(_MAGIC) + 1
+    if data[:len(_MAGIC)] != _MAGIC or len(data) <= header_size or data[len(_MAGIC)] != FORMAT_VERSION:
+        return None
+    return pickle.loads(memoryview(data)[header_size:])
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> Optional[Tuple[CourseCatalog, Optional[str]]]:
+    """
+    スナップショットからカタログを復元し、検索インデックスもキャッシュに登録する
+    先頭の識別子と形式のバージョンが合わないファイルは読まない（信頼できるファイルであることが前提）
+
+    Args:
+        path: スナップショットのパス
+
+    Returns:
+        (講座カタログ, シートの最終更新日時)、読み込めない場合はNone
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        payload = _read_payload(path)
+        if payload is None:
+            return None
+        courses = [Course(course_id, values) for course_id, values in payload["courses"]]
+        catalog = CourseCatalog(
+            courses,
+            version=payload["catalog_version"],
+            source=payload["source"],
+            warnings=payload["warnings"],
+        )
+        register_search_index(CourseSearchIndex(catalog, state=payload["search_index"]))
+        return catalog, payload["revision"]
+    except Exception as e:
+        print(f"スナップショット読み込みエラー: {e}")
+        return None
@@ -0,0 +1,174 @@
+"""
+起動直後の事前準備（プリウォーム）
+最初の利用者が来る前に、バックグラウンドのスレッドで
+SDKの読み込み・モデル解決・講座カタログの読み込み・索引の構築・共通プロンプトの組み立てを済ませておく
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import get_prewarm_enabled, get_settings
+from services.metrics import stage
+
+
+# 準備の状態
+STATE_IDLE = "idle"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+
+
+def _import_sdks() -> None:
+    """Gemini・Google Sheets のSDKを読み込む（読み込み済みなら何もしない）"""
+    from services.llm import get_genai
+
+    get_genai()
+    if get_settings().google_sheets_id:
+        import gspread  # noqa: F401
+        from google.oauth2.service_account import Credentials  # noqa: F401
+
+
+def _resolve_model() -> None:
+    """使用するGeminiモデルを解決しておく（APIキーがなければ何もしない）"""
+    from services.llm import get_model_resolver
+
+    api_key = get_settings().gemini_api_key
+    if api_key:
+        get_model_resolver().get_model(api_key)
+
+
+def _build_indexes() -> None:
+    """講座カタログを読み込み、検索・絞り込み・ファストパスの索引を作っておく"""
+    from services.facets import get_facet_index
+    from services.router import get_query_router
+    from services.search import get_search_index
+    from services.sheets import get_course_catalog
+
+    catalog = get_course_catalog()
+    if not catalog:
+        return
+    get_search_index(catalog)
+    get_facet_index(catalog)
+    get_query_router().prepare(catalog)
+
+
+def _build_prompt_prefix() -> None:
+    """デフォルトのガイドラインから共通の前半部分を組み立て、コンテキストキャッシュに登録しておく"""
+    from services.knowledge import resolve_guidelines
+    from services.llm import get_context_cache, get_model_resolver
+    from services.prompt_builder import build_static_prefix
+
+    prefix, _tokens, _truncated = build_static_prefix(resolve_guidelines())
+    settings = get_settings()
+    if settings.context_cache_enabled and settings.gemini_api_key:
+        model_name, _model = get_model_resolver().get_model(settings.gemini_api_key)
+        get_context_cache().get_model(model_name, prefix)
+
+
+# 準備の手順（前の手順が失敗しても次の手順は行う）
+PREWARM_STEPS: Tuple[Tuple[str, Callable[[], None]], ...] = (
+    ("import_sdks", _import_sdks),
+    ("model_resolution", _resolve_model),
+    ("catalog", _build_indexes),
+    ("prompt_prefix", _build_prompt_prefix),
+)
+
+
+class Prewarmer:
+    """
+    事前準備をバックグラウンドのスレッドで一度だけ行う
+
+    - 各手順の時間は "prewarm.<手順名>" の処理時間として記録する
+    - 失敗した手順は記録して次へ進む（最初のリクエストで改めて行われる）
+    - リクエスト側は準備の完了を待たない
+    """
+
+    def __init__(self, steps: Tuple[Tuple[str, Callable[[], None]], ...] = PREWARM_STEPS):
+        self._steps = steps
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at: Optional[float] = None
+        self._seconds: Optional[float] = None
+        self._results: List[Dict[str, Any]] = []
+
+    def start(self) -> bool:
+        """
+        準備を開始する（開始済みなら何もしない）
+
+        Returns:
+            今回開始した場合はTrue
+        """
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="prewarm", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self) -> None:
+        started = time.perf_counter()
+        try:
+            for name, step in self._steps:
+                step_started = time.perf_counter()
+                error = None
+                try:
+                    with stage(f"prewarm.{name}"):
+                        step()
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    print(f"事前準備エラー（{name}）: {e}")
+                with self._lock:
+                    self._results.append({
+                        "step": name,
+                        "ms": round((time.perf_counter() - step_started) * 1000, 1),
+                        "error": error,
+                    })
+        finally:
+            with self._lock:
+                self._seconds = time.perf_counter() - started
+            self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        準備の完了を待つ（ベンチマーク・バッチ用。開始していなければすぐ返す）
+
+        Returns:
+            完了していればTrue
+        """
+        with self._lock:
+            started = self._thread is not None
+        return self._done.wait(timeout) if started else False
+
+    def status(self) -> Dict[str, Any]:
+        """状態・手順ごとの時間（ミリ秒）・エラー"""
+        with self._lock:
+            if self._thread is None:
+                state = STATE_IDLE
+            else:
+                state = STATE_DONE if self._done.is_set() else STATE_RUNNING
+            return {
+                "state": state,
+                "started_at": self._started_at,
+                "total_ms": round(self._seconds * 1000, 1) if self._seconds is not None else None,
+                "steps": [dict(result) for result in self._results],
+            }
+
+
+_prewarmer = Prewarmer()
+
+
+def get_prewarmer() -> Prewarmer:
+    """プロセス共通のPrewarmerを取得"""
+    return _prewarmer
+
+
+def start_prewarm() -> bool:
+    """
+    事前準備を開始する（PREWARM が無効なら行わない。プロセスで一度だけ）
+
+    Returns:
+        今回開始した場合はTrue
+    """
+    if not get_prewarm_enabled():
+        return False
+    return _prewarmer.start()
@@ -0,0 +1,9 @@
+"""
+テスト共通の設定
+プロジェクト直下を読み込みパスに加え、ネットワーク・APIキーなしで実行できるようにする
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GEMINI_API_KEY", "test-fake-key")
@@ -0,0 +1,105 @@
+"""batch/run.py のテスト（偽のGeminiバックエンドを使用）"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import run as batch_run
+from batch.run import BatchItem, BatchRunner, ResultWriter, main, prepare_resume, read_questions
+
+
+def write_lines(path, lines):
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_reads_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / "questions.csv"
+    csv_path.write_text("id,質問\nq1,夜泣きがつらい\nq2,\n,離乳食\n", encoding="utf-8")
+    jsonl_path = tmp_path / "questions.jsonl"
+    jsonl_path.write_text('{"id": "a", "question": "英語"}\n\n{"question": "発達"}\n', encoding="utf-8")
+
+    assert list(read_questions(str(csv_path))) == [BatchItem("q1", "夜泣きがつらい"), BatchItem("3", "離乳食")]
+    assert list(read_questions(str(jsonl_path))) == [BatchItem("a", "英語"), BatchItem("3", "発達")]
+
+
+def test_prepare_resume_skips_done_and_drops_partial_lines(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    write_lines(output, [
+        json.dumps({"id": "q1", "answer": "a", "error": None}) + "\n",
+        json.dumps({"id": "q2", "answer": None, "error": "ResourceExhausted"}) + "\n",
+        '{"id": "q3", "answ',
+    ])
+
+    assert prepare_resume(str(output)) == {"q1", "q2"}
+    assert [record["id"] for record in read_records(output)] == ["q1", "q2"]
+
+
+def test_prepare_resume_removes_error_lines_when_retrying(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    write_lines(output, [
+        json.dumps({"id": "q1", "answer": "a", "error": None}) + "\n",
+        json.dumps({"id": "q2", "answer": None, "error": "ResourceExhausted"}) + "\n",
+    ])
+
+    assert prepare_resume(str(output), retry_errors=True) == {"q1"}
+    assert [record["id"] for record in read_records(output)] == ["q1"]
+
+
+def test_resume_with_retry_errors_leaves_one_line_per_id(tmp_path):
+    questions = tmp_path / "questions.jsonl"
+    questions.write_text(
+        "".join(json.dumps({"id": f"q{n}", "question": f"夜泣きの相談{n}"}, ensure_ascii=False) + "\n" for n in range(1, 4)),
+        encoding="utf-8",
+    )
+    output = tmp_path / "answers.jsonl"
+    write_lines(output, [
+        json.dumps({"id": "q1", "answer": "前回の回答", "error": None}) + "\n",
+        json.dumps({"id": "q2", "answer": None, "error": "ResourceExhausted"}) + "\n",
+    ])
+
+    exit_code = main([
+        str(questions), "--output", str(output), "--resume", "--retry-errors",
+        "--fake", "--fake-first-chunk-ms", "0", "--no-cache",
+    ])
+
+    records = read_records(output)
+    assert exit_code == 0
+    assert sorted(record["id"] for record in records) == ["q1", "q2", "q3"]
+    assert records[0]["answer"] == "前回の回答"
+    assert all(record["error"] is None for record in records)
+
+
+def test_ctrl_c_while_waiting_for_workers_stops_queued_questions(tmp_path, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def fake_respond_stream(question, *_args, **_kwargs):
+        started.set()
+        release.wait(5)
+        return iter(["回答"])
+
+    class InterruptedExecutor(ThreadPoolExecutor):
+        interrupted = False
+
+        def shutdown(self, wait=True, **kwargs):
+            if wait and not InterruptedExecutor.interrupted:
+                InterruptedExecutor.interrupted = True
+                started.wait(5)
+                raise KeyboardInterrupt
+            release.set()
+            return super().shutdown(wait=wait, **kwargs)
+
+    monkeypatch.setattr(batch_run, "respond_stream", fake_respond_stream)
+    monkeypatch.setattr(batch_run, "ThreadPoolExecutor", InterruptedExecutor)
+    output = tmp_path / "answers.jsonl"
+    writer = ResultWriter(str(output), append=False)
+    runner = BatchRunner(None, None, writer, workers=1)
+
+    runner.run(iter([BatchItem("q1", "質問1"), BatchItem("q2", "質問2")]), skip=set())
+    writer.close()
+
+    assert runner.counts["done"] == 1
+    assert [record["id"] for record in read_records(output)] == ["q1"]
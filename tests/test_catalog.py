@@ -0,0 +1,76 @@
+"""services/catalog.py のテスト"""
+import pytest
+
+from services.catalog import COURSE_COLUMNS, CatalogError, CourseCatalog
+
+HEADER = list(COURSE_COLUMNS)
+
+
+def row(title, url="https://example.com/a", class_name="ねんねクラス", instructor="山田"):
+    return ["ベビーコース", class_name, instructor, title, "0〜1歳", "内容", "感想", url]
+
+
+def test_parses_rows_into_courses():
+    catalog = CourseCatalog.from_rows([HEADER, row("夜泣き対策"), row("離乳食", url="https://example.com/b")])
+
+    assert len(catalog) == 2
+    course = catalog.courses[0]
+    assert course.title == "夜泣き対策"
+    assert course.get("対象年齢") == "0〜1歳"
+    assert catalog.get(course.course_id) is course
+    assert catalog.by_url("https://example.com/a/?utm=x") is course
+    assert catalog.by_class("ねんねクラス") == list(catalog.courses)
+    assert catalog.warnings == []
+
+
+def test_columns_are_found_by_header_name():
+    reordered = list(reversed(HEADER))
+    catalog = CourseCatalog.from_rows([reordered, list(reversed(row("夜泣き対策")))])
+
+    assert catalog.courses[0].title == "夜泣き対策"
+    assert catalog.courses[0].url == "https://example.com/a"
+
+
+def test_skips_rows_without_title_and_warns():
+    catalog = CourseCatalog.from_rows([HEADER, row(""), row("夜泣き対策"), ["", "", ""]])
+
+    assert [course.title for course in catalog] == ["夜泣き対策"]
+    assert any("2行目" in warning for warning in catalog.warnings)
+
+
+def test_duplicate_courses_get_distinct_ids():
+    catalog = CourseCatalog.from_rows([HEADER, row("夜泣き対策"), row("夜泣き対策")])
+
+    ids = [course.course_id for course in catalog]
+    assert len(set(ids)) == 2
+    assert ids[1] == ids[0] + "-2"
+
+
+def test_missing_required_column_raises():
+    header = [column for column in HEADER if column != "該当URL"]
+    with pytest.raises(CatalogError):
+        CourseCatalog.from_rows([header, row("夜泣き対策")[:-1]])
+
+
+def test_empty_data_raises():
+    with pytest.raises(CatalogError):
+        CourseCatalog.from_rows([])
+
+
+def test_version_follows_content():
+    first = CourseCatalog.from_rows([HEADER, row("夜泣き対策")])
+    same = CourseCatalog.from_rows([HEADER, row("夜泣き対策")])
+    changed = CourseCatalog.from_rows([HEADER, row("夜泣き対策（改訂）")])
+
+    assert first.version == same.version
+    assert first.version != changed.version
+
+
+def test_csv_text_round_trip_is_cached():
+    catalog = CourseCatalog.from_rows([HEADER, row("夜泣き対策")])
+    text = catalog.to_csv()
+
+    parsed = CourseCatalog.from_csv_text(text, source="test")
+
+    assert parsed.version == catalog.version
+    assert CourseCatalog.from_csv_text(text, source="test") is parsed
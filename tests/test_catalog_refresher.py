@@ -0,0 +1,136 @@
+"""services/sheets.py の CatalogRefresher のテスト（スタブの取得関数を使用）"""
+import time
+
+import pytest
+
+from services import sheets
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.sheets import FETCH_DISABLED, FETCH_UNCHANGED, FETCH_UPDATED, CatalogRefresher
+
+
+def make_catalog(title, source):
+    row = ["ベビーコース", "ねんねクラス", "山田", title, "0〜1歳", "内容", "感想", "https://example.com/a"]
+    return CourseCatalog.from_rows([list(COURSE_COLUMNS), row], source=source)
+
+
+SHEETS = make_catalog("Sheetsの講座", "google_sheets")
+NEWER = make_catalog("更新後の講座", "google_sheets")
+DEFAULT = make_catalog("同梱CSVの講座", "default_csv")
+
+
+class StubFetcher:
+    """呼ばれるたびに results を先頭から返す（例外なら送出する）"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.known_revisions = []
+
+    def __call__(self, known_revision):
+        self.known_revisions.append(known_revision)
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def snapshots(monkeypatch):
+    """スナップショットの読み書きをメモリ上で行う"""
+    stored = {}
+    monkeypatch.setattr(sheets, "load_snapshot", lambda: stored.get("snapshot"))
+    monkeypatch.setattr(sheets, "save_snapshot", lambda catalog, revision: stored.update(snapshot=(catalog, revision)))
+    monkeypatch.setattr(sheets, "get_google_sheets_id", lambda: "sheet-id")
+    return stored
+
+
+def make_refresher(fetcher):
+    return CatalogRefresher(interval_seconds=60, fetcher=fetcher, fallback_loader=lambda: DEFAULT)
+
+
+def test_swaps_in_updated_catalog_and_saves_snapshot(snapshots):
+    refresher = make_refresher(StubFetcher((FETCH_UPDATED, SHEETS, "r1")))
+
+    assert refresher.refresh() is True
+    assert refresher.current() is SHEETS
+    assert snapshots["snapshot"] == (SHEETS, "r1")
+    assert refresher.stats()["revision"] == "r1"
+
+
+def test_unchanged_revision_keeps_catalog(snapshots):
+    fetcher = StubFetcher((FETCH_UPDATED, SHEETS, "r1"), (FETCH_UNCHANGED, None, "r1"))
+    refresher = make_refresher(fetcher)
+
+    refresher.refresh()
+    assert refresher.refresh() is False
+
+    assert refresher.current() is SHEETS
+    assert fetcher.known_revisions == [None, "r1"]
+    assert refresher.stats()["unchanged"] == 1
+
+
+def test_failure_keeps_previous_catalog(snapshots):
+    refresher = make_refresher(StubFetcher((FETCH_UPDATED, SHEETS, "r1"), ConnectionError("timeout")))
+
+    refresher.refresh()
+    assert refresher.refresh() is False
+
+    assert refresher.current() is SHEETS
+    assert refresher.stats()["failures"] == 1
+    assert refresher.stats()["last_error"] == "timeout"
+
+
+def test_failure_on_cold_start_uses_snapshot(snapshots):
+    snapshots["snapshot"] = (SHEETS, "r1")
+    refresher = make_refresher(StubFetcher(ConnectionError("timeout")))
+
+    assert refresher.refresh() is True
+    assert refresher.current() is SHEETS
+    assert refresher.stats()["snapshot_loads"] == 1
+
+
+def test_failure_without_snapshot_uses_bundled_csv(snapshots):
+    refresher = make_refresher(StubFetcher(ConnectionError("timeout")))
+
+    assert refresher.refresh() is True
+    assert refresher.current() is DEFAULT
+    assert refresher.stats()["fallbacks"] == 1
+
+
+def test_snapshot_revision_is_revalidated(snapshots):
+    snapshots["snapshot"] = (SHEETS, "r1")
+    fetcher = StubFetcher((FETCH_UNCHANGED, None, "r1"))
+    refresher = make_refresher(fetcher)
+
+    assert refresher.current() is SHEETS
+    refresher.refresh()
+
+    assert fetcher.known_revisions == ["r1"]
+    assert refresher.current() is SHEETS
+
+
+def test_disabled_sheets_ignores_sheets_snapshot(snapshots, monkeypatch):
+    snapshots["snapshot"] = (SHEETS, "r1")
+    monkeypatch.setattr(sheets, "get_google_sheets_id", lambda: None)
+    refresher = make_refresher(StubFetcher((FETCH_DISABLED, None, None)))
+
+    assert refresher.current() is DEFAULT
+    refresher.refresh()
+    assert refresher.current() is DEFAULT
+
+
+def test_background_thread_swaps_catalog(snapshots):
+    refresher = CatalogRefresher(
+        interval_seconds=0.01,
+        fetcher=StubFetcher((FETCH_UPDATED, SHEETS, "r1"), (FETCH_UPDATED, NEWER, "r2"), (FETCH_UNCHANGED, None, "r2")),
+        fallback_loader=lambda: DEFAULT,
+    )
+    refresher.start()
+    try:
+        deadline = time.monotonic() + 5
+        while refresher.current() is not NEWER and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        refresher.stop()
+
+    assert refresher.current() is NEWER
+    assert refresher.stats()["updates"] == 2
@@ -0,0 +1,135 @@
+"""services/concurrency.py のテスト（同時実行数の制限とリトライ）"""
+import threading
+import time
+
+import pytest
+
+from services.concurrency import (
+    ConcurrencyLimiter,
+    QueueTimeoutError,
+    SlotReleasingIterator,
+    call_with_retry,
+    is_retryable_error,
+)
+
+
+class ResourceExhausted(Exception):
+    code = 429
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class InvalidArgument(Exception):
+    code = 400
+
+
+def test_retryable_errors_are_decided_by_type_and_code():
+    assert is_retryable_error(ResourceExhausted("quota"))
+    assert is_retryable_error(ServiceUnavailable("unavailable"))
+    assert not is_retryable_error(InvalidArgument("429 is not a valid value"))
+    assert not is_retryable_error(ValueError("500 tokens exceed the limit"))
+    assert not is_retryable_error(QueueTimeoutError(1))
+
+
+def test_retries_with_jittered_exponential_backoff():
+    errors = [ResourceExhausted(), ServiceUnavailable()]
+    delays = []
+
+    def operation():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    limiter = ConcurrencyLimiter(1, 1)
+    result = call_with_retry(operation, limiter, max_attempts=3, base_delay=1.0, max_delay=1.5, sleep=delays.append)
+
+    assert result == "ok"
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1.0
+    assert 0 <= delays[1] <= 1.5  # 2秒になるところを上限で抑える
+    assert limiter.stats()["retries"] == 2
+
+
+def test_gives_up_after_max_attempts():
+    calls = []
+
+    def operation():
+        calls.append(1)
+        raise ResourceExhausted()
+
+    with pytest.raises(ResourceExhausted):
+        call_with_retry(operation, max_attempts=3, sleep=lambda _seconds: None)
+    assert len(calls) == 3
+
+
+def test_non_retryable_error_is_raised_immediately():
+    calls = []
+
+    def operation():
+        calls.append(1)
+        raise InvalidArgument()
+
+    with pytest.raises(InvalidArgument):
+        call_with_retry(operation, sleep=lambda _seconds: None)
+    assert len(calls) == 1
+
+
+def test_limiter_times_out_when_full():
+    limiter = ConcurrencyLimiter(1, timeout=0.01)
+    limiter.acquire()
+
+    with pytest.raises(QueueTimeoutError):
+        limiter.acquire()
+    assert limiter.stats()["rejected"] == 1
+
+    limiter.release()
+    limiter.acquire()
+    assert limiter.stats()["active"] == 1
+
+
+def test_limiter_bounds_concurrent_calls():
+    limiter = ConcurrencyLimiter(2, timeout=5)
+    lock = threading.Lock()
+    active = []
+    peak = []
+    release = threading.Event()
+
+    def worker():
+        limiter.acquire()
+        try:
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            release.wait(5)
+            with lock:
+                active.pop()
+        finally:
+            limiter.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while limiter.stats()["waiting"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert max(peak) == 2
+    assert limiter.stats()["acquired"] == 5
+    assert limiter.stats()["active"] == 0
+
+
+def test_slot_is_released_when_stream_is_closed_early():
+    limiter = ConcurrencyLimiter(1, timeout=0.01)
+    limiter.acquire()
+    stream = SlotReleasingIterator(iter(["a", "b"]), limiter.release)
+
+    assert next(stream) == "a"
+    stream.close()
+
+    limiter.acquire()
+    assert limiter.stats()["active"] == 1
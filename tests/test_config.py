@@ -0,0 +1,106 @@
+"""config.py の Settings / SettingsStore のテスト"""
+from types import MappingProxyType
+
+import pytest
+
+import config
+from config import Settings, SettingsStore
+
+
+class StubLoader:
+    """呼ばれるたびに values を先頭から Settings にして返す（最後の値は繰り返す）"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        value = self.values.pop(0) if len(self.values) > 1 else self.values[0]
+        return Settings(gemini_api_key="key", gemini_max_concurrency=value, loaded_at=float(self.calls))
+
+
+@pytest.fixture
+def secrets_file(tmp_path, monkeypatch):
+    path = tmp_path / "secrets.toml"
+    path.write_text('GEMINI_MAX_CONCURRENCY = "8"\n', encoding="utf-8")
+    monkeypatch.setattr(config, "SECRETS_FILES", (str(path),))
+    monkeypatch.setattr(config, "SETTINGS_CHECK_INTERVAL_SECONDS", 0.0)
+    return path
+
+
+def test_settings_are_hashable_with_credentials():
+    settings = Settings(google_sheets_credentials=MappingProxyType({"client_email": "a@example.com"}))
+    same = Settings(google_sheets_credentials=MappingProxyType({"client_email": "a@example.com"}))
+    other = Settings(google_sheets_credentials=MappingProxyType({"client_email": "b@example.com"}))
+
+    assert hash(settings) == hash(same)
+    assert {settings, same} == {settings}
+    assert settings != other
+
+
+def test_loaded_credentials_are_read_only(monkeypatch):
+    monkeypatch.setattr(config, "_load_google_sheets_credentials", lambda: {"client_email": "a@example.com"})
+
+    settings = config.load_settings()
+
+    with pytest.raises(TypeError):
+        settings.google_sheets_credentials["client_email"] = "b@example.com"
+    hash(settings)
+
+
+def test_unchanged_secrets_file_is_not_reloaded(secrets_file):
+    loader = StubLoader(8)
+    store = SettingsStore(loader)
+
+    first = store.get()
+    second = store.get()
+
+    assert first is second
+    assert loader.calls == 1
+
+
+def test_changed_secrets_file_reloads_and_notifies(secrets_file):
+    loader = StubLoader(8, 16)
+    store = SettingsStore(loader)
+    changes = []
+    store.add_listener(lambda previous, current: changes.append((previous.gemini_max_concurrency, current.gemini_max_concurrency)))
+
+    store.get()
+    # 大きさも変わるように書き換える（更新時刻の分解能に依存しない）
+    secrets_file.write_text('GEMINI_MAX_CONCURRENCY = "16"\n', encoding="utf-8")
+    settings = store.get()
+
+    assert settings.gemini_max_concurrency == 16
+    assert loader.calls == 2
+    assert changes == [(8, 16)]
+    assert store.stats() == {"loads": 1, "reloads": 1}
+
+
+def test_reload_with_same_values_does_not_notify(secrets_file):
+    loader = StubLoader(8)
+    store = SettingsStore(loader)
+    changes = []
+    store.add_listener(lambda previous, current: changes.append(current))
+
+    store.get()
+    store.reload()  # loaded_at は変わるが比較には含めない
+
+    assert loader.calls == 2
+    assert changes == []
+
+
+def test_failing_listener_does_not_block_others(secrets_file):
+    store = SettingsStore(StubLoader(8, 4))
+    changes = []
+
+    def broken(previous, current):
+        raise RuntimeError("boom")
+
+    store.add_listener(broken)
+    store.add_listener(lambda previous, current: changes.append(current.gemini_max_concurrency))
+
+    store.get()
+    store.reload()
+
+    assert changes == [4]
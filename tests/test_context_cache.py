@@ -0,0 +1,220 @@
+"""services/context_cache.py のテスト（偽のプロバイダを使用）"""
+import os
+from typing import Any, List, Tuple
+
+import pytest
+
+from bench.fake_genai import FakeGenAI, FakeGenAIConfig, use_fake_genai
+from services.context_cache import (
+    MODE_CACHED,
+    MODE_UNCACHED,
+    REASON_ERROR,
+    REASON_TOO_SMALL,
+    REASON_UNSUPPORTED,
+    RETRY_AFTER_SECONDS,
+    ContextCacheManager,
+    GeminiContextProvider,
+    min_cache_tokens_for,
+)
+from services.knowledge import resolve_guidelines
+from services.llm import ModelResolver, get_genai
+from services.prompt_builder import build_static_prefix
+
+MODEL = "gemini-2.5-flash"
+PREFIX = "あ" * 4000  # 約2000トークン（2.5 Flash の最小 1024 を超える）
+
+
+class FakeProvider:
+    def __init__(self, errors: List[Exception] = ()):
+        self.errors = list(errors)
+        self.created: List[Tuple[str, str]] = []
+        self.bound: List[Tuple[str, str]] = []
+        self.deleted: List[Any] = []
+
+    def create(self, model_name: str, prefix: str, ttl_seconds: float) -> Tuple[Any, Any]:
+        if self.errors:
+            raise self.errors.pop(0)
+        handle = ("handle", len(self.created))
+        self.created.append((model_name, prefix))
+        return ("cached-model", handle), handle
+
+    def bind(self, model_name: str, prefix: str) -> Any:
+        self.bound.append((model_name, prefix))
+        return ("bound-model", model_name)
+
+    def delete(self, handle: Any) -> None:
+        self.deleted.append(handle)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class MethodNotImplemented(Exception):
+    code = 501
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class InvalidArgument(Exception):
+    code = 400
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+def test_creates_once_and_reuses(clock):
+    provider = FakeProvider()
+    manager = ContextCacheManager(provider, ttl_seconds=3600, clock=clock)
+
+    model, mode = manager.get_model(MODEL, PREFIX)
+    again, again_mode = manager.get_model(MODEL, PREFIX)
+
+    assert mode == again_mode == MODE_CACHED
+    assert model is again
+    assert len(provider.created) == 1
+    assert manager.stats()["created"] == 1
+    assert manager.stats()["hits"] == 1
+
+
+def test_recreates_when_prefix_version_changes(clock):
+    provider = FakeProvider()
+    manager = ContextCacheManager(provider, clock=clock)
+
+    manager.get_model(MODEL, PREFIX)
+    _model, mode = manager.get_model(MODEL, PREFIX + "（ガイドライン更新）")
+
+    assert mode == MODE_CACHED
+    assert len(provider.created) == 2
+    assert provider.deleted == [("handle", 0)]
+
+
+def test_recreates_before_expiry(clock):
+    provider = FakeProvider()
+    manager = ContextCacheManager(provider, ttl_seconds=100, clock=clock)
+
+    manager.get_model(MODEL, PREFIX)
+    clock.now += 89
+    manager.get_model(MODEL, PREFIX)
+    assert len(provider.created) == 1
+
+    clock.now += 2  # TTL の9割を過ぎたら作り直す
+    manager.get_model(MODEL, PREFIX)
+    assert len(provider.created) == 2
+    assert provider.deleted == [("handle", 0)]
+
+
+def test_prefix_below_model_minimum_is_not_cacheable(clock):
+    provider = FakeProvider()
+    manager = ContextCacheManager(provider, clock=clock)
+
+    _model, mode = manager.get_model(MODEL, "短い前置き")
+
+    assert mode == MODE_UNCACHED
+    assert provider.created == []
+    stats = manager.stats()
+    assert stats["uncached"] == 1
+    assert stats["hits"] == 0
+    assert stats["not_cacheable"] == {MODEL: REASON_TOO_SMALL}
+
+
+def test_minimum_depends_on_model():
+    assert min_cache_tokens_for("gemini-2.5-flash") < min_cache_tokens_for("models/gemini-1.5-flash")
+
+
+def test_transient_failure_is_retried_later(clock):
+    provider = FakeProvider(errors=[ServiceUnavailable("503 unavailable")])
+    manager = ContextCacheManager(provider, clock=clock)
+
+    _model, mode = manager.get_model(MODEL, PREFIX)
+    assert mode == MODE_UNCACHED
+    assert manager.stats()["not_cacheable"] == {MODEL: REASON_ERROR}
+    assert manager.stats()["unsupported"] == {}
+
+    _model, mode = manager.get_model(MODEL, PREFIX)
+    assert mode == MODE_UNCACHED
+    assert provider.created == []
+
+    clock.now += RETRY_AFTER_SECONDS + 1
+    _model, mode = manager.get_model(MODEL, PREFIX)
+    assert mode == MODE_CACHED
+    assert len(provider.created) == 1
+
+
+def test_unsupported_error_disables_model(clock):
+    provider = FakeProvider(errors=[MethodNotImplemented("caching not supported")])
+    manager = ContextCacheManager(provider, clock=clock)
+
+    manager.get_model(MODEL, PREFIX)
+    _model, mode = manager.get_model(MODEL, PREFIX + "別の内容")
+
+    assert mode == MODE_UNCACHED
+    assert provider.created == []
+    assert MODEL in manager.stats()["unsupported"]
+    assert manager.stats()["not_cacheable"] == {MODEL: REASON_UNSUPPORTED}
+
+
+def test_other_requests_do_not_wait_while_creating(clock):
+    manager: ContextCacheManager
+
+    class SlowProvider(FakeProvider):
+        def create(self, model_name: str, prefix: str, ttl_seconds: float) -> Tuple[Any, Any]:
+            # 作成中に別のリクエストが来た場合、ロックで待たされずにキャッシュなしで返る
+            _model, mode = manager.get_model(model_name, prefix)
+            assert mode == MODE_UNCACHED
+            return super().create(model_name, prefix, ttl_seconds)
+
+    provider = SlowProvider()
+    manager = ContextCacheManager(provider, clock=clock)
+
+    _model, mode = manager.get_model(MODEL, PREFIX)
+
+    assert mode == MODE_CACHED
+    assert len(provider.created) == 1
+
+
+def test_too_small_error_is_not_retried_for_same_prefix(clock):
+    error = InvalidArgument("Cached content is too small. total_token_count=900, min_total_token_count=1024")
+    provider = FakeProvider(errors=[error])
+    manager = ContextCacheManager(provider, clock=clock)
+
+    manager.get_model(MODEL, PREFIX)
+    clock.now += RETRY_AFTER_SECONDS + 1
+    _model, mode = manager.get_model(MODEL, PREFIX)
+
+    assert mode == MODE_UNCACHED
+    assert provider.created == []
+    assert manager.stats()["not_cacheable"] == {MODEL: REASON_TOO_SMALL}
+
+
+def test_other_invalid_argument_is_retried_later(clock):
+    provider = FakeProvider(errors=[InvalidArgument("Request contains an invalid argument.")])
+    manager = ContextCacheManager(provider, clock=clock)
+
+    manager.get_model(MODEL, PREFIX)
+    assert manager.stats()["not_cacheable"] == {MODEL: REASON_ERROR}
+
+    clock.now += RETRY_AFTER_SECONDS + 1
+    _model, mode = manager.get_model(MODEL, PREFIX)
+    assert mode == MODE_CACHED
+
+
+def test_default_model_caches_the_real_prefix():
+    prefix, _tokens, _truncated = build_static_prefix(resolve_guidelines())
+    fake = FakeGenAI(FakeGenAIConfig(first_chunk_latency=0, chunk_latency=0), seed=0)
+    with use_fake_genai(fake):
+        model_name, _model = ModelResolver().get_model(os.environ["GEMINI_API_KEY"])
+        manager = ContextCacheManager(GeminiContextProvider(get_genai))
+
+        _model, mode = manager.get_model(model_name, prefix)
+
+    assert mode == MODE_CACHED
+    assert fake.calls["cache_creates"] == 1
@@ -0,0 +1,105 @@
+"""services/conversation.py のテスト"""
+import pytest
+
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.conversation import ConversationState, find_recommended_courses, follow_up_query
+from services.sheets import find_courses
+
+
+@pytest.fixture
+def catalog():
+    rows = [list(COURSE_COLUMNS)]
+    for n in range(3):
+        rows.append(["ベビーコース", "ねんねクラス", "山田", f"夜泣き対策{n}", "0〜1歳", "夜泣き・寝かしつけ", "", f"https://example.com/sleep/{n}"])
+        rows.append(["キッズコース", "おやこ英語クラス", "佐藤", f"英語あそび{n}", "1〜6歳", "英語の歌", "", f"https://example.com/english/{n}"])
+    return CourseCatalog.from_rows(rows)
+
+
+def turns(count):
+    messages = []
+    for n in range(count):
+        messages.append({"role": "user", "content": f"質問{n}です。詳しく教えてください。"})
+        messages.append({"role": "assistant", "content": f"## 回答{n}\n**答え{n}です。** 続きの説明"})
+    return messages
+
+
+def test_keeps_recent_turns_verbatim_and_summarizes_older_ones():
+    state = ConversationState(recent_turns=2)
+
+    context = state.build_context("次の質問", turns(3))
+
+    summary, recent = context.history.split("【直近のやりとり】")
+    assert "質問0です。" in summary and "答え0です。" in summary
+    assert "続きの説明" not in summary.split("質問1")[0]  # 要約は最初の文だけ
+    assert "質問1です。詳しく教えてください。" in recent
+    assert "質問2です。" in recent
+    assert "質問0" not in recent
+
+
+def test_folds_each_message_once():
+    state = ConversationState(recent_turns=1)
+    messages = turns(2)
+
+    state.build_context("a", messages)
+    state.build_context("b", messages + turns(3)[4:])
+
+    assert len(state.summary_lines) == 4
+    assert state.summary_lines[0].startswith("ユーザー")
+
+
+def test_summary_is_capped():
+    state = ConversationState(recent_turns=1, summary_max_chars=60)
+
+    state.build_context("a", turns(10))
+
+    assert sum(len(line) for line in state.summary_lines) <= 60
+    assert "質問8" in state.summary_lines[-2]
+
+
+def test_finds_recommended_courses_from_urls(catalog):
+    response = (
+        "- 【夜泣き対策1】\n  - 視聴はこちら：https://example.com/sleep/1?utm=x\n"
+        "（https://example.com/english/0）https://example.com/sleep/1 https://example.com/unknown"
+    )
+
+    ids = find_recommended_courses(response, catalog)
+
+    assert ids == [catalog.by_url("https://example.com/sleep/1").course_id, catalog.by_url("https://example.com/english/0").course_id]
+
+
+def test_recorded_courses_are_excluded_and_summarized(catalog):
+    state = ConversationState(recent_turns=0)
+    response = "こちらです https://example.com/sleep/0"
+    course_ids = state.record_response(response, catalog)
+    messages = [
+        {"role": "user", "content": "夜泣きがつらい"},
+        {"role": "assistant", "content": response, "course_ids": course_ids},
+    ]
+
+    context = state.build_context("ありがとう", messages, catalog)
+
+    assert context.recommended_ids == frozenset(course_ids)
+    assert "講座を案内（夜泣き対策0）" in context.history
+
+
+def test_follow_up_is_joined_with_previous_question():
+    assert follow_up_query("もっと小さい子向けは？", "夜泣きがつらい") == "もっと小さい子向けは？ 夜泣きがつらい"
+    assert follow_up_query("2歳だと？", "夜泣きがつらい") == "2歳だと？ 夜泣きがつらい"
+
+
+def test_unrelated_question_is_not_joined():
+    assert follow_up_query("英語の講座は？", "夜泣きがつらい") == "英語の講座は？"
+    assert follow_up_query("退会方法は？", "夜泣きがつらい") == "退会方法は？"
+    assert follow_up_query("他にある？", "") == "他にある？"
+
+
+def test_new_topic_does_not_pull_previous_topic_courses(catalog):
+    messages = [
+        {"role": "user", "content": "夜泣きがつらいです"},
+        {"role": "assistant", "content": "つらいですよね。"},
+    ]
+
+    context = ConversationState().build_context("英語の講座は？", messages, catalog)
+    courses = find_courses(context.retrieval_query, catalog, top_k=3)
+
+    assert courses and all(course.class_name == "おやこ英語クラス" for course in courses)
@@ -0,0 +1,70 @@
+"""services/embeddings.py のテスト（numpy がない環境では実行しない）"""
+import pytest
+
+pytest.importorskip("numpy")
+
+from services.catalog import COURSE_COLUMNS, CourseCatalog  # noqa: E402
+from services.embeddings import HashingEmbedder, build_embedding_index  # noqa: E402
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return super().embed(texts)
+
+
+def catalog(contents):
+    rows = [list(COURSE_COLUMNS)]
+    for number, content in enumerate(contents):
+        rows.append(["コース", "クラス", "講師", f"講座{number}", "0〜2歳", content, "", f"https://example.com/{number}"])
+    return CourseCatalog.from_rows(rows)
+
+
+def test_only_changed_rows_are_embedded_again():
+    embedder = CountingEmbedder()
+    first, embedded = build_embedding_index(catalog(["夜泣き", "離乳食", "英語"]), embedder)
+    assert embedded == 3
+
+    embedder.embedded.clear()
+    second, embedded = build_embedding_index(catalog(["夜泣き", "離乳食の進め方", "英語"]), embedder, previous=first)
+
+    assert embedded == 1
+    assert len(embedder.embedded) == 1
+    assert "離乳食の進め方" in embedder.embedded[0]
+    assert (second.matrix[0] == first.matrix[0]).all()
+    assert (second.matrix[2] == first.matrix[2]).all()
+
+
+def test_different_embedder_recomputes_all_rows():
+    first, _embedded = build_embedding_index(catalog(["夜泣き", "離乳食"]), CountingEmbedder())
+
+    _second, embedded = build_embedding_index(catalog(["夜泣き", "離乳食"]), HashingEmbedder(dimension=32), previous=first)
+
+    assert embedded == 2
+
+
+def test_search_ranks_matching_course_first():
+    index, _embedded = build_embedding_index(catalog(["夜泣きと寝かしつけ", "離乳食の進め方", "英語あそび"]), HashingEmbedder())
+
+    results = index.search(HashingEmbedder().embed(["離乳食"])[0], top_k=2)
+
+    assert results[0][0] == 1
+
+
+def test_failed_save_leaves_no_temporary_files(tmp_path, monkeypatch):
+    from services import embeddings
+
+    index, _embedded = build_embedding_index(catalog(["夜泣き"]), HashingEmbedder(dimension=8))
+
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(embeddings.os, "replace", fail_replace)
+    saved = embeddings.save_embedding_index(index, str(tmp_path / "m.npy"), str(tmp_path / "m.json"))
+
+    assert saved is False
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,37 @@
+"""services/facets.py のテスト"""
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.facets import FacetIndex, extract_facets, parse_age_range
+
+
+def catalog_with_classes(*class_names):
+    rows = [list(COURSE_COLUMNS)]
+    for number, class_name in enumerate(class_names):
+        rows.append(["のびのびコース", class_name, "講師", f"講座{number}", "0〜2歳", "", "", f"https://example.com/{number}"])
+    return CourseCatalog.from_rows(rows)
+
+
+def test_extracts_age_and_topics():
+    facets = extract_facets("1歳半の離乳食が進みません")
+
+    assert facets.age_months == 18
+    assert facets.topics == ("ごはん",)
+
+
+def test_parses_age_ranges():
+    assert parse_age_range("0～6歳") == (0, 83)
+    assert parse_age_range("6ヶ月～2歳") == (6, 35)
+
+
+def test_topics_follow_renamed_classes():
+    index = FacetIndex(catalog_with_classes("離乳食・幼児食クラス", "おやこ英語クラス"))
+
+    assert index.topic_facets["ごはん"] == ["離乳食・幼児食クラス"]
+    assert index.for_topics(("ごはん",)) == frozenset({0})
+
+
+def test_unmatched_topics_are_reported(capsys):
+    index = FacetIndex(catalog_with_classes("おやこ英語クラス"))
+
+    assert "ごはん" in index.unmatched_topics
+    assert "英語" not in index.unmatched_topics
+    assert "ごはん" in capsys.readouterr().out
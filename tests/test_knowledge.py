@@ -0,0 +1,146 @@
+"""services/knowledge.py のテスト"""
+import gc
+
+import pytest
+
+from services.knowledge import MAX_MATCHED_SECTIONS, GuidelineOutline, GuidelineStore
+from services.prompt_builder import select_guideline_block
+
+GUIDELINES = """# ファミリーシップ ガイドライン
+このガイドラインに沿って回答してください。
+
+## 運営方針
+利用者に寄り添い、丁寧に答える。
+
+## お悩みを相談されたら
+講座を2〜3件案内する。
+
+### 【ねんね、寝かしつけ、夜泣きの悩み】
+**夜泣き**が続くときは生活リズムを見直す。**アプリ**の記録機能を案内する。
+
+### 【ご飯・食事の悩み】
+**離乳食**を食べないときは無理をさせない。**アプリ**の記録機能を案内する。
+
+### 【退会手続き】
+**退会**は**アプリ**の設定画面から行う。
+
+### 【ポイント制度】
+**ポイント**は**アプリ**で確認できる。
+"""
+
+SLEEP = "【ねんね、寝かしつけ、夜泣きの悩み】"
+FOOD = "【ご飯・食事の悩み】"
+CANCEL = "【退会手続き】"
+
+
+@pytest.fixture
+def outline():
+    return GuidelineOutline(GUIDELINES)
+
+
+def titles(sections):
+    return [section.title for section in sections]
+
+
+def test_always_on_headings_and_parent_bodies_are_static(outline):
+    static = outline.static_text()
+
+    assert "このガイドラインに沿って回答してください。" in static
+    assert "## 運営方針\n利用者に寄り添い、丁寧に答える。" in static
+    assert "講座を2〜3件案内する。" in static
+    assert "生活リズム" not in static
+    assert SLEEP in static  # 選べる見出しの一覧には載せる
+
+
+def test_always_on_sections_are_never_selected(outline):
+    assert "運営方針" not in titles(outline.select("運営方針を教えて"))
+
+
+def test_selects_matching_section(outline):
+    assert titles(outline.select("夜泣きがひどい")) == [SLEEP]
+    assert titles(outline.select("退会したい")) == [CANCEL]
+
+
+def test_drops_sections_below_relative_score(outline):
+    # 夜泣き（見出しの語）に比べて、アプリ（本文の強調語）だけの一致は関連度が半分未満
+    assert titles(outline.select("夜泣きでアプリを使いたい")) == [SLEEP]
+
+
+def test_limits_number_of_sections(outline):
+    # アプリは4つのセクションに同じ関連度で一致する（同点は文書の順）
+    assert titles(outline.select("アプリの使い方")) == [SLEEP, FOOD, CANCEL][:MAX_MATCHED_SECTIONS]
+    assert titles(outline.select("アプリの使い方", limit=2)) == [SLEEP, FOOD]
+
+
+def test_no_match_adds_no_section_block(outline):
+    assert outline.select("宇宙の話") == []
+    assert outline.select("") == []
+    assert select_guideline_block(GUIDELINES, "宇宙の話", budget=1000) == ("", 0)
+
+
+def test_section_block_includes_parent_path():
+    block, count = select_guideline_block(GUIDELINES, "夜泣きがひどい", budget=1000)
+
+    assert count == 1
+    assert block.startswith("# 質問に関連するガイドライン\n### お悩みを相談されたら > " + SLEEP)
+
+
+def test_unchanged_file_returns_same_document(tmp_path):
+    path = tmp_path / "guidelines.md"
+    path.write_text(GUIDELINES, encoding="utf-8")
+    store = GuidelineStore()
+
+    first = store.load_file(str(path))
+    second = store.load_file(str(path))
+
+    assert first is second
+    assert store.stats()["file_reads"] == 1
+    assert store.stats()["file_hits"] == 1
+
+
+def test_changed_file_is_reloaded_with_new_version(tmp_path):
+    path = tmp_path / "guidelines.md"
+    path.write_text(GUIDELINES, encoding="utf-8")
+    store = GuidelineStore()
+    first = store.load_file(str(path))
+
+    path.write_text(GUIDELINES + "\n### 【新しい項目】\n追加の本文\n", encoding="utf-8")
+    second = store.load_file(str(path))
+
+    assert second.version != first.version
+    assert "追加の本文" in second.text
+    assert store.stats()["file_reads"] == 2
+
+
+def test_same_text_is_shared_while_in_use():
+    store = GuidelineStore()
+
+    first = store.intern(GUIDELINES, "upload")
+    second = store.intern("\n" + GUIDELINES + "\n", "upload")
+
+    assert first is second
+    assert store.stats()["shared"] == 1
+
+
+def test_unused_documents_are_released():
+    store = GuidelineStore()
+    version = store.intern(GUIDELINES).version
+
+    gc.collect()
+
+    assert store.stats()["documents"] == 0
+    assert store.intern(GUIDELINES).version == version
+    assert store.stats()["interned"] == 2
+
+
+def test_loaded_file_stays_interned(tmp_path):
+    path = tmp_path / "guidelines.md"
+    path.write_text(GUIDELINES, encoding="utf-8")
+    store = GuidelineStore()
+    version = store.load_file(str(path)).version
+
+    gc.collect()
+
+    assert store.stats()["documents"] == 1
+    assert store.intern(GUIDELINES).version == version
+    assert store.stats()["shared"] == 1
@@ -0,0 +1,55 @@
+"""services/llm.py の ModelResolver のテスト（偽のGeminiバックエンドを使用）"""
+import os
+
+import pytest
+
+from bench.fake_genai import FakeGenAI, FakeGenAIConfig, use_fake_genai
+from services.llm import ModelResolver
+
+API_KEY = os.environ["GEMINI_API_KEY"]
+
+
+@pytest.fixture
+def fake():
+    with use_fake_genai(FakeGenAI(FakeGenAIConfig(first_chunk_latency=0, chunk_latency=0), seed=0)) as backend:
+        yield backend
+
+
+def test_resolves_once_and_reuses(fake):
+    resolver = ModelResolver(preferred_models=["gemini-2.5-flash", "gemini-1.5-flash"])
+
+    first = resolver.get_model(API_KEY)
+    second = resolver.get_model(API_KEY)
+
+    assert first[0] == "gemini-2.5-flash"
+    assert second[1] is first[1]
+    assert fake.calls["list_models"] == 1
+    assert fake.calls["configure"] == 1
+    assert resolver.stats()["hits"] == 1
+
+
+def test_skips_preferred_models_that_are_not_available(fake):
+    resolver = ModelResolver(preferred_models=["gemini-pro", "gemini-2.0-flash"])
+
+    assert resolver.get_model(API_KEY)[0] == "gemini-2.0-flash"
+
+
+def test_invalidate_resolves_again(fake):
+    resolver = ModelResolver(preferred_models=["gemini-2.5-flash"])
+
+    resolver.get_model(API_KEY)
+    resolver.invalidate()
+    resolver.get_model(API_KEY)
+
+    assert fake.calls["list_models"] == 2
+    assert resolver.stats()["invalidations"] == 1
+
+
+def test_expired_model_is_resolved_again(fake):
+    resolver = ModelResolver(preferred_models=["gemini-2.5-flash"], ttl_seconds=0)
+
+    resolver.get_model(API_KEY)
+    resolver.get_model(API_KEY)
+
+    assert fake.calls["list_models"] == 2
+    assert resolver.stats()["refreshes"] == 1
@@ -0,0 +1,125 @@
+"""services/prompt_builder.py のテスト"""
+import pytest
+
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.knowledge import resolve_guidelines
+from services.prompt_builder import (
+    FEEDBACK_EXCERPT_CHARS,
+    PromptBudget,
+    assemble_prompt,
+    assemble_prompt_parts,
+    estimate_tokens,
+    fit_course_rows,
+)
+
+FEEDBACK = list(COURSE_COLUMNS).index("感想（一部）")
+LONG_FEEDBACK = "とても参考になりました。" * 30
+
+
+@pytest.fixture
+def courses():
+    rows = [list(COURSE_COLUMNS)] + [
+        ["ベビーコース", "ねんねクラス", "山田", f"夜泣き講座{n}", "0〜1歳", "夜泣きの内容", LONG_FEEDBACK, f"https://example.com/{n}"]
+        for n in range(4)
+    ]
+    return CourseCatalog.from_rows(rows).courses
+
+
+def test_keeps_everything_within_budget(courses):
+    rows, metrics = fit_course_rows(courses, 10 ** 6)
+
+    assert [row[FEEDBACK] for row in rows] == [LONG_FEEDBACK] * 4
+    assert metrics.courses_included == 4
+    assert metrics.feedback_trimmed == metrics.courses_dropped == 0
+
+
+def test_shortens_feedback_of_lowest_ranked_courses_first(courses):
+    untouched, _ = fit_course_rows(courses, 10 ** 6)
+    budget = sum(estimate_tokens("".join(row)) + len(row) for row in untouched + [list(COURSE_COLUMNS)]) - 1
+
+    rows, metrics = fit_course_rows(courses, budget)
+
+    assert [row[FEEDBACK] for row in rows[:3]] == [LONG_FEEDBACK] * 3
+    assert rows[3][FEEDBACK] == LONG_FEEDBACK[:FEEDBACK_EXCERPT_CHARS] + "…"
+    assert metrics.feedback_trimmed == 1
+    assert metrics.courses_included == 4
+
+
+def test_drops_feedback_after_shortening_all(courses):
+    all_shortened = sum(
+        estimate_tokens("".join(row)) + len(row)
+        for row in [list(COURSE_COLUMNS)] + [
+            course.as_row()[:FEEDBACK] + [LONG_FEEDBACK[:FEEDBACK_EXCERPT_CHARS] + "…"] + course.as_row()[FEEDBACK + 1:]
+            for course in courses
+        ]
+    )
+
+    rows, metrics = fit_course_rows(courses, all_shortened - 1)
+
+    assert rows[3][FEEDBACK] == ""
+    assert rows[0][FEEDBACK] == LONG_FEEDBACK[:FEEDBACK_EXCERPT_CHARS] + "…"
+    assert metrics.courses_included == 4
+    assert metrics.feedback_trimmed == 4
+
+
+def test_drops_lowest_ranked_courses_last(courses):
+    rows, metrics = fit_course_rows(courses, 120)
+
+    assert 0 < len(rows) < 4
+    assert [row[3] for row in rows] == [f"夜泣き講座{n}" for n in range(len(rows))]
+    assert all(row[FEEDBACK] == "" for row in rows)
+    assert metrics.courses_dropped == 4 - len(rows)
+    assert estimate_tokens("".join(list(COURSE_COLUMNS) + sum(rows, []))) <= 120
+
+
+def test_drops_all_courses_when_budget_is_zero(courses):
+    rows, metrics = fit_course_rows(courses, 0)
+
+    assert rows == []
+    assert metrics.courses_dropped == 4
+
+
+@pytest.mark.parametrize("structured", [False, True])
+def test_assembled_prompt_stays_within_total(courses, structured):
+    guidelines = resolve_guidelines()
+    _prefix, _request, one_course = assemble_prompt_parts(
+        "夜泣きがつらい", courses[:1], guidelines, structured=structured
+    )
+    budget = PromptBudget(total=one_course.total_tokens + 40)
+
+    prefix, request_part, metrics = assemble_prompt_parts(
+        "夜泣きがつらい", courses, guidelines, budget, structured=structured
+    )
+
+    assert metrics.total_tokens <= budget.total
+    assert metrics.courses_included > 0
+    assert metrics.feedback_trimmed or metrics.courses_dropped
+    assert "夜泣き講座0" in request_part
+
+
+def test_prefix_is_shared_and_question_goes_in_request_part(courses):
+    guidelines = resolve_guidelines()
+
+    first_prefix, first_request, _ = assemble_prompt_parts("夜泣きがつらい", courses, guidelines)
+    second_prefix, second_request, _ = assemble_prompt_parts("離乳食を食べない", courses, guidelines)
+
+    assert first_prefix == second_prefix
+    assert "夜泣きがつらい" in first_request and "夜泣きがつらい" not in first_prefix
+    assert "離乳食を食べない" in second_request
+
+
+def test_truncates_long_user_input(courses):
+    prompt, metrics = assemble_prompt("あ" * 50 + "\n" + "い" * 50, courses, resolve_guidelines(), PromptBudget(user_input=60))
+
+    assert metrics.user_input_truncated
+    assert "い" * 50 not in prompt
+
+
+@pytest.mark.parametrize("structured", [False, True])
+def test_no_matching_courses_asks_for_general_advice(structured):
+    _prefix, request_part, metrics = assemble_prompt_parts("退会したい", [], resolve_guidelines(), structured=structured)
+
+    assert "該当する講座はありませんでした" in request_part
+    assert "2〜3件" not in request_part
+    assert "講座データベース（CSV形式" not in request_part
+    assert metrics.courses_included == 0
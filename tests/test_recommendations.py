@@ -0,0 +1,84 @@
+"""services/recommendations.py のテスト"""
+import json
+
+import pytest
+
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.recommendations import MAX_RECOMMENDATIONS, parse_structured_answer, salvage_empathy
+
+
+@pytest.fixture
+def catalog():
+    rows = [list(COURSE_COLUMNS)] + [
+        ["ベビーコース", "ねんねクラス", "山田", f"講座{n}", "0〜1歳", "内容", "感想", f"https://example.com/{n}"]
+        for n in range(5)
+    ]
+    return CourseCatalog.from_rows(rows)
+
+
+def answer_json(course_ids, empathy="つらいですよね。"):
+    return json.dumps({
+        "empathy": empathy,
+        "recommendations": [{"course_id": course_id, "reason": "理由"} for course_id in course_ids],
+        "closing": "応援しています。",
+    }, ensure_ascii=False)
+
+
+def ids(catalog):
+    return [course.course_id for course in catalog]
+
+
+def test_parses_valid_answer(catalog):
+    answer = parse_structured_answer(answer_json(ids(catalog)[:2]), catalog)
+
+    assert answer.empathy == "つらいですよね。"
+    assert [item.course_id for item in answer.recommendations] == ids(catalog)[:2]
+    assert answer.closing == "応援しています。"
+    assert answer.dropped == 0
+
+
+def test_drops_unknown_ids(catalog):
+    answer = parse_structured_answer(answer_json(["unknown", ids(catalog)[0]]), catalog)
+
+    assert [item.course_id for item in answer.recommendations] == ids(catalog)[:1]
+    assert answer.dropped == 1
+
+
+def test_drops_duplicate_ids(catalog):
+    first = ids(catalog)[0]
+    answer = parse_structured_answer(answer_json([first, first]), catalog)
+
+    assert [item.course_id for item in answer.recommendations] == [first]
+    assert answer.dropped == 1
+
+
+def test_drops_surplus_ids(catalog):
+    answer = parse_structured_answer(answer_json(ids(catalog)), catalog)
+
+    assert len(answer.recommendations) == MAX_RECOMMENDATIONS
+    assert answer.dropped == len(catalog) - MAX_RECOMMENDATIONS
+
+
+def test_accepts_code_fences(catalog):
+    text = "```json\n" + answer_json(ids(catalog)[:1]) + "\n```"
+
+    answer = parse_structured_answer(text, catalog)
+
+    assert [item.course_id for item in answer.recommendations] == ids(catalog)[:1]
+
+
+@pytest.mark.parametrize("text", [
+    '{"empathy": "つらいですよね。", "recommendations": [',
+    "夜泣きには講座1がおすすめです。",
+    '{"empathy": "", "recommendations": []}',
+    "[]",
+])
+def test_returns_none_for_unusable_answers(catalog, text):
+    assert parse_structured_answer(text, catalog) is None
+
+
+def test_salvages_empathy_from_broken_json():
+    text = '{"empathy": "つらいですよね。\\n眠れていますか？", "recommendations": [{"course_id": "ab'
+
+    assert salvage_empathy(text) == "つらいですよね。\n眠れていますか？"
+    assert salvage_empathy('{"empathy": "途中で切れ') == ""
@@ -0,0 +1,51 @@
+"""services/response_cache.py のテスト"""
+from services.response_cache import ResponseCache, content_version, normalize_question
+
+VERSION = content_version("catalog-v1", "guidelines-v1")
+
+
+def test_normalization_absorbs_width_case_and_punctuation():
+    assert normalize_question("ＡＢＣ の 講座は？") == normalize_question("abcの講座は")
+
+
+def test_hit_on_normalized_question():
+    cache = ResponseCache()
+    cache.put("夜泣きに効く講座を教えて", VERSION, "回答")
+
+    assert cache.get("夜泣きに効く講座を教えて！", VERSION) == "回答"
+    assert cache.stats()["hits"] == 1
+
+
+def test_version_change_misses():
+    cache = ResponseCache()
+    cache.put("夜泣きに効く講座を教えて", VERSION, "回答")
+
+    assert cache.get("夜泣きに効く講座を教えて", content_version("catalog-v2", "guidelines-v1")) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_similar_question_hits_but_different_numbers_do_not():
+    cache = ResponseCache(similarity_threshold=0.8)
+    cache.put("3ヶ月の赤ちゃんの夜泣きに効く講座を教えてください", VERSION, "3ヶ月向け")
+
+    assert cache.get("3ヶ月の赤ちゃんの夜泣きに効く講座を教えて下さい", VERSION) == "3ヶ月向け"
+    assert cache.get("5ヶ月の赤ちゃんの夜泣きに効く講座を教えてください", VERSION) is None
+
+
+def test_expired_entries_are_not_returned():
+    cache = ResponseCache(ttl_seconds=0)
+    cache.put("夜泣きに効く講座を教えて", VERSION, "回答")
+
+    assert cache.get("夜泣きに効く講座を教えて", VERSION) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, similarity_threshold=None)
+    cache.put("質問いち", VERSION, "1")
+    cache.put("質問に", VERSION, "2")
+    cache.get("質問いち", VERSION)
+    cache.put("質問さん", VERSION, "3")
+
+    assert cache.get("質問に", VERSION) is None
+    assert cache.get("質問いち", VERSION) == "1"
+    assert cache.stats()["evictions"] == 1
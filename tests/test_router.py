@@ -0,0 +1,73 @@
+"""services/router.py のテスト"""
+import time
+
+import pytest
+
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.router import PATH_FAST, PATH_LLM, PATH_MISS, QueryRouter
+
+
+def row(title, instructor, class_name, n):
+    return ["ベビーコース", class_name, instructor, title, "0〜1歳", "内容", "感想", f"https://example.com/{n}"]
+
+
+@pytest.fixture
+def catalog():
+    rows = [row(f"発達あそび{n}", "かなこ", "発達あそびクラス", n) for n in range(5)]
+    rows += [
+        row("卒乳・断乳講座", "助産師あやの", "-", 10),
+        row("おっぱいケア講座", "助産師あやの", "-", 11),
+        row("はじめての絵本", "にぐ", "知育あそびクラス", 12),
+    ]
+    return CourseCatalog.from_rows([list(COURSE_COLUMNS)] + rows)
+
+
+def test_title_match_answers_with_course_url(catalog):
+    router = QueryRouter()
+
+    answer = router.route("卒乳・断乳講座はどこ？", catalog)
+
+    assert "【卒乳・断乳講座】" in answer
+    assert "https://example.com/10" in answer
+    assert "おっぱいケア講座" not in answer
+
+
+def test_specific_instructor_match_lists_their_courses(catalog):
+    answer = QueryRouter().route("助産師あやのさんの講座を見たい", catalog)
+
+    assert "https://example.com/10" in answer and "https://example.com/11" in answer
+
+
+def test_ambiguous_instructor_match_goes_to_llm(catalog):
+    # かなこ先生の講座は5件あり、どれを探しているか決められない
+    assert QueryRouter().route("かなこ先生の講座はどこ？", catalog) is None
+
+
+def test_short_name_is_not_matched(catalog):
+    assert QueryRouter().route("にぐ先生の講座はどこ？", catalog) is None
+
+
+def test_non_navigational_question_goes_to_llm(catalog):
+    assert QueryRouter().route("卒乳・断乳講座の内容で悩んでいます", catalog) is None
+
+
+def test_records_latency_for_hits_and_misses(catalog):
+    router = QueryRouter()
+
+    router.route("卒乳・断乳講座はどこ？", catalog)
+    router.route("夜泣きがつらい", catalog)
+    router.record(PATH_LLM, 0.5)
+    stats = router.stats()
+
+    assert stats[PATH_FAST]["requests"] == 1
+    assert stats[PATH_MISS]["requests"] == 1
+    assert stats[PATH_LLM]["requests"] == 1
+    assert stats["fast_path_rate"] == 0.5
+
+
+def test_llm_latency_includes_routing_time():
+    router = QueryRouter()
+
+    list(router.timed(PATH_LLM, iter(["回答"]), started=time.perf_counter() - 1.0))
+
+    assert router.stats()[PATH_LLM]["max_ms"] >= 1000
@@ -0,0 +1,44 @@
+"""services/search.py のテスト"""
+import pytest
+
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.search import CourseSearchIndex, tokenize
+
+
+@pytest.fixture
+def catalog():
+    rows = [list(COURSE_COLUMNS)]
+    for title, content in [
+        ("夜泣き対策講座", "夜泣きの原因と対処"),
+        ("離乳食の進め方", "初期の離乳食の作り方"),
+        ("寝かしつけのコツ", "夜泣きにも効く寝かしつけ"),
+        ("おやこ英語", "英語の歌であそぶ"),
+    ]:
+        rows.append(["コース", "クラス", "講師", title, "0〜2歳", content, "", f"https://example.com/{title}"])
+    return CourseCatalog.from_rows(rows)
+
+
+def titles(catalog, results):
+    return [catalog.courses[position].title for position, _score in results]
+
+
+def test_tokenize_normalizes_width_and_case():
+    assert tokenize("ＡＢ ｃ") == ["ab", "c"]
+    assert tokenize("夜泣き") == ["夜泣", "泣き"]
+
+
+def test_ranks_title_match_first(catalog):
+    results = CourseSearchIndex(catalog).search("夜泣きがつらい", top_k=3)
+
+    assert titles(catalog, results) == ["夜泣き対策講座", "寝かしつけのコツ"]
+    assert results[0][1] > results[1][1] > 0
+
+
+def test_respects_allowed_positions(catalog):
+    results = CourseSearchIndex(catalog).search("夜泣き", allowed={2, 3})
+
+    assert titles(catalog, results) == ["寝かしつけのコツ"]
+
+
+def test_no_overlap_returns_nothing(catalog):
+    assert CourseSearchIndex(catalog).search("退会したい") == []
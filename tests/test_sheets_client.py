@@ -0,0 +1,163 @@
+"""services/sheets_client.py のテスト（スタブの gspread / Drive クライアントを使用）"""
+import sys
+import types
+
+import pytest
+
+from services import sheets, sheets_client
+from services.catalog import COURSE_COLUMNS
+from services.sheets import FETCH_UNCHANGED, FETCH_UPDATED, fetch_from_google_sheets
+from services.sheets_client import SheetsClientManager
+
+SHEETS_ID = "sheet-id"
+HEADER = list(COURSE_COLUMNS)
+ROW = ["ベビーコース", "ねんねクラス", "山田", "夜泣き講座", "0〜1歳", "内容", "感想", "https://example.com/a"]
+
+
+class StubWorksheet:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_all_values(self):
+        self.backend.calls.append("get_all_values")
+        return [HEADER, ROW]
+
+    def get(self, range_name):
+        self.backend.calls.append(f"get {range_name}")
+        return [HEADER, ROW]
+
+
+class StubLegacyClient:
+    """gspread 5.x のクライアント（Drive API を request で呼ぶ）"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_by_key(self, key):
+        self.backend.calls.append("open_by_key")
+        if self.backend.open_errors:
+            raise self.backend.open_errors.pop(0)
+        return types.SimpleNamespace(sheet1=StubWorksheet(self.backend))
+
+    def request(self, method, url, params=None):
+        self.backend.calls.append(f"request {url} {params['fields']}")
+        return types.SimpleNamespace(json=lambda: {"modifiedTime": self.backend.modified_time})
+
+
+class StubClient(StubLegacyClient):
+    """gspread 6.x のクライアント（get_file_drive_metadata を持つ）"""
+
+    def get_file_drive_metadata(self, key):
+        self.backend.calls.append("drive_metadata")
+        if self.backend.drive_errors:
+            raise self.backend.drive_errors.pop(0)
+        return {"modifiedTime": self.backend.modified_time}
+
+
+class StubBackend:
+    def __init__(self, client_class=StubClient):
+        self.client_class = client_class
+        self.calls = []
+        self.authorizations = 0
+        self.open_errors = []
+        self.drive_errors = []
+        self.modified_time = "2026-10-01T00:00:00Z"
+
+    def authorize(self, credentials):
+        self.authorizations += 1
+        return self.client_class(self)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = StubBackend()
+    gspread = types.ModuleType("gspread")
+    gspread.authorize = lambda credentials: backend.authorize(credentials)
+    service_account = types.ModuleType("google.oauth2.service_account")
+    service_account.Credentials = types.SimpleNamespace(
+        from_service_account_info=lambda info, scopes: ("credentials", info["client_email"])
+    )
+    monkeypatch.setitem(sys.modules, "gspread", gspread)
+    monkeypatch.setitem(sys.modules, "google.oauth2.service_account", service_account)
+    monkeypatch.setattr(sheets_client, "get_google_sheets_credentials", lambda: {"client_email": "a@example.com"})
+    return backend
+
+
+def test_authorizes_once_and_reuses_client(backend):
+    manager = SheetsClientManager()
+
+    manager.get_revision(SHEETS_ID)
+    manager.fetch_values(SHEETS_ID, HEADER)
+    manager.fetch_values(SHEETS_ID, HEADER)
+
+    assert backend.authorizations == 1
+    assert backend.calls.count("open_by_key") == 1
+    assert manager.stats()["authorizations"] == 1
+
+
+def test_second_fetch_narrows_to_used_columns(backend):
+    manager = SheetsClientManager()
+
+    manager.fetch_values(SHEETS_ID, HEADER)
+    values = manager.fetch_values(SHEETS_ID, HEADER)
+
+    assert values == [HEADER, ROW]
+    assert backend.calls[-1] == "get A1:H"
+
+
+def test_revision_is_read_from_drive_each_time(backend):
+    manager = SheetsClientManager()
+
+    assert manager.get_revision(SHEETS_ID) == "2026-10-01T00:00:00Z"
+    backend.modified_time = "2026-10-02T00:00:00Z"
+    assert manager.get_revision(SHEETS_ID) == "2026-10-02T00:00:00Z"
+    assert backend.calls.count("drive_metadata") == 2
+
+
+def test_revision_with_gspread_5_uses_drive_api(backend):
+    backend.client_class = StubLegacyClient
+    manager = SheetsClientManager()
+
+    assert manager.get_revision(SHEETS_ID) == "2026-10-01T00:00:00Z"
+    assert backend.calls == [f"request https://www.googleapis.com/drive/v3/files/{SHEETS_ID} modifiedTime"]
+
+
+def test_auth_failure_resets_and_retries_once(backend):
+    backend.open_errors = [PermissionError("token expired")]
+    manager = SheetsClientManager()
+
+    values = manager.fetch_values(SHEETS_ID)
+
+    assert values == [HEADER, ROW]
+    assert backend.authorizations == 2
+    assert manager.stats()["resets"] == 1
+
+
+def test_second_failure_is_raised(backend):
+    backend.open_errors = [PermissionError("token expired"), PermissionError("still denied")]
+    manager = SheetsClientManager()
+
+    with pytest.raises(PermissionError):
+        manager.fetch_values(SHEETS_ID)
+    assert backend.authorizations == 2
+
+
+def test_revision_failure_returns_none(backend):
+    backend.drive_errors = [PermissionError("denied"), PermissionError("denied")]
+
+    assert SheetsClientManager().get_revision(SHEETS_ID) is None
+
+
+def test_unchanged_revision_skips_download(backend, monkeypatch):
+    manager = SheetsClientManager()
+    monkeypatch.setattr(sheets, "get_sheets_client_manager", lambda: manager)
+    monkeypatch.setattr(sheets, "get_google_sheets_id", lambda: SHEETS_ID)
+
+    status, catalog, revision = fetch_from_google_sheets()
+    assert status == FETCH_UPDATED and len(catalog) == 1
+    backend.calls.clear()
+
+    status, catalog, revision = fetch_from_google_sheets(known_revision=revision)
+
+    assert status == FETCH_UNCHANGED and catalog is None
+    assert backend.calls == ["drive_metadata"]
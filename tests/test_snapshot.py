@@ -0,0 +1,67 @@
+"""services/snapshot.py のテスト"""
+import os
+import pickle
+
+import pytest
+
+from services import snapshot
+from services.catalog import COURSE_COLUMNS, CourseCatalog
+from services.search import get_search_index
+from services.snapshot import FORMAT_VERSION, load_snapshot, save_snapshot
+
+
+@pytest.fixture
+def catalog():
+    rows = [list(COURSE_COLUMNS)] + [
+        ["ベビーコース", "ねんねクラス", "山田", f"夜泣き講座{n}", "0〜1歳", "夜泣きの内容", "感想", f"https://example.com/{n}"]
+        for n in range(3)
+    ]
+    return CourseCatalog.from_rows(rows, source="google_sheets")
+
+
+def test_round_trip_restores_catalog_and_index(tmp_path, catalog):
+    path = str(tmp_path / "courses.snapshot")
+
+    assert save_snapshot(catalog, "r1", path) is True
+    restored, revision = load_snapshot(path)
+
+    assert revision == "r1"
+    assert restored.version == catalog.version
+    assert restored.source == "google_sheets"
+    assert [course.course_id for course in restored] == [course.course_id for course in catalog]
+    assert [course.as_row() for course in restored] == [course.as_row() for course in catalog]
+    assert get_search_index(restored).search("夜泣き", 1)
+    assert os.listdir(tmp_path) == ["courses.snapshot"]
+
+
+def test_missing_file_returns_none(tmp_path):
+    assert load_snapshot(str(tmp_path / "missing.snapshot")) is None
+
+
+@pytest.mark.parametrize("content", [
+    b"",
+    b"not a snapshot",
+    snapshot._MAGIC + bytes([FORMAT_VERSION + 1]) + pickle.dumps({}),
+    snapshot._MAGIC + bytes([FORMAT_VERSION]) + b"\x80broken pickle",
+    snapshot._MAGIC + bytes([FORMAT_VERSION]) + pickle.dumps({"courses": []}),
+])
+def test_corrupt_or_old_format_is_rejected(tmp_path, content):
+    path = tmp_path / "courses.snapshot"
+    path.write_bytes(content)
+
+    assert load_snapshot(str(path)) is None
+
+
+def test_failed_save_keeps_previous_file(tmp_path, catalog, monkeypatch):
+    path = str(tmp_path / "courses.snapshot")
+    save_snapshot(catalog, "r1", path)
+
+    def fail_dump(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(snapshot.pickle, "dump", fail_dump)
+
+    assert save_snapshot(catalog, "r2", path) is False
+    assert os.listdir(tmp_path) == ["courses.snapshot"]
+    monkeypatch.undo()
+    assert load_snapshot(path)[1] == "r1"